@@ -1,11 +1,19 @@
 import youtube_dl
-import subprocess
+from youtube_dl.postprocessor.common import PostProcessor
 import os
-from models import TopicFile, session, Playlist
+import shutil
+import time
+import threading
+import collections
+from concurrent.futures import Future
+from models import TopicFile, Session, session, Playlist
+from transcript_search import index_topic
+from rate_converter import RateConverter, MIN_RATE, MAX_RATE
+from waveform import peak_indexer
 from config import (TOPICFILES_DIR,
                     ARCHIVE_FILE)
 import logging
-from typing import List
+from typing import List, Dict, Callable, Deque, Optional, Sequence, Tuple
 
 
 logger = logging.getLogger(__name__)
@@ -22,6 +30,37 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
+# Concurrent playlist downloads.
+DOWNLOAD_WORKERS = 3
+# Downloads a playlist gets before the next playlist's turn.
+DOWNLOAD_FAIR_SHARE = 1
+# Bytes per second shared by all downloads, None for no limit.
+DOWNLOAD_BANDWIDTH_LIMIT = None
+# Bytes a get_new_playlist_items run may download, None for no limit.
+DOWNLOAD_DISK_BUDGET = None
+# Don't start downloads with less free space than this in TOPICFILES_DIR.
+DOWNLOAD_MIN_FREE_DISK = 500 * 1024 * 1024
+
+
+class YdlLogger(object):
+
+    """Sends youtube_dl's messages to the module logger and remembers the
+    last error, which ignoreerrors would otherwise swallow.
+    """
+
+    def __init__(self):
+        self.last_error: Optional[str] = None
+
+    def debug(self, msg: str) -> None:
+        logger.debug(msg)
+
+    def warning(self, msg: str) -> None:
+        logger.warning(msg)
+
+    def error(self, msg: str) -> None:
+        logger.error(msg)
+        self.last_error = msg
+
 
 class AudioDownloader(object):
 
@@ -30,17 +69,29 @@ class AudioDownloader(object):
 
     def __init__(self,
                  yt_id: str,
-                 config=None,
                  language: str = 'en',
                  sm_element_id: int = -1,
                  sm_priority: float = -1,
                  playback_rate: float = 1.0,
-                 max_downloads: int = 1):
+                 max_downloads: int = 1,
+                 ydl_options: Optional[Dict] = None,
+                 progress_hooks: Sequence[Callable] = (),
+                 extractors: Sequence[type] = (),
+                 db=None,
+                 converter: Optional[RateConverter] = None):
         """
         :url: Url of the youtube video.
         :playback_rate: Desired playback rate for the audio track.
         :sm_element_id: the parent element extracts can be added under.
         :sm_priority: The priority of extracts exported into SM.
+        :ydl_options: Extra youtube_dl options eg. outtmpl or ratelimit.
+        :progress_hooks: Extra youtube_dl progress hooks.
+        :extractors: InfoExtractor classes tried before youtube_dl's own,
+        eg. a fake extractor for local testing.
+        :db: SQLAlchemy session to add TopicFiles with. Threads other than
+        the main one must pass their own.
+        :converter: RateConverter for playback rate changes, shared eg. by
+        DownloadScheduler workers. One is started if needed.
         """
 
         self.yt_id = yt_id
@@ -49,10 +100,11 @@ class AudioDownloader(object):
         self.playback_rate = playback_rate
         self.sm_element_id = sm_element_id
         self.sm_priority = sm_priority
+        self.ydl_logger = YdlLogger()
         self.ydl_options = {
                 'format': 'worstaudio/worst',
-                # 'logger': logger(),
-                'progress_hooks': [self.finished_hook],
+                'logger': self.ydl_logger,
+                'progress_hooks': [],
                 'download_archive': ARCHIVE_FILE,
                 'writesubtitles': True,
                 'writeautomaticsub': True,
@@ -62,138 +114,132 @@ class AudioDownloader(object):
                 'outtmpl': os.path.join(TOPICFILES_DIR, '%(id)s.%(ext)s'),
                 'max_downloads': max_downloads
         }
-        
-        # For Flask API downloads
-        if config:
-            self.config = config
-            self.ydl_options["progress_hooks"].append(self.download_progress_hook)
-
-        # Playlist information
-        self.is_playlist = False
-        self.playlist_id = None
-
-    def check_is_playlist(self, id: str) -> None:
-        """Get ydl info dict for youtube id to check whether it is a playlist or video.
-        """
-        with youtube_dl.YoutubeDL({}) as ydl:
-            info_dict = ydl.extract_info(id, download=False, process=False)
-            if info_dict.get("_type") == "playlist":
-                self.is_playlist = True
-                self.playlist_uploader_id = info_dict["uploader_id"]
-                self.playlist_id = info_dict["id"]
-                self.playlist_title = info_dict["title"]
-            else:
-                self.is_playlist = False
+        self.ydl_options.update(ydl_options or {})
+        self.ydl_options["progress_hooks"].extend(progress_hooks)
+        self.extractors = extractors
+        self.db = db or session
+        self.converter = converter
+        self._own_converter = False
+        # (conversion future, filepath, info dict) of downloads waiting
+        # for their playback rate change.
+        self.converting: List[Tuple[Future, str, Dict]] = []
 
-    def download_progress_hook(self, target):
-        """Update app.config['updated']
+        # Statistics of the last download()
+        self.extractor_calls = 0
+        self.downloads = 0
+        self.error: Optional[str] = None
+
+    def make_ydl(self, options: Dict) -> "CountingYoutubeDL":
+        """
+        :returns: YoutubeDL trying self.extractors before the built in
+        extractors.
         """
-        if target['status'] == 'downloading':
-            if target.get('downloaded_bytes') and target.get('total_bytes'):
-                if (target['downloaded_bytes'] / target['total_bytes']) != self.config['progress']:
-                    self.config['updated'] = True
-                    self.config["progress"] = int(target['downloaded_bytes'] / target['total_bytes'] * 100)
-                    print('\n\n' + str(self.config["progress"]) + "%" + '\n\n')
-        
-        elif target['status'] == "error":
-            self.config["updated"] = True
-            self.config["error"] = True
-        
-        elif target['status'] == 'finished':
-            self.config['updated'] = True
-            self.config['progress'] = 100
+        ydl = CountingYoutubeDL(options, auto_init=False)
+        for extractor in self.extractors:
+            ydl.add_info_extractor(extractor())
+        ydl.add_default_info_extractors()
+        return ydl
 
     def download(self) -> None:
         """Download a youtube video's audio.
+
+        The info dicts resolved for the download are handed to
+        add_topicfile by a TopicFilePostProcessor, so every video is
+        extracted exactly once.
         """
-        self.check_is_playlist(self.yt_id)
+        self.extractor_calls = 0
+        self.downloads = 0
+        self.error = None
+        self.ydl_logger.last_error = None
+        ydl = self.make_ydl(self.ydl_options)
+        ydl.add_post_processor(TopicFilePostProcessor(self))
         try:
-            with youtube_dl.YoutubeDL(self.ydl_options) as ydl:
+            with ydl:
                 ydl.download([self.yt_id])
+        except youtube_dl.utils.MaxDownloadsReached:
+            logger.info(f"Downloaded {self.max_downloads} new files "
+                        f"from {self.yt_id}.")
         except youtube_dl.utils.DownloadError as e:
             logger.error(f"Attempt to download {self.yt_id} failed with "
                          f"exception {e}")
+            self.error = str(e)
+        finally:
+            self.add_converted(wait=True)
+            if self._own_converter:
+                self.converter.shutdown()
+                self.converter = None
+                self._own_converter = False
+            self.extractor_calls = ydl.extractor_calls
+            self.error = self.error or self.ydl_logger.last_error
+            logger.info(f"{self.yt_id}: {self.extractor_calls} extractor "
+                        f"calls for {self.downloads} downloads.")
 
-    def set_playback_rate(self, filepath: str) -> bool:
-        """Make a subprocess call to ffmpeg to set the playback rate.
-
-        :filepath: The path to the downloaded audio file.
-        :returns: True on success else False
+    def valid_playback_rate(self) -> bool:
+        """
+        :returns: True if files can be converted to the playback rate.
         """
-        # ffmpeg limited to range between 0.5 and 2
-        if self.playback_rate < 0.5 or self.playback_rate > 2:
+        if not MIN_RATE <= self.playback_rate <= MAX_RATE:
             logger.error(f"Requested playback rate was {self.playback_rate}, "
-                         "but ffmpeg can only set playback rate "
-                         "between 0.5 and 2.")
+                         f"but the playback rate must be between {MIN_RATE} "
+                         f"and {MAX_RATE}.")
             return False
-        if os.path.isfile(filepath):
-            try:
-                temp_dir_name = os.path.dirname(filepath)
-                tmp_name, tmp_ext = os.path.splitext(os.path.basename(filepath))
-                temp_file_name = tmp_name + ".tmp" + tmp_ext
-                temp_output_file = os.path.join(temp_dir_name, temp_file_name)
-                p = subprocess.call(['ffmpeg',
-                                     '-i',
-                                     filepath,
-                                     '-filter:a',
-                                     f"atempo={str(self.playback_rate)}",
-                                     '-vn',
-                                     temp_output_file])
-
-                if p != 0:
-                    logger.error("Subprocess call to ffmpeg to "
-                                 "change the playback rate failed.")
-                    return False
-                # success, remove filepath, rename tmp to filepath
-                try:
-                    os.remove(filepath)
-                    os.rename(temp_output_file, filepath)
-                except OSError as e:
-                    logger.error("Attempt to clean up temp files after "
-                                 "changing playback rate failed with "
-                                 f"exception {e}")
-                    return False
-                
-                return True
-
-            except OSError as e:
-                logger.error(f"Subprocess call to ffmpeg failed with "
-                             f"exception {e}")
-                return False
-
-    def finished_hook(self, target):
+        return True
+
+    def finished(self, info: Dict) -> None:
         """Runs after each successful download.
+
+        Files needing a playback rate change are converted by the
+        RateConverter while youtube_dl downloads the next file. They are
+        added to the DB, and counted in self.downloads, once converted.
+
+        :info: youtube_dl info dict of the downloaded video.
         """
+        filepath = info['filepath']
+        # Check filepath exists.
 
-        if target['status'] == 'finished':
-            filepath = target['filename']
-            # Check filepath exists.
-
-            if os.path.isfile(filepath):
-                if self.playback_rate != 1:
-                    if self.set_playback_rate(filepath):
-                        self.add_topicfile(filepath)
-                        return
-                    else:
-                        logger.error("Call to set_playback_rate failed.")
-                        return
-                self.add_topicfile(filepath)
+        if os.path.isfile(filepath):
+            if self.playback_rate != 1:
+                if self.valid_playback_rate():
+                    if self.converter is None:
+                        self.converter = RateConverter()
+                        self._own_converter = True
+                    future = self.converter.submit(filepath,
+                                                   self.playback_rate)
+                    self.converting.append((future, filepath, info))
+                    self.add_converted()
                 return
+            self.add_topicfile(filepath, info)
+            return
+        else:
+            logger.error(f"Downloaded audio file {filepath} "
+                         "does not exist.")
+            return
+
+    def add_converted(self, wait: bool = False) -> None:
+        """Add the downloads whose playback rate conversion has finished
+        to the DB.
+
+        :wait: Wait for all conversions.
+        """
+        still_converting = []
+        for future, filepath, info in self.converting:
+            if not (wait or future.done()):
+                still_converting.append((future, filepath, info))
+                continue
+            returncode, error = future.result()
+            if returncode == 0:
+                self.add_topicfile(filepath, info)
             else:
-                logger.error(f"Downloaded audio file {filepath} "
-                             "does not exist.")
-                return
-    
-    def add_topicfile(self, filepath: str):
-        """Extract data and add to DB as a new TopicFile.
+                logger.error(f"Changing the playback rate of {filepath} "
+                             f"failed with exit code {returncode}: {error}")
+        self.converting = still_converting
+
+    def add_topicfile(self, filepath: str, info: Dict):
+        """Add a downloaded video to DB as a new TopicFile.
         :filepath: Audio filepath.
+        :info: youtube_dl info dict of the video.
         """
 
-        with youtube_dl.YoutubeDL({}) as ydl:
-            # find individual video id - depends on filename being id.ext
-            video_id = os.path.splitext(os.path.basename(filepath))[0]
-            info = ydl.extract_info(video_id, download=False)
-
         if info:
             topic: TopicFile = TopicFile(filepath=filepath,
                                          title=info["title"],
@@ -217,63 +263,408 @@ class AudioDownloader(object):
             if os.path.exists(subs_file):
                 topic.transcript_filepath = subs_file
 
-            if self.is_playlist:
-                if self.playlist_id:
+            # youtube_dl adds the playlist fields to playlist entries
+            playlist_id = info.get("playlist_id")
+            if playlist_id:
 
-                    # Search for existing playlist in DB
-                    # Don't add new playlists here
-                    playlist: Playlist = (session
-                                          .query(Playlist)
-                                          .filter_by(playlist_id=self.playlist_id)
-                                          .one_or_none())
+                # Search for existing playlist in DB
+                # Don't add new playlists here
+                playlist: Playlist = (self.db
+                                      .query(Playlist)
+                                      .filter_by(playlist_id=playlist_id)
+                                      .one_or_none())
+                if playlist:
                     # Inherit the playlist's language and priority
                     topic.sm_priority = playlist.sm_priority
                     topic.language = playlist.language
                     playlist.topics.append(topic)
 
-                    #if not playlist:
-                    #    playlist = Playlist(playlist_id=self.playlist_id,
-                    #                        title=self.playlist_title,
-                    #                        language=self.language,
-                    #                        outstanding_target=self.max_downloads,
-                    #                        uploader_id=self.playlist_uploader_id)
-                    #    playlist.topics.append(topic)
-                    #    session.add(playlist)
+                #if not playlist:
+                #    playlist = Playlist(playlist_id=playlist_id,
+                #                        title=info["playlist_title"],
+                #                        language=self.language,
+                #                        outstanding_target=self.max_downloads,
+                #                        uploader_id=info["playlist_uploader_id"])
+                #    playlist.topics.append(topic)
+                #    session.add(playlist)
             
-            session.add(topic)
-            session.commit()
+            self.db.add(topic)
+            self.db.commit()
+            self.downloads += 1
             logger.info(f"Successfully added {topic} to DB.")
+            peak_indexer.submit(topic.filepath)
+
+            if topic.transcript_filepath:
+                try:
+                    index_topic(self.db, topic)
+                    self.db.commit()
+                except Exception as e:
+                    self.db.rollback()
+                    logger.error(f"Indexing the transcript of {topic} "
+                                 f"failed with exception {e}.")
         else:
             logger.error("YDL info extraction failed.")
             return
 
 
-def get_new_playlist_items():
-    """Get new playlist items for outstanding playlists.
+class CountingYoutubeDL(youtube_dl.YoutubeDL):
+
+    """YoutubeDL counting the extractions its InfoExtractors run.
+
+    Entries skipped because of the download archive are not extracted
+    and not counted.
     """
-    playlists: List[Playlist] = (session
-                                 .query(Playlist)
-                                 .filter_by(archived=False)
-                                 .all())
 
-    if playlists:
+    def __init__(self, *args, **kwargs):
+        self.extractor_calls = 0
+        super().__init__(*args, **kwargs)
+
+    def add_info_extractor(self, ie):
+        # Classes are instantiated and added again on first use.
+        if not isinstance(ie, type):
+            extract = ie.extract
+
+            def counted_extract(url):
+                self.extractor_calls += 1
+                return extract(url)
+
+            ie.extract = counted_extract
+        super().add_info_extractor(ie)
+
+
+class TopicFilePostProcessor(PostProcessor):
+
+    """Hands the info dict of each downloaded video to
+    AudioDownloader.finished.
+    """
+
+    def __init__(self, downloader: AudioDownloader):
+        super().__init__()
+        self.audio_downloader = downloader
+
+    def run(self, information: Dict):
+        self.audio_downloader.finished(information)
+        return [], information
+
+
+class TokenBucket(object):
+
+    """Bandwidth limit shared by all download threads.
+    """
+
+    def __init__(self, rate: Optional[float]):
+        """
+        :rate: Bytes per second, None for no limit.
+        """
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._available = 0.0
+        self._last = time.monotonic()
+
+    def consume(self, n_bytes: int) -> None:
+        """Block the calling download until n_bytes fit in the budget.
+        """
+        if not self.rate or n_bytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Allow bursts of at most one second's worth of bytes.
+            self._available = min(self.rate,
+                                  self._available +
+                                  (now - self._last) * self.rate)
+            self._last = now
+            self._available -= n_bytes
+            wait = -self._available / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadJob(object):
+
+    """Outstanding downloads for one playlist and their statistics.
+    """
+
+    def __init__(self, playlist: Playlist, to_download: int):
+        self.playlist_id: str = playlist.playlist_id
+        self.title: str = playlist.title
+        self.language: str = playlist.language
+        self.remaining = to_download
+        self.status = "queued"
+        self.downloads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.turns = 0
+        self.extractor_calls = 0
+        self.error: Optional[str] = None
+        # Why the budget filter last skipped a video this turn.
+        self.skipped: Optional[str] = None
+
+    def summary(self) -> Dict:
+        """
+        :returns: Throughput summary of the job.
+        """
+        return {"playlist_id": self.playlist_id,
+                "title": self.title,
+                "status": self.status,
+                "downloads": self.downloads,
+                "bytes": self.bytes,
+                "seconds": round(self.seconds, 3),
+                "bytes_per_second": (int(self.bytes / self.seconds)
+                                     if self.seconds else 0),
+                "turns": self.turns,
+                "extractor_calls": self.extractor_calls,
+                "error": self.error}
+
+
+class DownloadScheduler(object):
+
+    """Downloads new playlist items with a pool of worker threads.
+
+    Each playlist is one DownloadJob. Jobs take turns of at most
+    fair_share downloads and go to the back of the queue afterwards, so
+    a playlist with a big backlog or a slow server can't hold up the
+    others. A playlist is only downloaded by one thread at a time as
+    youtube_dl's download archive and max_downloads are per run.
+    """
+
+    def __init__(self,
+                 workers: int = DOWNLOAD_WORKERS,
+                 fair_share: int = DOWNLOAD_FAIR_SHARE,
+                 bandwidth_limit: Optional[float] = DOWNLOAD_BANDWIDTH_LIMIT,
+                 disk_budget: Optional[int] = DOWNLOAD_DISK_BUDGET,
+                 min_free_disk: int = DOWNLOAD_MIN_FREE_DISK,
+                 download_dir: str = TOPICFILES_DIR,
+                 ydl_options: Optional[Dict] = None,
+                 extractors: Sequence[type] = (),
+                 session_factory: Callable = Session):
+        """
+        :workers: Maximum number of concurrent playlist downloads.
+        :fair_share: Downloads per turn of a playlist.
+        :bandwidth_limit: Bytes per second shared by all workers, None for
+        no limit.
+        :disk_budget: Bytes this run may download, None for no limit.
+        :min_free_disk: Stop starting downloads below this many free bytes
+        in download_dir.
+        :download_dir: Directory the audio files are downloaded to.
+        :ydl_options: Extra youtube_dl options for every download.
+        :extractors: Extra InfoExtractor classes, see AudioDownloader.
+        :session_factory: Creates the SQLAlchemy session of each worker.
+        """
+        self.workers = workers
+        self.fair_share = fair_share
+        self.bucket = TokenBucket(bandwidth_limit)
+        self.disk_budget = disk_budget
+        self.min_free_disk = min_free_disk
+        self.download_dir = download_dir
+        self.ydl_options = {
+                'outtmpl': os.path.join(download_dir, '%(id)s.%(ext)s'),
+        }
+        self.ydl_options.update(ydl_options or {})
+        self.extractors = extractors
+        self.session_factory = session_factory
+        self.jobs: List[DownloadJob] = []
+        self._queue: Deque[DownloadJob] = collections.deque()
+        self._lock = threading.Lock()
+        self._downloaded_bytes = 0
+
+    def schedule(self, db) -> List[DownloadJob]:
+        """Queue a job for every unarchived playlist with fewer outstanding
+        TopicFiles than its outstanding target.
+        """
+        playlists: List[Playlist] = (db
+                                     .query(Playlist)
+                                     .filter_by(archived=False)
+                                     .all())
         for playlist in playlists:
-            outstanding = playlist.has_outstanding()
+            outstanding = playlist.outstanding_count
             target = playlist.outstanding_target
             if outstanding < target:
                 # Number of oustanding topics for this playlist
                 # is less than the number the user requested to
-                # be in the TopicFile queue at any time, so
-                # start download
+                # be in the TopicFile queue at any time
                 to_download = target - outstanding
-                logger.debug(f"{playlist} has {outstanding} outstanding " 
+                logger.debug(f"{playlist} has {outstanding} outstanding "
                              f"TopicFiles. Outstanding target for this "
-                             f"Playlist is {target}. Starting ydl download "
-                             f"with max_downloads set to {to_download}.")
-                AudioDownloader(yt_id=playlist.playlist_id,
-                                max_downloads=to_download,
-                                language=playlist.language).download()
+                             f"Playlist is {target}. Queueing "
+                             f"{to_download} downloads.")
+                job = DownloadJob(playlist, to_download)
+                self.jobs.append(job)
+                self._queue.append(job)
+        return self.jobs
+
+    def budget_left(self) -> Optional[str]:
+        """
+        :returns: Why no more downloads may start or None.
+        """
+        if self.disk_budget is not None and \
+           self._downloaded_bytes >= self.disk_budget:
+            return "Disk budget for this run is spent."
+        if shutil.disk_usage(self.download_dir).free < self.min_free_disk:
+            return f"Less than {self.min_free_disk} bytes free " \
+                   f"in {self.download_dir}."
+        return None
+
+    def budget_filter(self,
+                      job: DownloadJob) -> Callable[[Dict], Optional[str]]:
+        """
+        :returns: youtube_dl match_filter skipping videos that don't fit
+        in the disk budget and noting why in job.skipped.
+        """
+        def match_filter(info: Dict) -> Optional[str]:
+            reason = self.budget_left()
+            size = info.get("filesize") or info.get("filesize_approx")
+            if reason is None and size and self.disk_budget is not None and \
+               self._downloaded_bytes + size > self.disk_budget:
+                reason = f"{info.get('id')} does not fit in the disk budget."
+            if reason:
+                job.skipped = reason
+            return reason
+
+        return match_filter
+
+    def next_job(self) -> Optional[DownloadJob]:
+        """
+        :returns: The job at the front of the queue or None if the queue
+        is empty or the budget is spent.
+        """
+        with self._lock:
+            if not self._queue:
+                return None
+            reason = self.budget_left()
+            if reason:
+                while self._queue:
+                    job = self._queue.popleft()
+                    job.status = "over budget"
+                    job.error = reason
+                return None
+            job = self._queue.popleft()
+            job.status = "running"
+            return job
+
+    def progress_hook(self, job: DownloadJob) -> Callable[[Dict], None]:
+        """
+        :returns: youtube_dl progress hook throttling the download and
+        counting its bytes.
+        """
+        seen: Dict[str, int] = {}
+
+        def hook(target: Dict) -> None:
+            if target['status'] not in ('downloading', 'finished'):
+                return
+            filename = target.get('filename')
+            done = target.get('downloaded_bytes') or \
+                target.get('total_bytes') or 0
+            delta = done - seen.get(filename, 0)
+            seen[filename] = done
+            with self._lock:
+                job.bytes += max(delta, 0)
+                self._downloaded_bytes += max(delta, 0)
+                if target['status'] == 'finished':
+                    job.downloads += 1
+            self.bucket.consume(delta)
+
+        return hook
+
+    def run_turn(self, job: DownloadJob, db) -> None:
+        """Download up to fair_share new items of the job's playlist and
+        requeue the job if it has downloads left.
+        """
+        downloads_before = job.downloads
+        job.skipped = None
+        ydl_options = {'match_filter': self.budget_filter(job)}
+        ydl_options.update(self.ydl_options)
+        start = time.perf_counter()
+        downloader = AudioDownloader(yt_id=job.playlist_id,
+                                     max_downloads=min(job.remaining,
+                                                       self.fair_share),
+                                     language=job.language,
+                                     ydl_options=ydl_options,
+                                     progress_hooks=[self.progress_hook(job)],
+                                     extractors=self.extractors,
+                                     db=db)
+        try:
+            downloader.download()
+        except Exception as e:
+            logger.error(f"Download of {job.playlist_id} failed with "
+                         f"exception {e}.")
+            db.rollback()
+            job.error = str(e)
+        job.seconds += time.perf_counter() - start
+        job.turns += 1
+        job.extractor_calls += downloader.extractor_calls
+        downloaded = job.downloads - downloads_before
+        job.remaining -= downloaded
+
+        with self._lock:
+            if job.error:
+                job.status = "failed"
+            elif job.remaining <= 0:
+                job.status = "done"
+            elif downloaded == 0 and job.skipped:
+                job.status = "over budget"
+                job.error = job.skipped
+            elif downloaded == 0:
+                # The playlist has no new items left.
+                job.status = "exhausted"
+            else:
+                job.status = "queued"
+                self._queue.append(job)
+
+    def _worker_loop(self) -> None:
+        db = self.session_factory()
+        try:
+            while True:
+                job = self.next_job()
+                if job is None:
+                    return
+                self.run_turn(job, db)
+        finally:
+            db.close()
+
+    def run(self) -> List[Dict]:
+        """Run the queued jobs to completion.
+
+        :returns: Throughput summary of each job.
+        """
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._worker_loop,
+                                    name=f"download-{n}",
+                                    daemon=True)
+                   for n in range(min(self.workers, len(self._queue)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        summaries = [job.summary() for job in self.jobs]
+        for summary in summaries:
+            logger.info(f"{summary['playlist_id']}: {summary['status']}, "
+                        f"{summary['downloads']} downloads, "
+                        f"{summary['bytes']} bytes in "
+                        f"{summary['seconds']}s "
+                        f"({summary['bytes_per_second']} B/s).")
+        if elapsed and summaries:
+            logger.info(f"Downloaded {self._downloaded_bytes} bytes for "
+                        f"{len(summaries)} playlists in {elapsed:.1f}s "
+                        f"({int(self._downloaded_bytes / elapsed)} B/s).")
+        return summaries
+
+
+def get_new_playlist_items(**kwargs) -> List[Dict]:
+    """Get new playlist items for outstanding playlists.
+
+    :kwargs: DownloadScheduler options.
+    :returns: Throughput summary of each playlist download.
+    """
+    scheduler = DownloadScheduler(**kwargs)
+    db = scheduler.session_factory()
+    try:
+        scheduler.schedule(db)
+    finally:
+        db.close()
+    return scheduler.run()
+
 
-        
 if __name__ == "__main__":
     get_new_playlist_items()
@@ -1,10 +1,15 @@
 import mpd
-from mpd import MPDClient
+import re
 import time
 import os
 from config import HOST
 from config import PORT
 from config import AUDIOFILES_BASEDIR
+from config import (TOPICFILES_DIR,
+                    EXTRACTFILES_DIR,
+                    QUESTIONFILES_DIR)
+from MPD.MpdConnection import MpdConnection
+from MPD.MpdLibrary import MpdLibrary
 from contextlib import contextmanager, ExitStack
 from typing import List, Dict, Optional
 import logging
@@ -24,6 +29,10 @@ file_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 logger.addHandler(file_handler)
 
+# Commands per command list. Keeps each list well below MPD's
+# max_command_list_size (2048 KiB by default) for long filepaths.
+MAX_COMMAND_LIST = 500
+
 
 class Mpd(object):
 
@@ -37,19 +46,21 @@ class Mpd(object):
 
         self.host = HOST if HOST else "localhost"
         self.port = PORT if PORT else 6600
-        self.client = MPDClient()
+        # Persistent connection, reconnects by itself when MPD drops it.
+        self.client = MpdConnection(self.host, self.port)
+        # Created on first use by the library property.
+        self._library: Optional[MpdLibrary] = None
 
     @contextmanager
     def connection(self):
 
-        """Create temporary connection to mpd client.
+        """Make sure the persistent connection to mpd is open.
+
+        The connection stays open after the block so the next command
+        doesn't pay for a new connection.
         """
-        try:
-            self.client.connect(self.host, self.port)
-            yield
-        finally:
-            self.client.close()
-            self.client.disconnect()
+        self.client.connect()
+        yield
 
     @staticmethod
     def abs_to_rel(abs_fp: str) -> str:
@@ -67,27 +78,37 @@ class Mpd(object):
         return os.path.join(AUDIOFILES_BASEDIR, rel_fp)
 
     def connected(self) -> bool:
-        """Test connection to MPD server.
+        """Check the persistent connection without a round trip.
+
+        A connection MPD has silently closed is reopened by the next command.
         :return: True if connected else False.
         """
-        try:
-            self.client.ping()
-            return True
-        except mpd.base.ConnectionError:
-            return False
+        return self.client.is_connected
+
+    @property
+    def library(self) -> MpdLibrary:
+        """Index of the files MPD knows in the topic, extract and question
+        directories. Loaded on first use and kept up to date by MPD
+        database notifications.
+        """
+        if self._library is None:
+            directories = [os.path.basename(directory)
+                           for directory in (TOPICFILES_DIR,
+                                             EXTRACTFILES_DIR,
+                                             QUESTIONFILES_DIR)]
+            self._library = MpdLibrary(self.host, self.port, directories)
+        return self._library
 
     def mpd_recognised(self, rel_fp: str) -> bool:
         """Checks if mpd recognises the file.
 
+        Looks the file up in the cached library index, no round trip.
+
         :rel_fp: MPD base directory relative filepath.
         """
-
-        with self.connection() if not self.connected() else ExitStack():
-            try:
-                if self.client.find('file', rel_fp):
-                    return True
-            except mpd.base.CommandError:
-                logger.debug(f"MPD does not recognise file {rel_fp}.")
+        if rel_fp in self.library:
+            return True
+        logger.debug(f"MPD does not recognise file {rel_fp}.")
         return False
 
     def load_queue(self, queue: List[str]) -> int:
@@ -97,14 +118,49 @@ class Mpd(object):
         :returns: Number of tracks in the queue.
         """
         if queue:
-            with self.connection() if not self.connected() else ExitStack():
-                self.client.clear()
-                for file in queue:
-                    self.client.add(file)
-            logger.info(f"Loaded a new queue with {len(queue)} tracks.")
-            return len(queue)
+            report = self.replace_queue(queue)
+            logger.info(f"Loaded a new queue with {report['accepted']} tracks.")
+            return report["accepted"]
         return 0
 
+    def replace_queue(self, queue: List[str],
+                      chunk_size: int = MAX_COMMAND_LIST) -> Dict:
+        """Clear the queue and add the tracks using MPD command lists.
+
+        MPD stops a command list at the first failing command, so after a
+        failure the rest of the chunk is sent again in a new list.
+
+        :queue: List of MPD base-relative filepaths.
+        :chunk_size: Maximum number of commands per command list.
+        :returns: accepted (int) number of tracks added and failed
+        (Dict) mapping rejected filepaths to MPD's error message.
+        """
+        commands = [("clear",)] + [("add", file) for file in queue]
+        accepted = 0
+        failed: Dict[str, str] = {}
+        while commands:
+            chunk = commands[:chunk_size]
+            try:
+                self.client.command_list(chunk)
+                ran, done = chunk, len(chunk)
+            except mpd.base.CommandError as e:
+                # eg. "[50@3] {add} No such directory", 3 is the list index.
+                match = re.match(r"\[\d+@(\d+)\]", str(e))
+                if not match or chunk[int(match.group(1))][0] != "add":
+                    raise
+                offset = int(match.group(1))
+                failed[chunk[offset][1]] = str(e)
+                ran, done = chunk[:offset], offset + 1
+            accepted += sum(1 for command in ran if command[0] == "add")
+            commands = commands[done:]
+        if failed:
+            logger.error(f"MPD rejected {len(failed)} of {len(queue)} "
+                         f"tracks: {list(failed)}")
+        return {
+                "accepted": accepted,
+                "failed": failed
+               }
+
     def remove_stop_state(self) -> None:
         """MPD state can be play, pause or stop.
 
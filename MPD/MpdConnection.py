@@ -0,0 +1,263 @@
+import mpd
+from mpd import MPDClient
+import time
+import threading
+from typing import Callable, List, Optional, Tuple
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("mpd_connection.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(console_handler)
+logger.addHandler(file_handler)
+
+# Errors that mean the socket to MPD is gone.
+CONNECTION_ERRORS = (mpd.base.ConnectionError, OSError)
+# python-mpd2's message when writing a command to the socket fails, so
+# MPD never received it and it is safe to send again.
+WRITE_ERROR = "Connection to server was reset"
+# Commands that are harmless to run twice. MPD may already have run a
+# command when the connection drops before its response arrives, so only
+# these are resent after that. See is_idempotent for pause and seekcur.
+IDEMPOTENT_COMMANDS = frozenset({
+        "status", "currentsong", "stats", "ping", "outputs",
+        "listall", "listallinfo", "lsinfo", "find", "search",
+        "playlistinfo", "playlistid", "setvol", "repeat", "single",
+        "random", "consume", "update",
+})
+
+
+def is_idempotent(command: str, args: Tuple) -> bool:
+    """
+    :returns: True if running the command twice has the same effect as
+    running it once.
+    """
+    if command == "pause":
+        # pause 0/1 sets the state, a bare pause toggles it.
+        return bool(args)
+    if command == "seekcur":
+        # "+10" and "-10" seek relative to the current position.
+        return bool(args) and not str(args[0]).startswith(("+", "-"))
+    return command in IDEMPOTENT_COMMANDS
+
+
+class MpdConnection(object):
+
+    """Long-lived, self-healing connection to the MPD server.
+
+    Stands in for an MPDClient: any MPD command can be called on it
+    (eg. connection.status()). The socket is opened on the first command,
+    reopened with exponential backoff when MPD drops it, and kept alive by
+    pinging before MPD's connection_timeout closes it.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 timeout: float = 10,
+                 keepalive_interval: float = 30,
+                 max_retries: int = 3,
+                 backoff: float = 0.1,
+                 max_backoff: float = 5):
+        """
+        :host: MPD host.
+        :port: MPD port.
+        :timeout: Socket timeout in seconds.
+        :keepalive_interval: Ping MPD after this many idle seconds. Must be
+        below the connection_timeout in mpd.conf (60 seconds by default).
+        :max_retries: Reconnect attempts per command before giving up.
+        :backoff: Seconds to wait before the first reconnect attempt,
+        doubled after every failure.
+        :max_backoff: Upper bound on the wait between reconnect attempts.
+        """
+        self.host = host
+        self.port = port
+        self.keepalive_interval = keepalive_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._client = MPDClient()
+        self._client.timeout = timeout
+        self._lock = threading.RLock()
+        self._connected = False
+        self._last_used = 0.0
+        self._stop = threading.Event()
+        self._keepalive_thread: Optional[threading.Thread] = None
+
+    @property
+    def is_connected(self) -> bool:
+        """
+        :returns: True if the socket is believed to be open.
+        """
+        return self._connected
+
+    def connect(self) -> None:
+        """Open the connection if it is not already open.
+        """
+        with self._lock:
+            if self._connected:
+                return
+            self._client.connect(self.host, self.port)
+            self._connected = True
+            self._last_used = time.monotonic()
+            logger.debug(f"Connected to MPD at {self.host}:{self.port}.")
+            self._start_keepalive()
+
+    def close(self) -> None:
+        """Close the connection and stop the keepalive thread.
+        """
+        self._stop.set()
+        with self._lock:
+            if self._connected:
+                try:
+                    self._client.close()
+                except CONNECTION_ERRORS:
+                    pass
+            self._drop()
+
+    def _drop(self) -> None:
+        """Forget a connection that MPD or the network has closed.
+        """
+        try:
+            self._client.disconnect()
+        except CONNECTION_ERRORS:
+            pass
+        self._connected = False
+
+    def _start_keepalive(self) -> None:
+        """Start the keepalive thread once per connection manager.
+        """
+        if self._keepalive_thread is None and self.keepalive_interval:
+            self._keepalive_thread = threading.Thread(
+                    target=self._keepalive_loop,
+                    name="mpd-keepalive",
+                    daemon=True)
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self) -> None:
+        """Ping MPD whenever the connection has been idle too long.
+        """
+        while not self._stop.wait(self.keepalive_interval / 2):
+            with self._lock:
+                if not self._connected:
+                    continue
+                idle = time.monotonic() - self._last_used
+                if idle < self.keepalive_interval:
+                    continue
+                try:
+                    self._client.ping()
+                    self._last_used = time.monotonic()
+                except CONNECTION_ERRORS as e:
+                    logger.info(f"Keepalive ping failed with exception {e}. "
+                                "Reconnecting on next command.")
+                    self._drop()
+
+    def _with_reconnect(self, description: str, run: Callable,
+                        idempotent: bool):
+        """Run a function against the client, reconnecting with backoff
+        if the connection was lost.
+
+        Failures before the command was sent, or while writing it, are
+        always retried. After that MPD may have run it, so it is only sent
+        again if idempotent.
+        The backoff waits without holding the lock, so the keepalive and
+        other threads are not stalled.
+
+        :description: What is being run, for the logs.
+        :run: Function taking the MPDClient and a function to call right
+        before sending the command MPD acts on.
+        :idempotent: Whether running it twice is harmless.
+        :returns: The return value of run.
+        """
+        sent = False
+
+        def sending() -> None:
+            nonlocal sent
+            sent = True
+
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            sent = False
+            with self._lock:
+                try:
+                    self.connect()
+                    response = run(self._client, sending)
+                    self._last_used = time.monotonic()
+                    return response
+                except CONNECTION_ERRORS as e:
+                    self._drop()
+                    error = e
+            if sent and not idempotent and str(error) != WRITE_ERROR:
+                logger.error(f"Lost connection to MPD running "
+                             f"{description} ({error}) after sending it. "
+                             "Not resending it as MPD may have run it.")
+                raise mpd.base.ConnectionError(str(error)) from error
+            if attempt == self.max_retries:
+                logger.error(f"MPD {description} failed after "
+                             f"{attempt} reconnects with "
+                             f"exception {error}.")
+                raise mpd.base.ConnectionError(str(error)) from error
+            logger.info(f"Lost connection to MPD running "
+                        f"{description} ({error}). "
+                        f"Reconnecting in {delay}s.")
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def call(self, command: str, *args):
+        """Run an MPD command, reconnecting if the connection was lost.
+
+        A command that is not idempotent (see is_idempotent) is not resent
+        if the connection drops after it was sent, and
+        mpd.base.ConnectionError is raised instead.
+
+        :command: Name of the MPDClient method eg. "status".
+        :returns: The MPD response.
+        """
+        def run(client: MPDClient, sending: Callable):
+            sending()
+            return getattr(client, command)(*args)
+
+        return self._with_reconnect(command, run,
+                                    is_idempotent(command, args))
+
+    def command_list(self, commands: List[Tuple]) -> List:
+        """Send commands in a single command_list_ok_begin batch.
+
+        MPD only runs a command list once it has received
+        command_list_end, so the whole list is resent if the connection
+        drops before that is written. After that it is only resent if every
+        command is idempotent, otherwise mpd.base.ConnectionError is
+        raised. On the first failing command MPD skips the rest of the
+        list and mpd.base.CommandError is raised.
+
+        :commands: Tuples of command name and arguments eg. ("add", uri).
+        :returns: One response per command.
+        """
+        def run(client: MPDClient, sending: Callable) -> List:
+            client.command_list_ok_begin()
+            for command, *args in commands:
+                getattr(client, command)(*args)
+            sending()
+            return client.command_list_end()
+
+        return self._with_reconnect(
+                f"command list of {len(commands)}", run,
+                all(is_idempotent(command, tuple(args))
+                    for command, *args in commands))
+
+    def __getattr__(self, command: str) -> Callable:
+        """Expose MPD commands as methods eg. connection.seekcur(10).
+        """
+        if command.startswith("_"):
+            raise AttributeError(command)
+        return lambda *args: self.call(command, *args)
@@ -0,0 +1,189 @@
+import mpd
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from MPD.MpdConnection import MpdConnection
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("mpd_library.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(console_handler)
+logger.addHandler(file_handler)
+
+# Seconds to wait after a database change so that the changes of a burst
+# of updates, eg. renders, are read together.
+UPDATE_DEBOUNCE = 0.5
+
+
+class MpdLibrary(object):
+
+    """In-memory set of the file URIs MPD knows about.
+
+    Filled with one listall of the audio directories and refreshed by a
+    daemon thread whenever MPD reports an "idle database" change. MPD does
+    not say what changed, so only the paths passed to update are listed
+    again after changes it started, the whole directories after others.
+    """
+
+    def __init__(self, host: str, port: int, directories: List[str]):
+        """
+        :host: MPD host.
+        :port: MPD port.
+        :directories: MPD base-relative directories to index.
+        """
+        self.directories = directories
+        self.uris: Set[str] = set()
+        self.loaded = False
+        self._connection = MpdConnection(host, port, keepalive_interval=0)
+        # idle blocks its connection, so the watcher needs its own.
+        self._idle_connection = MpdConnection(host, port, timeout=None,
+                                              keepalive_interval=0)
+        self._lock = threading.Lock()
+        # Paths passed to update that MPD may not have indexed yet.
+        self._updated: Set[str] = set()
+        # MPD's database version when the URIs were last listed.
+        self._listed_version: Optional[Tuple] = None
+        self._watcher: Optional[threading.Thread] = None
+
+    def __contains__(self, rel_fp: str) -> bool:
+        """
+        :rel_fp: MPD base directory relative filepath.
+        :returns: True if MPD recognises the file.
+        """
+        if not self.loaded:
+            self.refresh()
+            self.watch()
+        return rel_fp in self.uris
+
+    def refresh(self) -> None:
+        """Reload the URIs of the indexed directories from MPD.
+        """
+        with self._lock:
+            version = self._database_version()
+            commands = [("listall", directory)
+                        for directory in self.directories]
+            try:
+                responses = self._connection.command_list(commands)
+            except mpd.base.CommandError as e:
+                # A missing directory aborts the list, fall back to
+                # listing the directories one by one.
+                logger.debug(f"listall command list failed with {e}.")
+                responses = [self._listall(directory)
+                             for directory in self.directories]
+
+            uris = {entry["file"]
+                    for response in responses
+                    for entry in response
+                    if "file" in entry}
+            if self.loaded:
+                added = len(uris - self.uris)
+                removed = len(self.uris - uris)
+                logger.info(f"MPD database changed: {added} files added, "
+                            f"{removed} removed.")
+            self.uris = uris
+            self._listed_version = version
+            self.loaded = True
+            logger.debug(f"Indexed {len(uris)} MPD files.")
+
+    def update(self, rel_fp: str) -> None:
+        """Ask MPD to index a file or directory, which is added to the
+        library once MPD reports the database change.
+
+        :rel_fp: MPD base directory relative filepath.
+        """
+        with self._lock:
+            self._updated.add(rel_fp)
+        self._connection.update(rel_fp)
+
+    def refresh_updated(self) -> None:
+        """Relist the paths passed to update, or reload every directory
+        if there are none as the change was started by someone else.
+
+        MPD merges changes made while the watcher is busy into one
+        notification, which can come after their paths were relisted, so
+        nothing is reloaded if the database has not changed since.
+        Paths MPD has not indexed yet are kept for the next change while
+        it is still updating.
+        """
+        with self._lock:
+            paths, self._updated = self._updated, set()
+        version = self._database_version()
+        if not paths:
+            if version != self._listed_version:
+                self.refresh()
+            return
+        # Listed without the lock, update is called from the render threads.
+        listed = self._list(paths)
+        missing = {path for path, uris in listed.items() if not uris}
+        if missing and "updating_db" not in self._connection.status():
+            missing = set()
+        directories = tuple(path + "/" for path in paths)
+        with self._lock:
+            self._updated |= missing
+            uris = {uri for uri in self.uris
+                    if uri not in paths and not uri.startswith(directories)}
+            self.uris = uris.union(*listed.values())
+            self._listed_version = version
+            logger.debug(f"Relisted {len(paths)} updated MPD paths.")
+
+    def _list(self, paths: Iterable[str]) -> Dict[str, Set[str]]:
+        """
+        :returns: The file URIs under each path, empty if MPD does not
+        recognise it.
+        """
+        paths = list(paths)
+        try:
+            responses = self._connection.command_list(
+                    [("listall", path) for path in paths])
+        except mpd.base.CommandError:
+            responses = [self._listall(path) for path in paths]
+        return {path: {entry["file"] for entry in response
+                       if "file" in entry}
+                for path, response in zip(paths, responses)}
+
+    def _database_version(self) -> Tuple:
+        """
+        :returns: When MPD last updated its database and its number of
+        files, which change with the files MPD knows.
+        """
+        stats = self._connection.stats()
+        return stats.get("db_update"), stats.get("songs")
+
+    def _listall(self, directory: str) -> List:
+        try:
+            return self._connection.listall(directory)
+        except mpd.base.CommandError:
+            logger.debug(f"MPD does not recognise directory {directory}.")
+            return []
+
+    def watch(self) -> None:
+        """Start the daemon thread that refreshes on database changes.
+        """
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_loop,
+                                             name="mpd-library",
+                                             daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self) -> None:
+        while True:
+            try:
+                changed = self._idle_connection.idle("database")
+            except mpd.base.ConnectionError as e:
+                logger.error(f"Idle connection to MPD failed with "
+                             f"exception {e}. Retrying.")
+                time.sleep(5)
+                continue
+            if "database" in changed:
+                time.sleep(UPDATE_DEBOUNCE)
+                self.refresh_updated()
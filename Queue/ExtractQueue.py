@@ -1,6 +1,6 @@
 from typing import Dict, Callable, List
 from MPD.MpdBase import Mpd
-from models import ExtractFile, ItemFile, session
+from models import ExtractFile, ItemFile, find_media_file, session
 from Sounds.sounds import (espeak,
                            click_sound1,
                            click_sound2,
@@ -108,10 +108,7 @@ class ExtractQueue(Mpd, QueueBase, object):
         filepath = cur_song['abs_fp']
 
         if filepath:
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
+            extract: ExtractFile = find_media_file(filepath, ExtractFile)
 
             if extract:
                 if extract.to_export:
@@ -138,11 +135,7 @@ class ExtractQueue(Mpd, QueueBase, object):
         :returns: True on success else false.
         """
         # Get extracts from DB
-        extracts: List[ExtractFile] = (session
-                                       .query(ExtractFile)
-                                       .filter_by(deleted=False)
-                                       .order_by(ExtractFile.created_at.desc())
-                                       .all())
+        extracts: List[ExtractFile] = ExtractFile.queue_query().all()
 
         # Add mpd-recognised extracts to queue
         if extracts:
@@ -214,10 +207,7 @@ class ExtractQueue(Mpd, QueueBase, object):
         if filepath:
 
             # Find the extract in DB
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
+            extract: ExtractFile = find_media_file(filepath, ExtractFile)
 
             # Add a new child item to the extract
             if extract:
@@ -256,10 +246,7 @@ class ExtractQueue(Mpd, QueueBase, object):
         if filepath:
 
             # Get extract from DB
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
+            extract: ExtractFile = find_media_file(filepath, ExtractFile)
 
             # Get the last inserted itemfile
             if extract:
@@ -279,6 +266,7 @@ class ExtractQueue(Mpd, QueueBase, object):
                             else:
                                 self.load_global_extract_options()
                             if last_item.process_cloze():
+                                self.render_pool.wake()
                                 logger.info(f"Processed cloze {last_item}.")
                                 return True
                             else:
@@ -311,10 +299,7 @@ class ExtractQueue(Mpd, QueueBase, object):
 
         if filepath:
             # Find the extract in DB
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
+            extract: ExtractFile = find_media_file(filepath, ExtractFile)
 
             # Archive the extract
             if extract:
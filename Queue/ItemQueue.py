@@ -1,7 +1,7 @@
 from typing import List, Dict, Callable
 from Sounds.sounds import espeak
 from MPD.MpdBase import Mpd
-from models import ItemFile, session
+from models import ItemFile, find_media_file, session
 from Sounds.sounds import load_beep
 from config import (KEY_X,
                     KEY_B,
@@ -71,11 +71,7 @@ class ItemQueue(Mpd, QueueBase, object):
         :returns: True on success else false.
         """
         # Query DB for outstanding items
-        items: List[ItemFile] = (session
-                                 .query(ItemFile)
-                                 .filter_by(deleted=False)
-                                 .filter(ItemFile.question_filepath != None)
-                                 .all())
+        items: List[ItemFile] = ItemFile.queue_query().all()
 
         # Add mpd-recognised items to the queue
         if items:
@@ -128,10 +124,7 @@ class ItemQueue(Mpd, QueueBase, object):
 
         if filepath:
             # Find the item in DB
-            item: ItemFile = (session
-                              .query(ItemFile)
-                              .filter_by(question_filepath=filepath)
-                              .one_or_none())
+            item: ItemFile = find_media_file(filepath, ItemFile)
 
             # Archive the item
             if item:
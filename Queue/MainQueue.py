@@ -1,6 +1,6 @@
 from .TopicQueue import TopicQueue
 from typing import Dict, Callable, List
-from models import session, TopicFile, ExtractFile, ItemFile
+from models import session, TopicFile, ExtractFile, ItemFile, find_media_file
 from .ExtractQueue import ExtractQueue
 from .ItemQueue import ItemQueue
 from Sounds.sounds import (click_sound1,
@@ -129,10 +129,7 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
 
         if filepath:
             # Find currently playing topic
-            topic: TopicFile = (session
-                                .query(TopicFile)
-                                .filter_by(filepath=filepath)
-                                .one_or_none())
+            topic: TopicFile = find_media_file(filepath, TopicFile)
 
             # Create list of mpd-recognised child extracts
             if topic:
@@ -140,7 +137,7 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
                 # List of rel_fps
                 extract_queue: List[str] = []
                 for extract in extracts:
-                    if not extract.archived:
+                    if not extract.archived and extract.is_playable():
                         rel_fp = self.abs_to_rel(extract.filepath)
                         if self.mpd_recognised(rel_fp):
                             extract_queue.append(rel_fp)
@@ -185,10 +182,7 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
 
         if filepath:
             # Find extract in DB
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
+            extract: ExtractFile = find_media_file(filepath, ExtractFile)
 
             # Get extract's parent topic
             if extract:
@@ -258,10 +252,7 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
 
         if filepath:
             # Find extract in DB
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
+            extract: ExtractFile = find_media_file(filepath, ExtractFile)
 
             # Find extract's outstanding child items
             if extract:
@@ -269,7 +260,8 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
                 # List of rel_fps
                 item_queue: List[str] = []
                 for item in items:
-                    if item.question_filepath and not item.archived:
+                    if item.question_filepath and not item.archived and \
+                       item.is_playable():
                         rel_fp = self.abs_to_rel(item.question_filepath)
                         if self.mpd_recognised(rel_fp):
                             item_queue.append(rel_fp)
@@ -326,10 +318,7 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
 
         if filepath:
             # Find item in the DB
-            item: ItemFile = (session
-                              .query(ItemFile)
-                              .filter_by(question_filepath=filepath)
-                              .one_or_none())
+            item: ItemFile = find_media_file(filepath, ItemFile)
 
             # Get the item's parent extract
             if item:
@@ -343,7 +332,8 @@ class MainQueue(TopicQueue, ExtractQueue, ItemQueue, QueueBase, object):
                     extract_queue: List[str] = [
                                             self.abs_to_rel(extract.filepath)
                                             for extract in local_extracts
-                                            if not extract.deleted
+                                            if not extract.deleted and
+                                            extract.is_playable()
                                                ]
 
                     # Move parent extract to the front and load playlist
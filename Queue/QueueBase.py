@@ -1,5 +1,7 @@
 from abc import ABC
 from typing import Dict, Callable
+from renderer import RenderPool
+from waveform import peak_indexer
 
 
 class QueueBase(ABC):
@@ -26,6 +28,26 @@ class QueueBase(ABC):
         self.recording: bool = False
         self.clozing: bool = False
 
+    @property
+    def render_pool(self) -> RenderPool:
+        """Background renderer for extracts and clozes shared by the
+        queues of a MainQueue. Started on first use.
+        """
+        if getattr(self, "_render_pool", None) is None:
+            self._render_pool = RenderPool(on_rendered=self.file_rendered)
+            self._render_pool.start()
+        return self._render_pool
+
+    def file_rendered(self, filepath: str) -> None:
+        """Ask MPD to index a newly rendered file so that it can be
+        queued straight away, and compute its waveform peaks.
+
+        The library only relists the file once MPD has indexed it.
+        Called from the render worker threads.
+        """
+        self.library.update(self.abs_to_rel(filepath))
+        peak_indexer.submit(filepath)
+
     def load_initial_queue(self) -> bool:
         """Load the starting queue for this queue.
         :returns: True on success else fail.
@@ -6,7 +6,8 @@ from config import (EXTRACTFILES_DIR,
                     EXTRACTFILES_EXT,
                     RECORDING_SINK)
 from MPD.MpdBase import Mpd
-from models import TopicFile, ExtractFile, session
+from models import (TopicFile, ExtractFile, RenderJob, find_media_file,
+                    session, RENDER_PENDING)
 from Sounds.sounds import (espeak,
                            click_sound1,
                            load_beep)
@@ -45,6 +46,11 @@ class TopicQueue(Mpd, QueueBase, object):
     """Extends core mpd functions for the Topic queue.
     """
 
+    # Record only the start and end timestamps of extracts and cut them
+    # out of the topic file afterwards instead of capturing the
+    # PulseAudio sink with parecord in real time.
+    offline_extracts: bool = True
+
     def __init__(self):
         """
         :current_queue: Name of the current queue.
@@ -62,6 +68,9 @@ class TopicQueue(Mpd, QueueBase, object):
 
         super().__init__()
 
+        # Resume renders interrupted by a restart.
+        self.render_pool.start()
+
         # State
         self.current_queue: str = "global topic queue"
         self.active_keys: Dict[int, Callable] = {}
@@ -121,14 +130,7 @@ class TopicQueue(Mpd, QueueBase, object):
         :returns: True on success else false.
         """
         # Get outstanding topics from DB
-        topics: List[TopicFile] = (session
-                                   .query(TopicFile)
-                                   .filter_by(deleted=False)
-                                   .filter_by(archived=False)
-                                   .filter((TopicFile.cur_timestamp
-                                            / TopicFile.duration) < 0.9)
-                                   .order_by(TopicFile.created_at.asc())
-                                   .all())
+        topics: List[TopicFile] = TopicFile.queue_query().all()
 
         if topics:
             # List of rel_fps.
@@ -167,39 +169,42 @@ class TopicQueue(Mpd, QueueBase, object):
             source_topic_fp = filepath
             timestamp = cur_song['elapsed']
 
-            topic: TopicFile = (session
-                                .query(TopicFile)
-                                .filter_by(filepath=source_topic_fp)
-                                .one_or_none())
+            topic: TopicFile = find_media_file(source_topic_fp, TopicFile)
             if topic:
+                name, topic_ext = os.path.splitext(basename)
+                # Offline extracts keep the topic's codec and container.
+                ext = topic_ext if self.offline_extracts else EXTRACTFILES_EXT
                 # create extract filepath
                 # /home/pi ... /extractfiles/<name-epoch time->.wav
                 extract_fp = os.path.join(EXTRACTFILES_DIR,
-                                          os.path.splitext(basename)[0] +
+                                          name +
                                           "-" +
                                           str(int(time.time())) +
-                                          EXTRACTFILES_EXT)
-
-                # TODO: Add a 2 minute (?) timeout
-                # Start parecord process and load recording options
-                try:
-                    subprocess.Popen(['parecord',
-                                      '--channels=1',
-                                      '-d',
-                                      RECORDING_SINK,
-                                      extract_fp], shell=False)
-                except OSError as e:
-                    logger.error(f"Failed to lauch parecord subprocess "
-                                 f"with exception {e}.")
-                    return False
+                                          ext)
+
+                if not self.offline_extracts:
+                    # TODO: Add a 2 minute (?) timeout
+                    # Start parecord process
+                    try:
+                        subprocess.Popen(['parecord',
+                                          '--channels=1',
+                                          '-d',
+                                          RECORDING_SINK,
+                                          extract_fp], shell=False)
+                    except OSError as e:
+                        logger.error(f"Failed to lauch parecord subprocess "
+                                     f"with exception {e}.")
+                        return False
+                    logger.info("Started a parecord subprocess.")
 
-                logger.info("Started a parecord subprocess.")
                 self.load_recording_options()
 
                 # Add the extract as a child of the topic
                 # TODO: What if abs_fp returns None?
                 extract: ExtractFile = ExtractFile(filepath=extract_fp,
                                                    startstamp=timestamp)
+                if self.offline_extracts:
+                    extract.render_status = RENDER_PENDING
                 topic.extracts.append(extract)
                 session.commit()
                 logger.info("Started a new extract in DB.")
@@ -219,34 +224,35 @@ class TopicQueue(Mpd, QueueBase, object):
         # Get current song info
         cur_track = self.current_track()
         if cur_track["abs_fp"]:
-            # Kill the active parecord process
-            child = subprocess.Popen(['pkill', 'parecord'],
-                                     stdout=subprocess.PIPE,
-                                     shell=False)
-
-            # If return code is 0, a parecord process was killed
-            response = child.communicate()[0]
-            if child.returncode == 0:
-                espeak("rec stop")
-                self.load_topic_options()
+            if not self.offline_extracts:
+                # Kill the active parecord process
+                child = subprocess.Popen(['pkill', 'parecord'],
+                                         stdout=subprocess.PIPE,
+                                         shell=False)
+
+                # If return code is 0, a parecord process was killed
+                response = child.communicate()[0]
+                if child.returncode != 0:
+                    logger.error("There was no active parecord process "
+                                 "to stop.")
+                    return False
+
+            espeak("rec stop")
+            self.load_topic_options()
 
-                # Get the last inserted extract
-                extract: ExtractFile = (session
-                                        .query(ExtractFile)
-                                        .order_by(ExtractFile
-                                                  .created_at
-                                                  .desc())
-                                        .first())
-                if extract:
-                    extract.endstamp = cur_track['elapsed']
-                    session.commit()
-                    logger.info("Stopped recording.")
-                    return True
-                else:
-                    logger.error("Currently recording extract "
-                                 "not found in DB.")
+            # Get the last inserted extract
+            extract: ExtractFile = ExtractFile.newest_query().first()
+            if extract:
+                extract.endstamp = cur_track['elapsed']
+                if extract.render_status == RENDER_PENDING:
+                    RenderJob.enqueue("extract", extract.id)
+                session.commit()
+                logger.info("Stopped recording.")
+                self.render_pool.wake()
+                return True
             else:
-                logger.error("There was no active parecord process to stop.")
+                logger.error("Currently recording extract "
+                             "not found in DB.")
         else:
             logger.error("No currently playing track.")
         return False
@@ -265,10 +271,7 @@ class TopicQueue(Mpd, QueueBase, object):
 
         if filepath:
             # Find the topic in the DB
-            topic: TopicFile = (session
-                                .query(TopicFile)
-                                .filter_by(filepath=filepath)
-                                .one_or_none())
+            topic: TopicFile = find_media_file(filepath, TopicFile)
 
             # Seek to the current timestamp
             if topic:
@@ -296,10 +299,7 @@ class TopicQueue(Mpd, QueueBase, object):
 
         if filepath:
             # Find the topic in the DB
-            topic: TopicFile = (session
-                                .query(TopicFile)
-                                .filter_by(filepath=filepath)
-                                .one_or_none())
+            topic: TopicFile = find_media_file(filepath, TopicFile)
 
             # Seek to the current timestamp
             if topic:
@@ -327,10 +327,7 @@ class TopicQueue(Mpd, QueueBase, object):
 
         if filepath:
             # Find topic in DB
-            topic: TopicFile = (session
-                                .query(TopicFile)
-                                .filter_by(filepath=filepath)
-                                .one_or_none())
+            topic: TopicFile = find_media_file(filepath, TopicFile)
 
             # Archive the Topic
             if topic:
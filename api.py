@@ -1,11 +1,15 @@
 from flask_restplus import Resource, Api
 import os
-from flask import Blueprint, request, Flask, render_template, url_for
-from flask_restplus import fields
+import json
+from flask import (Blueprint, request, Flask, render_template, url_for,
+                   Response)
+from flask_restplus import fields, marshal
 from flask_sqlalchemy import SQLAlchemy
 from config import DATABASE_URI
 from flask_cors import CORS
-from AudioDownloader import AudioDownloader
+from download_jobs import DownloadJobStore, DownloadJobRunner, DONE_STATUSES
+from models import Session
+from transcript_search import search, SEARCH_LIMIT
 
 
 app = Flask(__name__)
@@ -31,6 +35,33 @@ download_request = api.model('Download Request', {
         "sm_priority": fields.Float,
         })
 
+download_job = api.model('Download Job', {
+        "id": fields.String,
+        "yt_id": fields.String,
+        "status": fields.String,
+        "progress": fields.Integer,
+        "downloads": fields.Integer,
+        "error": fields.String,
+        "created_at": fields.Float,
+        "updated_at": fields.Float,
+        "version": fields.Integer,
+        })
+
+search_hit = api.model('Transcript Search Hit', {
+        "topic_id": fields.Integer,
+        "extract_id": fields.Integer,
+        "title": fields.String,
+        "timestamp": fields.Float,
+        "snippet": fields.String,
+        "rank": fields.Float,
+        })
+
+# Seconds between keepalive comments on idle event streams.
+EVENTS_KEEPALIVE = 15
+
+download_jobs = DownloadJobStore()
+download_runner = DownloadJobRunner(download_jobs)
+
 
 @assistant_ns.route("/ping")
 class Ping(Resource):
@@ -43,31 +74,118 @@ class Ping(Resource):
 
 @assistant_ns.route("/download")
 class Youtube(Resource):
-    @api.response(201, "Successfully downloaded audio file to pi")
+    @api.response(202, "Queued the download")
+    @api.response(400, "No yt_id in the request")
     @api.expect(download_request)
     def post(self):
-        """Start a youtube_dl download
+        """Queue a youtube_dl download
+
+        Returns the download job straight away. Poll
+        /downloads/<job_id> or stream /downloads/<job_id>/events for
+        its progress.
         """
         dl_req = request.get_json()
-        if dl_req:
-            # TODO wait for the finished hook return status somehow
-            app.config["updated"] = False
-            app.config["progress"] = 0
-            app.config["error"] = False
-            AudioDownloader(config=app.config, **dl_req).download()
-            return dl_req, 201
-        return dl_req, 404
+        if not dl_req or not dl_req.get("yt_id"):
+            api.abort(400, "yt_id is required.")
+        dl_req = {key: value for key, value in dl_req.items()
+                  if key in download_request and value is not None}
+        job = download_runner.submit(dl_req)
+        return marshal(job, download_job), 202
+
+
+@assistant_ns.route("/downloads")
+class DownloadJobs(Resource):
+    @api.marshal_with(download_job, as_list=True)
+    @api.response(200, "Listed download jobs")
+    def get(self):
+        """List download jobs, newest first.
+        """
+        return download_jobs.all()
+
+
+@assistant_ns.route("/downloads/<string:job_id>")
+class DownloadJob(Resource):
+    @api.marshal_with(download_job)
+    @api.response(200, "Polled download job")
+    @api.response(404, "Download job not found")
+    def get(self, job_id):
+        """Poll the progress of a download job.
+        """
+        job = download_jobs.get(job_id)
+        if job is None:
+            api.abort(404, f"Download job {job_id} not found.")
+        return job
+
+
+@assistant_ns.route("/downloads/<string:job_id>/events")
+class DownloadJobEvents(Resource):
+    @api.response(200, "text/event-stream of download job updates")
+    @api.response(404, "Download job not found")
+    def get(self, job_id):
+        """Stream a download job's progress as Server-Sent Events.
+
+        Each event is the job as JSON. The stream ends once the job has
+        finished or failed.
+        """
+        if download_jobs.get(job_id) is None:
+            api.abort(404, f"Download job {job_id} not found.")
+
+        def events():
+            version = -1
+            while True:
+                job = download_jobs.wait(job_id, version, EVENTS_KEEPALIVE)
+                if job is None:
+                    return
+                if job["version"] == version:
+                    yield ": keepalive\n\n"
+                    continue
+                version = job["version"]
+                yield f"id: {version}\ndata: {json.dumps(job)}\n\n"
+                if job["status"] in DONE_STATUSES:
+                    return
+
+        return Response(events(),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache",
+                                 "X-Accel-Buffering": "no"})
+
+
+@assistant_ns.route("/search")
+class TranscriptSearch(Resource):
+    @api.marshal_with(search_hit, as_list=True)
+    @api.response(200, "Searched transcripts")
+    @api.response(400, "No q in the request")
+    @api.doc(params={"q": "Words to search for",
+                     "limit": f"Maximum number of hits, {SEARCH_LIMIT} "
+                              f"by default"})
+    def get(self):
+        """Search the transcripts of topics and extracts.
+
+        Hits are ranked best first. timestamp is the position of the
+        hit in seconds into the topic's audio file.
+        """
+        query = request.args.get("q", "")
+        if not query.strip():
+            api.abort(400, "q is required.")
+        limit = request.args.get("limit", SEARCH_LIMIT, type=int)
+        db = Session()
+        try:
+            return search(query, limit, db)
+        finally:
+            db.close()
 
 
 @assistant_ns.route("/progress")
 class Progress(Resource):
     @api.response(200, "Successfully polled download progress")
     def get(self):
-        """Poll the progress of the current youtube-dl download.
+        """Poll the progress of the newest download job.
+
+        Kept for old clients, use /downloads/<job_id> instead.
         """
-        if app.config.get('updated'):
-            app.config["updated"] = False
-            return app.config["progress"]
+        jobs = download_jobs.all()
+        if jobs:
+            return jobs[0]["progress"]
 
 
 if __name__ == "__main__":
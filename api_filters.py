@@ -0,0 +1,45 @@
+"""Filters of the old_api.py collections.
+
+old_api.py reflects the tables into its own Flask-SQLAlchemy models, so
+these take the model to filter by and work on queries of those as well
+as of the models.py classes, which query_plans.py explains.
+"""
+import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+
+
+def created_between(query: Query, model, start: str, end: str) -> Query:
+    """Filter for the ?start=&end= date range of a collection.
+    """
+    return (query
+            .filter(model.created_at >= start)
+            .filter(model.created_at <= end))
+
+
+def recorded_extracts(query: Query, model) -> Query:
+    """Filter for ExtractFiles whose recording was stopped.
+    """
+    return (query
+            .filter(model.filepath != None)
+            .filter(model.endstamp != None))
+
+
+def clozed_items(query: Query, model) -> Query:
+    """Filter for ItemFiles with a cloze.
+    """
+    return (query
+            .filter(model.question_filepath != None)
+            .filter(model.cloze_endstamp != None))
+
+
+def rollup_days(query: Query, rollup, start: datetime.date,
+                pruned_before: datetime.date, end: str) -> Query:
+    """Filter for the daily rollups from start up to pruned_before and
+    end, in day order.
+    """
+    return (query
+            .filter(rollup.day >= start)
+            .filter(rollup.day < pruned_before)
+            .filter(rollup.day <= func.date(end))
+            .order_by(rollup.day, rollup.id))
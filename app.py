@@ -9,7 +9,8 @@ from Queue.QueueBase import QueueBase
 import logging
 from typing import Dict
 from config import CONTROLLER, HEADPHONES
-from models import TopicFile, ExtractFile, ItemFile
+from reaper import reap_all
+from rollup import rollup_all
 
 
 logger = logging.getLogger(__name__)
@@ -295,10 +296,9 @@ if __name__ == "__main__":
     # eg. (TopicQueue) to test in isolation.
 
     # Remove finished files before load_initial_queue call.
-    # TODO
-    ItemFile.remove_finished_files()
-    ExtractFile.remove_finished_files()
-    TopicFile.remove_finished_files()
+    reap_all()
+    # Compact old events into the daily rollup tables.
+    rollup_all()
     
     queue = MainQueue()
     queue_loop = QueueLoop(queue)
@@ -0,0 +1,116 @@
+"""Stream audio files over HTTP for the old_api.py audio endpoints.
+
+Responses support byte ranges (206 Partial Content), so a player can seek
+through a multi-hour topic without downloading all of it, and ETags, so a
+file the client already has is answered with 304 Not Modified.
+
+A range reaching the end of the file, including the whole file, is never
+read into the Python process. The response body is the open file, seeked
+to the start of the range, handed to the server's wsgi.file_wrapper.
+Servers such as gunicorn send that with os.sendfile. The wrapper has no
+length, so other ranges, and servers without a file wrapper, get the
+range read in blocks. With the Flask USE_X_SENDFILE option set, the front
+server (nginx, Apache) sends the file and handles the ranges itself.
+"""
+import mimetypes
+import os
+from typing import BinaryIO, Iterator, Optional
+from flask import abort, current_app, request, send_file
+from werkzeug.wrappers import Response
+
+# Bytes read at a time when the file is not sent by wsgi.file_wrapper.
+BLOCK_SIZE = 64 * 1024
+# render_status of ExtractFiles and ItemFiles whose audio is complete,
+# see models.RENDER_DONE. Files still rendering are not served.
+PLAYABLE_RENDER_STATUSES = (None, "done")
+# Extensions the mimetypes module may not know.
+AUDIO_MIMETYPES = {
+    ".m4a": "audio/mp4",
+    ".opus": "audio/ogg",
+    ".webm": "audio/webm",
+    ".wav": "audio/wav",
+}
+
+
+def audio_mimetype(filepath: str) -> str:
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension in AUDIO_MIMETYPES:
+        return AUDIO_MIMETYPES[extension]
+    return mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """An ETag that changes whenever the file is replaced or rewritten,
+    without hashing its contents.
+    """
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def read_range(file: BinaryIO, length: int) -> Iterator[bytes]:
+    """Read length bytes from the current position of file in blocks."""
+    try:
+        while length > 0:
+            block = file.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        file.close()
+
+
+def stream_audio(filepath: Optional[str]) -> Response:
+    """Respond to the current request with (a range of) an audio file.
+
+    :filepath: File to send, 404 if None or missing.
+    :returns: 200, 206, 304 or 416 response.
+    """
+    if not filepath or not os.path.isfile(filepath):
+        abort(404, "Audio file not found")
+    mimetype = audio_mimetype(filepath)
+    if current_app.config["USE_X_SENDFILE"]:
+        return send_file(filepath, mimetype=mimetype, conditional=True)
+
+    stat = os.stat(filepath)
+    size = stat.st_size
+    etag = file_etag(stat)
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    response.set_etag(etag)
+    response.last_modified = int(stat.st_mtime)
+    response.accept_ranges = "bytes"
+    # Let clients keep the file but check its ETag before reusing it.
+    response.cache_control.no_cache = True
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    start, stop = 0, size
+    byte_range = request.range
+    if_range = request.if_range
+    # If-Range: only send the range if the client's copy is still current,
+    # otherwise the whole file. Multiple ranges also get the whole file.
+    current = (if_range.etag == etag if if_range.etag else
+               if_range.date is None or
+               if_range.date == response.last_modified)
+    if byte_range is not None and len(byte_range.ranges) == 1 and current:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            response.status_code = 416
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+        start, stop = bounds
+        response.status_code = 206
+        response.content_range = byte_range.make_content_range(size)
+
+    response.content_length = stop - start
+    if request.method == "HEAD":
+        return response
+    file = open(filepath, "rb")
+    file.seek(start)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    # The wrapper sends everything after start.
+    if file_wrapper is not None and stop == size:
+        response.response = file_wrapper(file, BLOCK_SIZE)
+    else:
+        response.response = read_range(file, stop - start)
+    return response
@@ -0,0 +1,62 @@
+"""Check that a video skipped by the disk budget only marks its own
+playlist "over budget", not a playlist with nothing new to download.
+
+Run from the repository root:
+
+    python -m benchmarks.budget_skip_check
+"""
+import sys
+import models
+from models import Playlist
+from AudioDownloader import DownloadScheduler
+from benchmarks.scratch import scratch_session
+from benchmarks.fake_youtube import FixtureServer, fake_extractor
+
+BUDGET = 512 * 1024
+# fake-p0 has a video bigger than the budget, fake-p1 has no videos.
+PLAYLISTS = {"fake-p0": ["fake-p0-v0"], "fake-p1": []}
+EXPECTED = {"fake-p0": "over budget", "fake-p1": "exhausted"}
+
+
+def run() -> bool:
+    """
+    :returns: True if every playlist ended with its expected status.
+    """
+    server = FixtureServer({"fake-p0-v0": 2 * BUDGET}).start()
+    extractor = fake_extractor(server, PLAYLISTS)
+    ok = True
+    try:
+        with scratch_session() as (session, tmp_dir):
+            for playlist_id in PLAYLISTS:
+                session.add(Playlist(playlist_id=playlist_id,
+                                     title=playlist_id,
+                                     language="en",
+                                     outstanding_target=1))
+            session.commit()
+            engine = session.get_bind()
+            # One worker so that fake-p0 takes its turn first.
+            scheduler = DownloadScheduler(
+                    workers=1,
+                    disk_budget=BUDGET,
+                    min_free_disk=0,
+                    download_dir=tmp_dir,
+                    ydl_options={"quiet": True,
+                                 "writesubtitles": False,
+                                 "writeautomaticsub": False},
+                    extractors=[extractor],
+                    session_factory=lambda: models.Session(bind=engine))
+            scheduler.schedule(session)
+            for summary in scheduler.run():
+                expected = EXPECTED[summary["playlist_id"]]
+                passed = summary["status"] == expected
+                print(f"{'ok' if passed else 'FAIL':5} "
+                      f"{summary['playlist_id']} {summary['status']}, "
+                      f"expected {expected}")
+                ok = ok and passed
+    finally:
+        server.stop()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,82 @@
+"""Compare the in-process WAV cloze renderer with the ffmpeg one, one
+cloze per decode and all clozes of the extract from one decode.
+
+Run from the repository root:
+
+    python -m benchmarks.cloze_render_benchmark [n_clozes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from typing import Dict, List
+import numpy as np
+import wav_cloze
+from renderer import clozes_command, run_ffmpeg
+
+EXTRACT_SECONDS = 120
+RATE = 44100
+
+
+def write_extract(filepath: str) -> float:
+    """Write a mono 16 bit noise WAV file.
+
+    :returns: Length in seconds.
+    """
+    frames = EXTRACT_SECONDS * RATE
+    noise = np.random.default_rng(0).integers(-3000, 3000, frames,
+                                              dtype=np.int16)
+    with wave.open(filepath, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(noise.tobytes())
+    return float(EXTRACT_SECONDS)
+
+
+def run(n_clozes: int) -> Dict[str, float]:
+    tmp_dir = tempfile.mkdtemp(prefix="audio-assistant-bench-")
+    try:
+        extract_fp = os.path.join(tmp_dir, "extract.wav")
+        length = write_extract(extract_fp)
+
+        clozes = []
+        for i in range(n_clozes):
+            start = (i * 7.3) % (length - 5)
+            clozes.append((start, start + 1.5,
+                           os.path.join(tmp_dir, f"q{i}.wav"),
+                           os.path.join(tmp_dir, f"c{i}.wav")))
+
+        def render_wav(batch: List) -> int:
+            wav_cloze.render_clozes_wav(extract_fp, length, batch)
+            return 0
+
+        def render_ffmpeg(batch: List) -> int:
+            return run_ffmpeg(clozes_command(extract_fp, length, batch))[0]
+
+        renderers = [("numpy", render_wav)]
+        if shutil.which("ffmpeg"):
+            renderers.append(("ffmpeg", render_ffmpeg))
+        else:
+            print("ffmpeg not found, only timing the NumPy renderer.")
+
+        timings: Dict[str, float] = {}
+        for name, render in renderers:
+            for mode, batches in (("single", [[c] for c in clozes]),
+                                  ("batch", [clozes])):
+                key = f"{name} {mode}"
+                start_time = time.perf_counter()
+                failed = sum(render(batch) != 0 for batch in batches)
+                timings[key] = time.perf_counter() - start_time
+                print(f"{key:>13}: {timings[key]:.3f}s "
+                      f"({timings[key] / n_clozes * 1000:.1f}ms per cloze, "
+                      f"{failed} failed)")
+        return timings
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,98 @@
+"""Check that Playlist.outstanding_count survives ORM writes to TopicFiles
+expired by a commit, which the counter events once miscounted.
+
+Run from the repository root:
+
+    python -m benchmarks.counter_drift_check
+"""
+import sys
+from typing import Callable, List, Tuple
+from sqlalchemy.orm import object_session
+from models import Playlist, TopicFile
+from benchmarks.scratch import scratch_session
+
+
+def archive(topic: TopicFile, other: Playlist) -> None:
+    topic.archived = True
+
+
+def delete(topic: TopicFile, other: Playlist) -> None:
+    topic.deleted = True
+
+
+def unarchive(topic: TopicFile, other: Playlist) -> None:
+    topic.archived = False
+
+
+def move_by_id(topic: TopicFile, other: Playlist) -> None:
+    topic.playlist_id = other.id
+
+
+def move(topic: TopicFile, other: Playlist) -> None:
+    topic.playlist = other
+
+
+def remove(topic: TopicFile, other: Playlist) -> None:
+    object_session(topic).delete(topic)
+
+
+def listen(topic: TopicFile, other: Playlist) -> None:
+    topic.cur_timestamp = 95.0
+
+
+# Writes applied one after the other, each committed, to a topic of the
+# first playlist, starting outstanding, and then removing the topic.
+SEQUENCES: List[Tuple[Callable, ...]] = [
+    (archive, archive),
+    (archive, delete),
+    (archive, unarchive),
+    (move_by_id,),
+    (move,),
+    (archive, move_by_id),
+    (listen, archive),
+    (listen, move_by_id),
+    (move_by_id, archive, move),
+]
+
+
+def run_sequence(session, steps: Tuple[Callable, ...]) -> List[str]:
+    """
+    :returns: The counters that drifted after a step, see
+    Playlist.check_outstanding_counts.
+    """
+    name = "-".join(step.__name__ for step in steps)
+    playlist = Playlist(playlist_id=name + "-a")
+    other = Playlist(playlist_id=name + "-b")
+    topic = TopicFile(filepath=name + ".m4a",
+                      downloaded=True,
+                      duration=100.0,
+                      cur_timestamp=10.0,
+                      playlist=playlist)
+    session.add_all([playlist, other, topic])
+    session.commit()
+    for step in steps + (remove,):
+        step(topic, other)
+        session.commit()
+        drift = Playlist.check_outstanding_counts(fix=True)
+        if drift:
+            return [f"{step.__name__}: {row['stored']} stored, "
+                    f"{row['actual']} recounted" for row in drift]
+    return []
+
+
+def run() -> bool:
+    """
+    :returns: True if no sequence drifted.
+    """
+    ok = True
+    with scratch_session() as (session, tmp_dir):
+        for steps in SEQUENCES:
+            drift = run_sequence(session, steps)
+            name = " -> ".join(step.__name__ for step in steps)
+            print(f"{'DRIFT' if drift else 'ok':5} {name} {', '.join(drift)}")
+            ok = ok and not drift
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,81 @@
+"""Compare sequential and parallel playlist downloads against a local
+fixture server.
+
+Playlist 0 is slow (large files) so with one worker it holds up the
+others, as get_new_playlist_items did before the DownloadScheduler.
+
+Run from the repository root:
+
+    python -m benchmarks.download_scheduler_benchmark [n_playlists]
+"""
+import os
+import sys
+import time
+from typing import Dict
+import models
+from models import Playlist, TopicFile
+from AudioDownloader import DownloadScheduler, DOWNLOAD_WORKERS
+from benchmarks.scratch import scratch_session
+from benchmarks.fake_youtube import FixtureServer, fake_extractor
+
+VIDEOS_PER_PLAYLIST = 3
+VIDEO_SIZE = 256 * 1024
+# Bytes per second per connection of the fixture server.
+SERVER_RATE = 2 * 1024 * 1024
+
+
+def run(n_playlists: int) -> Dict[int, float]:
+    playlists = {f"fake-p{p}": [f"fake-p{p}-v{v}"
+                                for v in range(VIDEOS_PER_PLAYLIST)]
+                 for p in range(n_playlists)}
+    sizes = {video_id: VIDEO_SIZE * (4 if video_id.startswith("fake-p0-")
+                                     else 1)
+             for videos in playlists.values() for video_id in videos}
+    server = FixtureServer(sizes, rate=SERVER_RATE).start()
+    extractor = fake_extractor(server, playlists)
+
+    timings: Dict[int, float] = {}
+    try:
+        for workers in (1, DOWNLOAD_WORKERS):
+            with scratch_session() as (session, tmp_dir):
+                for playlist_id in playlists:
+                    session.add(Playlist(playlist_id=playlist_id,
+                                         title=playlist_id,
+                                         language="en",
+                                         outstanding_target=(
+                                             VIDEOS_PER_PLAYLIST)))
+                session.commit()
+                engine = session.get_bind()
+                scheduler = DownloadScheduler(
+                        workers=workers,
+                        min_free_disk=0,
+                        download_dir=tmp_dir,
+                        ydl_options={
+                            "download_archive": os.path.join(tmp_dir,
+                                                             "archive"),
+                            "quiet": True,
+                            "writesubtitles": False,
+                            "writeautomaticsub": False,
+                        },
+                        extractors=[extractor],
+                        session_factory=lambda: models.Session(bind=engine))
+                scheduler.schedule(session)
+                start = time.perf_counter()
+                summaries = scheduler.run()
+                timings[workers] = time.perf_counter() - start
+                topics = session.query(TopicFile).count()
+                print(f"{workers} worker{'' if workers == 1 else 's'}: "
+                      f"{timings[workers]:.2f}s, {topics} topics")
+                for summary in summaries:
+                    print(f"    {summary['playlist_id']:>10} "
+                          f"{summary['status']:>9} "
+                          f"{summary['downloads']} downloads "
+                          f"{summary['extractor_calls']} extractor calls "
+                          f"{summary['bytes_per_second'] / 1024:.0f} KiB/s")
+    finally:
+        server.stop()
+    return timings
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
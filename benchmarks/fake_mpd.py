@@ -0,0 +1,265 @@
+"""Minimal in-process MPD server for benchmarks.
+
+Speaks enough of the MPD protocol for the commands Audio Assistant uses:
+playback, queue, find/listall, update, command lists and idle/noidle.
+"""
+import bisect
+import shlex
+import socket
+import socketserver
+import threading
+from typing import Dict, Iterable, List, Optional
+
+# Must match the greeting of a real server closely enough for python-mpd2.
+GREETING = "OK MPD 0.21.0\n"
+
+# Subsystem reported by idle after each command, "player" if not listed.
+SUBSYSTEMS = {
+        "clear": "playlist",
+        "setvol": "mixer",
+        "repeat": "options",
+        "single": "options",
+}
+
+
+class FakeMpdState(object):
+
+    """Playback state and library shared by all client connections.
+    """
+
+    def __init__(self, library: Iterable[str] = ()):
+        self.library: List[str] = sorted(library)
+        # Files written to disk that an update adds to the library.
+        self.unindexed: set = set()
+        self.update_jobs = 0
+        self.db_update = 0
+        self.queue: List[str] = []
+        self.pos = 0
+        self.state = "pause"
+        self.elapsed = 0.0
+        self.volume = 50
+        self.repeat = 0
+        self.single = 0
+        self.changed = threading.Condition()
+        self.pending: Dict[int, set] = {}
+        self.connections = 0
+        self.commands = 0
+        # Files sent in listall responses.
+        self.listed = 0
+        # Commands that close the connection once, before running or after
+        # running but before responding, like a network drop.
+        self.drop_before: set = set()
+        self.drop_after: set = set()
+
+    def add_to_library(self, *uris: str) -> None:
+        """Add files as if MPD had finished a database update.
+        """
+        self.library = sorted(set(self.library) | set(uris))
+        self.db_update += 1
+        self.notify("database")
+
+    def notify(self, *subsystems: str) -> None:
+        """Wake up clients blocked in idle.
+        """
+        with self.changed:
+            for pending in self.pending.values():
+                pending.update(subsystems)
+            self.changed.notify_all()
+
+
+class FakeMpdHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        state: FakeMpdState = self.server.state
+        state.connections += 1
+        with state.changed:
+            state.pending[id(self)] = set()
+        try:
+            self.serve(state)
+        except OSError:
+            pass
+        finally:
+            with state.changed:
+                state.pending.pop(id(self), None)
+
+    def serve(self, state: FakeMpdState) -> None:
+        self.wfile.write(GREETING.encode())
+        in_list = False
+        list_ok = False
+        list_lines: List[str] = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode().rstrip("\n")
+            if self.drops(state.drop_before, line):
+                return
+            if line == "close":
+                return
+            if line in ("command_list_ok_begin", "command_list_begin"):
+                in_list, list_ok, list_lines = True, line.endswith("ok_begin"), []
+                continue
+            if in_list and line != "command_list_end":
+                # MPD only runs the list once it has all of it.
+                list_lines.append(line)
+                continue
+            if line == "command_list_end":
+                in_list = False
+                response = self.run_list(state, list_lines, list_ok)
+            elif line.startswith("idle"):
+                response = self.idle(state, line)
+            else:
+                response = self.run(state, line)
+            if self.drops(state.drop_after, line):
+                return
+            self.wfile.write(response.encode())
+
+    @staticmethod
+    def drops(commands: set, line: str) -> bool:
+        """
+        :returns: True, once, if the command of line is in commands.
+        """
+        command = line.split(" ", 1)[0]
+        if command in commands:
+            commands.discard(command)
+            return True
+        return False
+
+    def run_list(self, state: FakeMpdState, lines: List[str],
+                 list_ok: bool) -> str:
+        responses = []
+        for index, line in enumerate(lines):
+            response = self.run(state, line, index=index)
+            if response.startswith("ACK"):
+                # MPD aborts the rest of the list on the first error.
+                return "".join(responses) + response
+            responses.append(response[:-len("OK\n")] +
+                             ("list_OK\n" if list_ok else ""))
+        return "".join(responses) + "OK\n"
+
+    def idle(self, state: FakeMpdState, line: str) -> str:
+        """Block until a subsystem changes or the client sends noidle.
+        """
+        key = id(self)
+        self.connection.settimeout(0.05)
+        try:
+            while True:
+                with state.changed:
+                    if state.pending[key]:
+                        break
+                    state.changed.wait(0.05)
+                    if state.pending[key]:
+                        break
+                try:
+                    peek = self.connection.recv(16, socket.MSG_PEEK)
+                except socket.timeout:
+                    continue
+                if peek.startswith(b"noidle"):
+                    self.rfile.readline()
+                    break
+                if not peek:
+                    break
+        finally:
+            self.connection.settimeout(None)
+        with state.changed:
+            changed, state.pending[key] = state.pending[key], set()
+        return "".join(f"changed: {s}\n" for s in sorted(changed)) + "OK\n"
+
+    def run(self, state: FakeMpdState, line: str, index: int = 0) -> str:
+        state.commands += 1
+        parts = shlex.split(line)
+        command, args = parts[0], parts[1:]
+        current: Optional[str] = state.queue[state.pos] if state.queue else None
+        if command == "status":
+            lines = [f"volume: {state.volume}", f"repeat: {state.repeat}",
+                     f"single: {state.single}", f"state: {state.state}",
+                     f"playlistlength: {len(state.queue)}"]
+            if current:
+                lines += [f"song: {state.pos}", f"elapsed: {state.elapsed:.3f}"]
+            return "\n".join(lines) + "\nOK\n"
+        if command == "stats":
+            return (f"songs: {len(state.library)}\n"
+                    f"db_update: {state.db_update}\nOK\n")
+        if command == "currentsong":
+            return (f"file: {current}\n" if current else "") + "OK\n"
+        if command == "find":
+            uri = args[1]
+            return (f"file: {uri}\n" if uri in state.library else "") + "OK\n"
+        if command == "listall":
+            path = args[0].rstrip("/") if args else ""
+            prefix = path + "/" if path else ""
+            # The library is sorted, so like MPD's directory tree a path
+            # is found without looking at every file.
+            library = state.library
+            i = bisect.bisect_left(library, path)
+            if path and i < len(library) and library[i] == path:
+                uris = [path]
+            else:
+                i = bisect.bisect_left(library, prefix)
+                uris = []
+                while i < len(library) and library[i].startswith(prefix):
+                    uris.append(library[i])
+                    i += 1
+            if path and not uris:
+                return f"ACK [50@{index}] {{listall}} No such directory\n"
+            state.listed += len(uris)
+            return "".join(f"file: {uri}\n" for uri in uris) + "OK\n"
+        if command == "update":
+            path = args[0] if args else ""
+            found = {uri for uri in state.unindexed
+                     if uri == path or uri.startswith(path)}
+            state.unindexed -= found
+            state.update_jobs += 1
+            if found:
+                state.add_to_library(*found)
+            return f"updating_db: {state.update_jobs}\nOK\n"
+        if command == "add":
+            if args[0] not in state.library:
+                return f"ACK [50@{index}] {{add}} No such directory\n"
+            state.queue.append(args[0])
+            state.notify("playlist")
+            return "OK\n"
+        if command == "clear":
+            state.queue, state.pos = [], 0
+        elif command == "play":
+            state.state = "play"
+        elif command == "pause":
+            paused = args[0] == "1" if args else state.state == "play"
+            state.state = "pause" if paused else "play"
+        elif command in ("next", "previous") and state.queue:
+            step = 1 if command == "next" else -1
+            state.pos = (state.pos + step) % len(state.queue)
+            state.elapsed = 0.0
+        elif command == "seekcur":
+            state.elapsed = float(args[0])
+        elif command == "setvol":
+            state.volume = int(args[0])
+        elif command in ("repeat", "single"):
+            setattr(state, command, int(args[0]))
+        elif command not in ("ping",):
+            return f"ACK [5@{index}] {{}} unknown command \"{command}\"\n"
+        if command != "ping":
+            state.notify(SUBSYSTEMS.get(command, "player"))
+        return "OK\n"
+
+
+class FakeMpdServer(socketserver.ThreadingTCPServer):
+
+    """Fake MPD server on a free localhost port, run in a daemon thread.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, library: Iterable[str] = ()):
+        super().__init__(("127.0.0.1", 0), FakeMpdHandler)
+        self.state = FakeMpdState(library)
+        self.host, self.port = self.server_address
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
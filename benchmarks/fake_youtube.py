@@ -0,0 +1,121 @@
+"""Local stand-ins for YouTube for download benchmarks.
+
+FixtureServer serves generated audio bytes over HTTP at a limited rate
+and fake_extractor builds a youtube_dl extractor for "fake-" playlist
+and video ids whose formats point at the server.
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List, Optional
+from youtube_dl.extractor.common import InfoExtractor
+
+# Bytes written between rate limiting sleeps.
+CHUNK = 16 * 1024
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        video_id = os.path.splitext(os.path.basename(self.path))[0]
+        size = self.server.sizes.get(video_id)
+        if size is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mp4")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        chunk = bytes(CHUNK)
+        sent = 0
+        try:
+            while sent < size:
+                n = min(CHUNK, size - sent)
+                self.wfile.write(chunk[:n])
+                sent += n
+                if self.server.rate:
+                    time.sleep(n / self.server.rate)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+
+    """HTTP server on a free localhost port serving sizes[video_id]
+    bytes at /media/<video_id>.m4a.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, sizes: Dict[str, int], rate: Optional[float] = None):
+        """
+        :sizes: Video id mapped to the size of its audio file.
+        :rate: Bytes per second per connection, None for no limit.
+        """
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.sizes = sizes
+        self.rate = rate
+        self._thread: Optional[threading.Thread] = None
+
+    def url(self, video_id: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/media/" \
+               f"{video_id}.m4a"
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def fake_extractor(server: FixtureServer,
+                   playlists: Dict[str, List[str]]) -> type:
+    """
+    :playlists: Playlist id mapped to its video ids. Ids must start with
+    "fake-" and the server must serve the videos.
+    :returns: InfoExtractor class for AudioDownloader's extractors.
+    """
+
+    class FakeYoutubeIE(InfoExtractor):
+        IE_NAME = "fakeyoutube"
+        _VALID_URL = r"(?P<id>fake-[\w-]+)$"
+
+        def _real_extract(self, url):
+            item_id = self._match_id(url)
+            if item_id in playlists:
+                entries = [self.url_result(video_id,
+                                           ie=FakeYoutubeIE.ie_key(),
+                                           video_id=video_id)
+                           for video_id in playlists[item_id]]
+                result = self.playlist_result(entries, item_id, item_id)
+                result["uploader_id"] = "fake-uploader"
+                return result
+            return {
+                "id": item_id,
+                "title": item_id,
+                "url": server.url(item_id),
+                "ext": "m4a",
+                "vcodec": "none",
+                "acodec": "mp4a",
+                "filesize": server.sizes[item_id],
+                "duration": 60,
+                "uploader": "Fake",
+                "uploader_id": "fake-uploader",
+                "thumbnail": None,
+                "upload_date": "20200101",
+                "view_count": 0,
+                "like_count": 0,
+                "dislike_count": 0,
+                "average_rating": None,
+            }
+
+    return FakeYoutubeIE
@@ -0,0 +1,66 @@
+"""Files listed by MpdLibrary while a burst of rendered files is indexed,
+relisting the whole directories after every database change versus only
+the paths passed to MpdLibrary.update, against benchmarks.fake_mpd.
+Also checks that a file added without update still shows up.
+
+Run from the repository root:
+
+    python -m benchmarks.library_refresh_benchmark [library_size] [renders]
+"""
+import sys
+import time
+from typing import List
+from MPD.MpdLibrary import MpdLibrary
+from benchmarks.fake_mpd import FakeMpdServer
+
+DIRECTORIES = ["topicfiles", "extractfiles", "questionfiles"]
+# Seconds between two rendered files, about a short cloze render.
+RENDER_INTERVAL = 0.02
+
+
+class FullReloadLibrary(MpdLibrary):
+
+    """MpdLibrary with the old reload of every directory per change.
+    """
+
+    def refresh_updated(self) -> None:
+        with self._lock:
+            self._updated.clear()
+        self.refresh()
+
+
+def run(library_cls, library_size: int, renders: int) -> None:
+    uris = [f"{DIRECTORIES[i % 3]}/{i}.wav" for i in range(library_size)]
+    rendered = [f"questionfiles/rendered-{i}.wav" for i in range(renders)]
+    with FakeMpdServer(uris) as server:
+        library = library_cls(server.host, server.port, DIRECTORIES)
+        assert uris[0] in library
+        server.state.listed = 0
+        start = time.perf_counter()
+        for uri in rendered:
+            server.state.unindexed.add(uri)
+            library.update(uri)
+            time.sleep(RENDER_INTERVAL)
+        wait_for(library, rendered, start)
+        seconds = time.perf_counter() - start
+        listed = server.state.listed
+        # A change not made through MpdLibrary.update reloads everything.
+        server.state.add_to_library("topicfiles/added-by-hand.m4a")
+        wait_for(library, ["topicfiles/added-by-hand.m4a"],
+                 time.perf_counter())
+    print(f"{library_cls.__name__:>17}: {listed} files listed, "
+          f"all {renders} renders queueable after {seconds:.2f}s")
+
+
+def wait_for(library: MpdLibrary, uris: List[str], start: float) -> None:
+    while not all(uri in library.uris for uri in uris):
+        if time.perf_counter() - start > 30:
+            raise TimeoutError(f"{uris[-1]} never showed up.")
+        time.sleep(0.01)
+
+
+if __name__ == "__main__":
+    library_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    renders = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for library_cls in (FullReloadLibrary, MpdLibrary):
+        run(library_cls, library_size, renders)
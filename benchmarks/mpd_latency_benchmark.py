@@ -0,0 +1,80 @@
+"""Round-trip time per key press with and without the persistent
+MPD connection, measured against benchmarks.fake_mpd.
+
+Run from the repository root:
+
+    python -m benchmarks.mpd_latency_benchmark [presses]
+"""
+import sys
+import time
+from contextlib import contextmanager, ExitStack
+from mpd import MPDClient
+import mpd
+from MPD.MpdBase import Mpd
+from MPD.MpdConnection import MpdConnection
+from benchmarks.fake_mpd import FakeMpdServer
+
+
+class PerCommandMpd(Mpd):
+
+    """Mpd with the old connect / ping / close per command behaviour.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.client = MPDClient()
+
+    @contextmanager
+    def connection(self):
+        try:
+            self.client.connect(self.host, self.port)
+            yield
+        finally:
+            self.client.close()
+            self.client.disconnect()
+
+    def connected(self) -> bool:
+        try:
+            self.client.ping()
+            return True
+        except mpd.base.ConnectionError:
+            return False
+
+
+def connect_to(player: Mpd, server: FakeMpdServer) -> Mpd:
+    """Point a player at the fake server instead of config.HOST / PORT.
+    """
+    player.host, player.port = server.host, server.port
+    if isinstance(player.client, MpdConnection):
+        player.client = MpdConnection(server.host, server.port)
+    return player
+
+
+def next_topic_press(player: Mpd) -> None:
+    """The MPD traffic of TopicQueue.next_topic.
+    """
+    player.next()
+    player.current_track()
+    with player.connection() if not player.connected() else ExitStack():
+        player.client.seekcur(30.0)
+
+
+def run(presses: int) -> None:
+    library = [f"topicfiles/{i}.m4a" for i in range(10)]
+    with FakeMpdServer(library) as server:
+        # The queue is server state. Load it once, with command lists.
+        connect_to(Mpd(), server).load_queue(library)
+        for cls in (PerCommandMpd, Mpd):
+            player = connect_to(cls(), server)
+            connections = server.state.connections
+            start = time.perf_counter()
+            for _ in range(presses):
+                next_topic_press(player)
+            elapsed = time.perf_counter() - start
+            print(f"{cls.__name__:>14}: "
+                  f"{elapsed / presses * 1000:.2f}ms per key press, "
+                  f"{server.state.connections - connections} connections")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,99 @@
+"""Compare OFFSET pages with keyset (cursor) pages of the topic events
+collection, as old_api.py /events/topics serves them, at increasing
+depths.
+
+Run from the repository root:
+
+    python -m benchmarks.pagination_benchmark [pages] [per_page]
+"""
+import datetime
+import sys
+import time
+from typing import Dict, List
+from migrations import migrate
+from models import TopicFile, TopicEvent
+from pagination import keyset_page, CountCache
+from benchmarks.scratch import scratch_session
+
+# Pages timed, besides the last one.
+DEPTHS = (1, 10, 100, 1000)
+# Times each page is fetched.
+REPEATS = 20
+
+
+def timed(fetch) -> float:
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        fetch()
+    return (time.perf_counter() - start_time) / REPEATS
+
+
+def run(pages: int, per_page: int) -> Dict[str, Dict[int, float]]:
+    timings: Dict[str, Dict[int, float]] = {
+            "offset": {}, "keyset": {},
+            "offset + count": {}, "keyset + cached": {}}
+    with scratch_session() as (session, tmp_dir):
+        migrate(session.get_bind())
+        topic = TopicFile(filepath=f"{tmp_dir}/a.m4a", downloaded=True)
+        session.add(topic)
+        session.flush()
+        start = datetime.datetime(2020, 1, 1)
+        n_events = pages * per_page + per_page
+        # Events share timestamps, so the id breaks ties.
+        session.execute(TopicEvent.__table__.insert(), [
+            {"topic_id": topic.id,
+             "event": "play",
+             "timestamp": i,
+             "duration": 0,
+             "created_at": start + datetime.timedelta(seconds=i // 3)}
+            for i in range(n_events)])
+        session.commit()
+        print(f"{n_events} topic events")
+
+        query = session.query(TopicEvent)
+        keys = [TopicEvent.created_at, TopicEvent.id]
+        depths = [depth for depth in DEPTHS if depth < pages] + [pages]
+
+        # Walk the cursors down to each depth, checking nothing is
+        # skipped or repeated on the way.
+        cursors: Dict[int, str] = {}
+        cursor = None
+        seen: List[int] = []
+        for page in range(1, pages + 1):
+            if page in depths:
+                cursors[page] = cursor
+            rows, cursor, _ = keyset_page(query, keys, per_page, cursor)
+            seen.extend(row.id for row in rows)
+        assert seen == sorted(seen) and len(set(seen)) == len(seen) == \
+            pages * per_page, "Keyset pages skipped or repeated rows"
+        rows, _, prev_cursor = keyset_page(query, keys, per_page, cursor)
+        rows, _, _ = keyset_page(query, keys, per_page, prev_cursor)
+        assert [row.id for row in rows] == seen[-per_page:], \
+            "prev cursor did not return the previous page"
+
+        ordered = query.order_by(TopicEvent.created_at, TopicEvent.id)
+        count_cache = CountCache()
+        for page in depths:
+            timings["offset"][page] = timed(
+                lambda: ordered.offset((page - 1) * per_page)
+                               .limit(per_page).all())
+            timings["offset + count"][page] = timed(
+                lambda: (ordered.offset((page - 1) * per_page)
+                                .limit(per_page).all(),
+                         query.order_by(None).count()))
+            timings["keyset"][page] = timed(
+                lambda: keyset_page(query, keys, per_page, cursors[page]))
+            timings["keyset + cached"][page] = timed(
+                lambda: (keyset_page(query, keys, per_page, cursors[page]),
+                         count_cache.count(query)))
+
+        print(f"{'page':>8}" + "".join(f"{name:>17}" for name in timings))
+        for page in depths:
+            print(f"{page:>8}" + "".join(
+                f"{timings[name][page] * 1000:>15.2f}ms" for name in timings))
+    return timings
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10)
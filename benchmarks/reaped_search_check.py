@@ -0,0 +1,77 @@
+"""Check that reaped TopicFiles and ExtractFiles, and rows deleted behind
+the mapper events' back, no longer show up in transcript searches.
+
+Run from the repository root:
+
+    python -m benchmarks.reaped_search_check
+"""
+import os
+import sys
+from typing import List
+from sqlalchemy import text
+from migrations import migrate
+from models import (TopicFile, ExtractFile, TranscriptCue, reap_finished)
+from transcript_search import search
+from benchmarks.scratch import scratch_session, touch
+
+
+def populate(session, tmp_dir: str, name: str) -> TopicFile:
+    """A finished topic with a topic cue saying "hello name" and an
+    archived extract whose transcript says "zebra name".
+    """
+    topic = TopicFile(filepath=touch(os.path.join(tmp_dir, f"{name}.m4a")),
+                      title=name,
+                      downloaded=True,
+                      duration=100.0,
+                      cur_timestamp=95.0)
+    topic.extracts.append(ExtractFile(
+            filepath=touch(os.path.join(tmp_dir, f"{name}.wav")),
+            startstamp=0.0, endstamp=10.0,
+            transcript=f"zebra {name}",
+            archived=True))
+    session.add(topic)
+    session.flush()
+    session.add(TranscriptCue(topic_id=topic.id, start_ms=0, end_ms=1000,
+                              text=f"hello {name}"))
+    session.commit()
+    return topic
+
+
+def run() -> bool:
+    """
+    :returns: True if no deleted row was found.
+    """
+    failures: List[str] = []
+    with scratch_session() as (session, tmp_dir):
+        migrate(session.get_bind())
+
+        populate(session, tmp_dir, "reaped")
+        if len(search("reaped", db=session)) != 2:
+            failures.append("the cues were not indexed")
+        reap_finished(ExtractFile)
+        reap_finished(TopicFile)
+        cues = session.query(TranscriptCue).count()
+        if cues:
+            failures.append(f"reaping left {cues} cues")
+        if search("reaped", db=session):
+            failures.append("reaped rows are still found")
+
+        topic = populate(session, tmp_dir, "bulk")
+        session.execute(text("UPDATE extractfiles SET deleted = 1"))
+        if [hit for hit in search("bulk", db=session) if hit["extract_id"]]:
+            failures.append("an extract deleted by raw SQL is still found")
+        session.execute(text("UPDATE topicfiles SET deleted = 1 "
+                             "WHERE id = :id"), {"id": topic.id})
+        if search("bulk", db=session):
+            failures.append("a topic deleted by raw SQL is still found")
+        session.rollback()
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if not failures:
+        print("ok    reaped and deleted rows are not searchable")
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,74 @@
+"""Compare the per-row reaper with models.reap_finished.
+
+Run from the repository root:
+
+    python -m benchmarks.reaper_benchmark [n_topics]
+"""
+import os
+import sys
+import time
+from typing import Dict
+import models
+from models import TopicFile, ExtractFile, ItemFile
+from benchmarks.scratch import scratch_session, touch
+
+
+def populate(session, tmp_dir: str, n_topics: int) -> None:
+    """Insert topics with 2 extracts and 2 items each, half of them finished.
+    """
+    for t in range(n_topics):
+        finished = t % 2 == 0
+        topic = TopicFile(filepath=touch(os.path.join(tmp_dir, f"t{t}.m4a")),
+                          downloaded=True,
+                          duration=100.0,
+                          cur_timestamp=95.0 if finished else 10.0)
+        for e in range(2):
+            extract = ExtractFile(
+                    filepath=touch(os.path.join(tmp_dir, f"e{t}-{e}.wav")),
+                    startstamp=0.0, endstamp=10.0,
+                    archived=finished)
+            for i in range(2):
+                name = f"{t}-{e}-{i}.wav"
+                extract.items.append(ItemFile(
+                    question_filepath=touch(os.path.join(tmp_dir, "q" + name)),
+                    cloze_filepath=touch(os.path.join(tmp_dir, "c" + name)),
+                    archived=finished))
+            topic.extracts.append(extract)
+        session.add(topic)
+    session.commit()
+
+
+def per_row_reap(model) -> None:
+    """The reaper as it was before models.reap_finished.
+    """
+    rows = models.session.query(model).filter_by(deleted=False).all()
+    for row in rows:
+        if model is ItemFile:
+            finished = row.archived or row.exported
+        else:
+            finished = row.is_finished()
+        if finished:
+            if model.unlink_files(*row.file_paths()):
+                row.deleted = True
+                models.session.commit()
+
+
+def run(n_topics: int) -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    for name, reap in (("per-row", per_row_reap),
+                       ("set-based", models.reap_finished)):
+        with scratch_session() as (session, tmp_dir):
+            populate(session, tmp_dir, n_topics)
+            start = time.perf_counter()
+            for model in (ItemFile, ExtractFile, TopicFile):
+                reap(model)
+            timings[name] = time.perf_counter() - start
+            deleted = (session.query(TopicFile)
+                       .filter_by(deleted=True).count())
+            print(f"{name:>9}: {timings[name]:.3f}s "
+                  f"({deleted}/{n_topics} topics reaped)")
+    return timings
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
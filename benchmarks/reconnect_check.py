@@ -0,0 +1,108 @@
+"""Check which MPD commands MpdConnection resends after the connection
+drops, against benchmarks.fake_mpd, and that its reconnect backoff does
+not block other threads.
+
+Run from the repository root:
+
+    python -m benchmarks.reconnect_check
+"""
+import sys
+import threading
+import time
+from typing import Callable, List, Tuple
+import mpd
+from MPD.MpdConnection import MpdConnection
+from benchmarks.fake_mpd import FakeMpdServer, FakeMpdState
+
+LIBRARY = ["topicfiles/a.m4a", "topicfiles/b.m4a", "topicfiles/c.m4a"]
+
+
+def raises(run: Callable) -> bool:
+    try:
+        run()
+    except mpd.base.ConnectionError:
+        return True
+    return False
+
+
+def resent_status(connection: MpdConnection, state: FakeMpdState) -> bool:
+    state.drop_after.add("status")
+    return connection.status()["state"] == "pause"
+
+
+def toggle_not_resent(connection: MpdConnection, state: FakeMpdState) -> bool:
+    state.state = "play"
+    state.drop_after.add("pause")
+    return raises(connection.pause) and state.state == "pause"
+
+
+def pause_on_resent(connection: MpdConnection, state: FakeMpdState) -> bool:
+    state.state = "play"
+    state.drop_after.add("pause")
+    return connection.pause(1) is None and state.state == "pause"
+
+
+def list_resent_before_end(connection: MpdConnection,
+                           state: FakeMpdState) -> bool:
+    state.queue = [LIBRARY[2]]
+    state.drop_before.add("add")
+    connection.command_list([("clear",), ("add", LIBRARY[0]),
+                             ("add", LIBRARY[1])])
+    return state.queue == LIBRARY[:2]
+
+
+def list_not_resent_after_end(connection: MpdConnection,
+                              state: FakeMpdState) -> bool:
+    state.queue = []
+    state.drop_after.add("command_list_end")
+    return (raises(lambda: connection.command_list([("add", LIBRARY[0]),
+                                                    ("add", LIBRARY[1])]))
+            and state.queue == LIBRARY[:2])
+
+
+def backoff_releases_lock(connection: MpdConnection,
+                          state: FakeMpdState) -> bool:
+    connection.backoff = 0.5
+    state.drop_before.add("status")
+    thread = threading.Thread(target=connection.status)
+    thread.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    connection.ping()
+    waited = time.perf_counter() - start
+    thread.join()
+    return waited < 0.3
+
+
+CHECKS: List[Tuple[str, Callable]] = [
+    ("status is resent", resent_status),
+    ("a bare pause is not resent", toggle_not_resent),
+    ("pause 1 is resent", pause_on_resent),
+    ("a list dropped before command_list_end is resent",
+     list_resent_before_end),
+    ("a list of adds dropped after command_list_end is not resent",
+     list_not_resent_after_end),
+    ("other threads run during the backoff", backoff_releases_lock),
+]
+
+
+def run() -> bool:
+    """
+    :returns: True if every check passed.
+    """
+    ok = True
+    with FakeMpdServer(LIBRARY) as server:
+        for name, check in CHECKS:
+            connection = MpdConnection(server.host, server.port,
+                                       keepalive_interval=0, backoff=0.01)
+            try:
+                passed = check(connection, server.state)
+            finally:
+                connection.close()
+            print(f"{'ok' if passed else 'FAIL':5} {name}")
+            ok = ok and passed
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
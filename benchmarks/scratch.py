@@ -0,0 +1,37 @@
+"""Throwaway databases and files for benchmarks.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+import models
+
+
+@contextmanager
+def scratch_session():
+    """Point models.session at a temporary SQLite database.
+
+    :yields: (session, tmp_dir) where tmp_dir can hold scratch audio files.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="audio-assistant-bench-")
+    engine = create_engine("sqlite:///" + os.path.join(tmp_dir, "bench.db"))
+    models.Base.metadata.create_all(engine)
+    original = models.session
+    models.session = models.Session(bind=engine)
+    try:
+        yield models.session, tmp_dir
+    finally:
+        models.session.close()
+        models.session = original
+        engine.dispose()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def touch(path: str) -> str:
+    """Create an empty file.
+    :returns: The path.
+    """
+    with open(path, "w"):
+        pass
+    return path
@@ -0,0 +1,93 @@
+"""Time transcript searches on the FTS5 index against a LIKE scan of the
+same cues, with hours of synthetic captions spread over many topics.
+
+Run from the repository root:
+
+    python -m benchmarks.transcript_search_benchmark [hours] [searches]
+"""
+import random
+import sys
+import time
+from itertools import accumulate
+from typing import Dict, List
+from migrations import migrate
+from models import TopicFile, TranscriptCue
+from transcript_search import search, match_query
+from benchmarks.scratch import scratch_session
+
+# Hours of captions per topic.
+TOPIC_HOURS = 2
+# Milliseconds per caption line.
+CUE_MS = 2010
+VOCABULARY_SIZE = 20000
+WORDS_PER_CUE = 7
+
+
+def vocabulary(rng: random.Random) -> List[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(3, 9)))
+            for _ in range(VOCABULARY_SIZE)]
+
+
+def run(hours: float, searches: int) -> Dict[str, float]:
+    rng = random.Random(0)
+    words = vocabulary(rng)
+    # Zipf-like word frequencies, like speech.
+    cum_weights = list(accumulate(1 / (rank + 1)
+                                  for rank in range(len(words))))
+    timings: Dict[str, float] = {}
+    with scratch_session() as (session, tmp_dir):
+        migrate(session.get_bind())
+        cues = TranscriptCue.__table__
+        n_topics = max(1, int(hours / TOPIC_HOURS))
+        cues_per_topic = int(TOPIC_HOURS * 3600 * 1000 / CUE_MS)
+        start_time = time.perf_counter()
+        for n in range(n_topics):
+            topic = TopicFile(filepath=f"{tmp_dir}/{n}.m4a",
+                              title=f"Topic {n}",
+                              downloaded=True)
+            session.add(topic)
+            session.flush()
+            session.execute(cues.insert(), [
+                {"topic_id": topic.id,
+                 "start_ms": i * CUE_MS,
+                 "end_ms": (i + 1) * CUE_MS,
+                 "text": " ".join(rng.choices(
+                     words, cum_weights=cum_weights, k=WORDS_PER_CUE))}
+                for i in range(cues_per_topic)])
+            session.commit()
+        timings["index"] = time.perf_counter() - start_time
+        print(f"Indexed {n_topics * cues_per_topic} cues of {n_topics} "
+              f"topics in {timings['index']:.1f}s")
+
+        queries = {
+            "common word": [words[rng.randint(0, 20)]
+                            for _ in range(searches)],
+            "rare word": [words[rng.randint(5000, VOCABULARY_SIZE - 1)]
+                          for _ in range(searches)],
+            "two words": [f"{words[rng.randint(0, 200)]} "
+                          f"{words[rng.randint(200, 2000)]}"
+                          for _ in range(searches)],
+        }
+        for name, terms in queries.items():
+            start_time = time.perf_counter()
+            for term in terms:
+                search(term, db=session)
+            timings[name] = (time.perf_counter() - start_time) / searches
+            print(f"{name:>12}: {timings[name] * 1000:.2f}ms per search")
+
+        # What finding a word cost without the index.
+        term = queries["rare word"][0]
+        start_time = time.perf_counter()
+        session.execute(cues.select()
+                        .where(cues.c.text.like(f"%{term}%"))
+                        .limit(20)).fetchall()
+        timings["like scan"] = time.perf_counter() - start_time
+        print(f"{'like scan':>12}: {timings['like scan'] * 1000:.2f}ms "
+              f"for {match_query(term)}")
+    return timings
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100)
@@ -0,0 +1,118 @@
+"""Compare re-parsing a VTT file per lookup with the cached CueIndex on a
+multi-hour YouTube style auto-caption file.
+
+Run from the repository root:
+
+    python -m benchmarks.vtt_index_benchmark [hours] [lookups]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict
+import webvtt
+import vtt_index
+from vtt_index import load_index, join_lines, index_filepath
+
+
+def timestamp(ms: int) -> str:
+    return f"{ms // 3600000:02}:{ms // 60000 % 60:02}:" \
+           f"{ms // 1000 % 60:02}.{ms % 1000:03}"
+
+
+def write_auto_captions(filepath: str, hours: float) -> int:
+    """Write rolling two line captions: every cue repeats the last line
+    of the previous one, with a 10ms cue in between like YouTube's.
+
+    :returns: Number of cues.
+    """
+    words = "the quick brown fox jumps over a lazy dog while it".split()
+    rng = random.Random(0)
+    cues = []
+    previous = " ".join(rng.choices(words, k=6))
+    ms = 0
+    while ms < hours * 3600 * 1000:
+        line = " ".join(rng.choices(words, k=6))
+        cues.append(f"{timestamp(ms)} --> {timestamp(ms + 2000)}\n"
+                    f"{previous}\n{line}\n")
+        cues.append(f"{timestamp(ms + 2000)} --> {timestamp(ms + 2010)}\n"
+                    f"{line}\n")
+        previous = line
+        ms += 2010
+    with open(filepath, "w") as f:
+        f.write("WEBVTT\nKind: captions\nLanguage: en\n\n")
+        f.write("\n".join(cues))
+    return len(cues)
+
+
+def reparse_find_within_range(start, end, subs_file):
+    """find_within_range as it was before vtt_index.
+    """
+    start = time.strftime("%H:%M:%S", time.gmtime(int(start)))
+    end = time.strftime("%H:%M:%S", time.gmtime(int(end)))
+    vtt = webvtt.read(subs_file)
+    transcript = ""
+    lines = []
+    for caption in vtt:
+        if caption.end > start and caption.start < end:
+            lines.extend(caption.text.strip().splitlines())
+    previous = None
+    for line in lines:
+        if line == previous:
+            continue
+        transcript += " " + line
+        previous = line
+    return transcript
+
+
+def run(hours: float, lookups: int) -> Dict[str, float]:
+    tmp_dir = tempfile.mkdtemp(prefix="audio-assistant-bench-")
+    try:
+        vtt_fp = os.path.join(tmp_dir, "topic.en.vtt")
+        n_cues = write_auto_captions(vtt_fp, hours)
+        rng = random.Random(1)
+        ranges = []
+        for _ in range(lookups):
+            start = rng.uniform(0, hours * 3600 - 30)
+            ranges.append((start, start + rng.uniform(5, 30)))
+        print(f"{n_cues} cues, {os.path.getsize(vtt_fp) // 1024} KiB")
+
+        timings: Dict[str, float] = {}
+
+        def timed(name: str, lookup, n: int) -> None:
+            start_time = time.perf_counter()
+            for start, end in ranges[:n]:
+                lookup(start, end)
+            timings[name] = (time.perf_counter() - start_time) / n
+            print(f"{name:>16}: {timings[name] * 1000:.3f}ms per lookup")
+
+        # Re-parsing takes seconds per lookup on long files.
+        timed("re-parse", lambda start, end:
+              reparse_find_within_range(start, end, vtt_fp),
+              min(lookups, 5))
+
+        def cold(start, end):
+            vtt_index._cache.clear()
+            if os.path.exists(index_filepath(vtt_fp)):
+                os.remove(index_filepath(vtt_fp))
+            join_lines(load_index(vtt_fp).within(start, end))
+        timed("parse + save", cold, min(lookups, 5))
+
+        def saved(start, end):
+            vtt_index._cache.clear()
+            join_lines(load_index(vtt_fp).within(start, end))
+        timed("load saved index", saved, lookups)
+
+        timed("cached index", lambda start, end:
+              join_lines(load_index(vtt_fp).within(start, end)),
+              lookups)
+        return timings
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 3,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -0,0 +1,99 @@
+"""Time computing waveform peaks of WAV files one by one and on the
+PeakIndexer process pool, and reading the peaks of a window from the
+index against reducing the window's samples from the audio.
+
+Run from the repository root:
+
+    python -m benchmarks.waveform_benchmark [n_files] [minutes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from typing import Dict
+import numpy as np
+import wav_cloze
+from peak_index import load_index, samples_per_peak, level0
+from waveform import PeakIndexer, index_file
+
+RATE = 16000
+# Windows read, as (seconds, peaks wide).
+WINDOWS = ((10, 1000), (600, 1000), (3600, 2000))
+# Times each window is read.
+REPEATS = 50
+
+
+def write_audio(filepath: str, minutes: float) -> None:
+    """Write a mono 16 bit noise WAV file."""
+    frames = int(minutes * 60 * RATE)
+    noise = np.random.default_rng(0).integers(-3000, 3000, frames,
+                                              dtype=np.int16)
+    with wave.open(filepath, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(noise.tobytes())
+
+
+def run(n_files: int, minutes: float) -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    tmp_dir = tempfile.mkdtemp(prefix="audio-assistant-bench-")
+    try:
+        filepaths = [os.path.join(tmp_dir, f"{n}.wav")
+                     for n in range(n_files)]
+        for filepath in filepaths:
+            write_audio(filepath, minutes)
+        hours = n_files * minutes / 60
+
+        start_time = time.perf_counter()
+        for filepath in filepaths:
+            assert index_file(filepath) == (0, "")
+        timings["serial"] = time.perf_counter() - start_time
+
+        indexer = PeakIndexer()
+        try:
+            # Start the worker processes before timing.
+            indexer.submit(filepaths[0]).result()
+            start_time = time.perf_counter()
+            futures = [indexer.submit(filepath) for filepath in filepaths]
+            assert all(future.result() == (0, "") for future in futures)
+            timings["pool"] = time.perf_counter() - start_time
+        finally:
+            indexer.shutdown()
+        for name in ("serial", "pool"):
+            print(f"{name:>8}: {timings[name]:.2f}s for {hours:.1f}h of "
+                  f"audio, {timings[name] / hours:.2f}s per hour")
+
+        index = load_index(filepaths[0])
+        samples = wav_cloze.read_wav(filepaths[0]).samples
+        for seconds, width in WINDOWS:
+            seconds = min(seconds, index.duration)
+
+            start_time = time.perf_counter()
+            for _ in range(REPEATS):
+                index.window(0, seconds, width)
+            indexed = (time.perf_counter() - start_time) / REPEATS
+
+            # What drawing the window cost without the index.
+            start_time = time.perf_counter()
+            for _ in range(REPEATS):
+                window = samples[:int(seconds * RATE)]
+                level0([window], max(samples_per_peak(RATE),
+                                     len(window) // width))
+            decoded = (time.perf_counter() - start_time) / REPEATS
+
+            timings[f"{seconds}s index"] = indexed
+            timings[f"{seconds}s audio"] = decoded
+            print(f"{seconds:>7}s window, {width} peaks: "
+                  f"{indexed * 1000:.3f}ms from the index, "
+                  f"{decoded * 1000:.3f}ms from the audio")
+    finally:
+        shutil.rmtree(tmp_dir)
+    return timings
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 60)
@@ -0,0 +1,41 @@
+from models import Playlist
+import sys
+import logging
+from typing import List, Dict
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("check_counters.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+
+def check_counters(fix: bool = False) -> List[Dict]:
+    """Recount the denormalised counters and report drift.
+
+    :fix: Overwrite drifted counters with the recounted values.
+    :returns: One dict per drifted row.
+    """
+    drift = Playlist.check_outstanding_counts(fix=fix)
+    for row in drift:
+        logger.warning(f"Playlist {row['id']} ({row['title']}) "
+                       f"outstanding_count is {row['stored']}, "
+                       f"recounted {row['actual']}."
+                       + (" Fixed." if fix else ""))
+    if not drift:
+        logger.info("Playlist outstanding counts are consistent.")
+    return drift
+
+
+if __name__ == "__main__":
+    drift = check_counters(fix="--fix" in sys.argv)
+    sys.exit(1 if drift and "--fix" not in sys.argv else 0)
@@ -0,0 +1,193 @@
+"""Background download jobs for the API.
+
+POST /assistant/download creates a job and returns its id straight
+away. The download runs on a worker thread and reports its progress to a
+DownloadJobStore, which the API reads for polling and for Server-Sent
+Events streams. Several downloads can run and report at the same time.
+"""
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from models import Session
+from AudioDownloader import AudioDownloader
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("download_jobs.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# Concurrent API downloads.
+DOWNLOAD_JOB_WORKERS = 2
+# Seconds finished jobs are kept for polling.
+DOWNLOAD_JOB_TTL = 60 * 60
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+FINISHED = "finished"
+ERROR = "error"
+DONE_STATUSES = (FINISHED, ERROR)
+
+
+class DownloadJobStore(object):
+
+    """Thread-safe progress of download jobs.
+
+    Every update bumps the job's version and wakes threads waiting for
+    changes, eg. Server-Sent Events streams.
+    """
+
+    def __init__(self, ttl: float = DOWNLOAD_JOB_TTL):
+        """
+        :ttl: Seconds finished jobs are kept.
+        """
+        self.ttl = ttl
+        self._jobs: Dict[str, Dict] = {}
+        self._changed = threading.Condition()
+
+    def create(self, request: Dict) -> Dict:
+        """Add a queued job for a download request.
+
+        :returns: A copy of the job.
+        """
+        now = time.time()
+        job = {"id": uuid.uuid4().hex,
+               "yt_id": request.get("yt_id"),
+               "status": QUEUED,
+               "progress": 0,
+               "downloads": 0,
+               "error": None,
+               "created_at": now,
+               "updated_at": now,
+               "version": 0}
+        with self._changed:
+            self._prune(now)
+            self._jobs[job["id"]] = job
+            return dict(job)
+
+    def update(self, job_id: str, **fields) -> None:
+        """Change fields of a job and wake up waiting readers.
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["updated_at"] = time.time()
+            job["version"] += 1
+            self._changed.notify_all()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        :returns: A copy of the job or None if it does not exist.
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def all(self) -> List[Dict]:
+        """
+        :returns: Copies of all jobs, newest first.
+        """
+        with self._changed:
+            return sorted((dict(job) for job in self._jobs.values()),
+                          key=lambda job: job["created_at"],
+                          reverse=True)
+
+    def wait(self, job_id: str, version: int,
+             timeout: float) -> Optional[Dict]:
+        """Block until the job is newer than version or timeout passes.
+
+        :returns: A copy of the job or None if it does not exist.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                    lambda: self._jobs.get(job_id, {}).get("version",
+                                                           version + 1)
+                    > version,
+                    timeout)
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def progress_hook(self, job_id: str):
+        """
+        :returns: youtube_dl progress hook reporting to the job.
+        """
+        def hook(target: Dict) -> None:
+            if target['status'] == 'downloading':
+                total = target.get('total_bytes') or \
+                        target.get('total_bytes_estimate')
+                if total and target.get('downloaded_bytes'):
+                    progress = int(target['downloaded_bytes'] / total * 100)
+                    job = self.get(job_id)
+                    if job and job["progress"] != progress:
+                        self.update(job_id, status=DOWNLOADING,
+                                    progress=progress)
+            elif target['status'] == 'finished':
+                self.update(job_id, progress=100)
+            elif target['status'] == 'error':
+                self.update(job_id, error="Download failed.")
+        return hook
+
+    def _prune(self, now: float) -> None:
+        for job_id, job in list(self._jobs.items()):
+            if job["status"] in DONE_STATUSES and \
+               now - job["updated_at"] > self.ttl:
+                del self._jobs[job_id]
+
+
+class DownloadJobRunner(object):
+
+    """Runs download requests on a thread pool, reporting to a store.
+    """
+
+    def __init__(self, store: DownloadJobStore,
+                 workers: int = DOWNLOAD_JOB_WORKERS):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="download")
+
+    def submit(self, request: Dict) -> Dict:
+        """Queue a download.
+
+        :request: AudioDownloader keyword arguments.
+        :returns: The new job.
+        """
+        job = self.store.create(request)
+        self._executor.submit(self.run, job["id"], request)
+        return job
+
+    def run(self, job_id: str, request: Dict) -> None:
+        self.store.update(job_id, status=DOWNLOADING)
+        db = Session()
+        try:
+            downloader = AudioDownloader(
+                    progress_hooks=[self.store.progress_hook(job_id)],
+                    db=db,
+                    **request)
+            downloader.download()
+            error = downloader.error or self.store.get(job_id)["error"]
+            # A playlist download with some failed videos still finishes.
+            failed = error and downloader.downloads == 0
+            self.store.update(job_id,
+                              status=ERROR if failed else FINISHED,
+                              downloads=downloader.downloads,
+                              error=error)
+        except Exception as e:
+            logger.error(f"Download job {job_id} failed with exception {e}.")
+            db.rollback()
+            self.store.update(job_id, status=ERROR, error=str(e))
+        finally:
+            db.close()
@@ -1,11 +1,19 @@
 from models import (TopicFile,
                     ExtractFile,
                     ItemFile,
+                    TopicEvent,
+                    ExtractEvent,
+                    ItemEvent,
+                    find_media_file,
                     session)
+import mpd
+from mpd import MPDClient
+import datetime
+import socket
 import time
 import logging
 from MPD.MpdBase import Mpd
-from typing import Union, Optional
+from typing import Union, Optional, List, Tuple
 
 
 logger = logging.getLogger(__name__)
@@ -24,92 +32,172 @@ logger.addHandler(console_handler)
 
 class MpdHeartbeat(Mpd, object):
 
-    def __init__(self, interval=5):
+    """Tracks MPD playback and records it in the DB.
+
+    Blocks on MPD's "idle player" instead of polling, so nothing runs while
+    playback is paused. Between player events the position is
+    interpolated locally. The DB is only written on state transitions
+    and every flush_interval seconds while playing.
+    """
+
+    def __init__(self, flush_interval: float = 30):
         """
-        :interval: Seconds between polls.
+        :flush_interval: Seconds between writes of the current position
+        while playing.
+
+        :idle_client: Separate connection that blocks in idle.
+
+        :state: Last known MPD state (play, pause or stop).
+
+        :file: Row of the current track or None.
+
+        :elapsed: Position of the current track at changed_at.
+
+        :changed_at: time.monotonic() when elapsed was read from MPD.
+
+        :event: Open event row of the current track or None.
         """
         super().__init__()
-        self.interval = interval
+        self.flush_interval = flush_interval
+        self.idle_client = MPDClient()
+        self.idle_client.timeout = 10
+        self.idle_connected = False
+
+        # State
+        self.state: str = "stop"
+        self.abs_fp: Optional[str] = None
+        self.file: Optional[Union[TopicFile, ExtractFile, ItemFile]] = None
+        self.elapsed: float = 0.0
+        self.changed_at: float = time.monotonic()
+        self.event: Optional[Union[TopicEvent,
+                                   ExtractEvent,
+                                   ItemEvent]] = None
 
     def find_file(self, filepath: str) -> Optional[Union[TopicFile,
                                                          ItemFile,
                                                          ExtractFile]]:
-        """Search TopicFile, ExtractFile and ItemFile tables to find the row
-        corresponding to the filepath.
+        """Find the TopicFile, ExtractFile or ItemFile row corresponding to
+        the filepath with one lookup in the media_files table.
         """
+        file = find_media_file(filepath)
+        if file:
+            logger.info(f"Found currently playing {file}.")
+        return file
 
-        # Search TopicFile table
-        topic: TopicFile = (session
-                            .query(TopicFile)
-                            .filter_by(filepath=filepath)
-                            .one_or_none())
-        if topic:
-            logger.info(f"Found currently playing {topic}.")
-            return topic
-        
-        else:
-            # Search ExtractFile table
-            extract: ExtractFile = (session
-                                    .query(ExtractFile)
-                                    .filter_by(filepath=filepath)
-                                    .one_or_none())
-            if extract:
-                logger.info(f"Found currently playing {extract}.")
-                return extract
+    def position(self) -> float:
+        """
+        :returns: Interpolated position of the current track in seconds.
+        """
+        if self.state == "play":
+            return self.elapsed + (time.monotonic() - self.changed_at)
+        return self.elapsed
 
-            else:
-                # Search ItemFile table
-                item: ItemFile = (session
-                                  .query(ItemFile)
-                                  .filter_by(question_filepath=filepath)
-                                  .one_or_none())
+    def wait_for_change(self) -> List[str]:
+        """Block until MPD reports a player change.
 
-                if item:
-                    logger.info(f"Found currently playing {item}.")
-                    return item
+        While playing, gives up after flush_interval seconds so the
+        position can be flushed. While paused or stopped, blocks
+        indefinitely.
 
-        return None
+        :returns: Changed subsystems, empty if the wait timed out.
+        """
+        self.idle_client.idletimeout = (self.flush_interval
+                                        if self.state == "play" else None)
+        try:
+            if not self.idle_connected:
+                self.idle_client.connect(self.host, self.port)
+                self.idle_connected = True
+            return self.idle_client.idle("player")
+        except socket.timeout:
+            # The timed out idle is still pending on the server.
+            self.reset_idle_client()
+            return []
+        except (mpd.base.ConnectionError, OSError) as e:
+            logger.error(f"Idle connection to MPD failed with "
+                         f"exception {e}.")
+            self.reset_idle_client()
+            time.sleep(5)
+            # Re-read the state, changes may have been missed.
+            return ["player"]
+
+    def reset_idle_client(self) -> None:
+        try:
+            self.idle_client.disconnect()
+        except (mpd.base.ConnectionError, OSError):
+            pass
+        self.idle_connected = False
+
+    def read_player(self) -> Tuple[str, Optional[str], float]:
+        """
+        :returns: MPD state, abs_fp of the current track and elapsed.
+        """
+        with self.connection():
+            status = self.client.status()
+            cur_song = self.client.currentsong()
+        rel_fp: Optional[str] = cur_song.get("file")
+        abs_fp = self.rel_to_abs(rel_fp) if rel_fp else None
+        return status["state"], abs_fp, float(status.get("elapsed", 0.0))
+
+    def handle_change(self) -> None:
+        """Read the player state after an MPD player event.
+
+        Seeks only resynchronise the interpolation. Track and state
+        changes flush the previous track and open a new event.
+        """
+        state, abs_fp, elapsed = self.read_player()
+        now = time.monotonic()
+
+        if abs_fp == self.abs_fp:
+            # MPD's elapsed is more accurate than the interpolation.
+            self.elapsed, self.changed_at = elapsed, now
+            if state == self.state:
+                return
+
+        self.flush()
+        self.event = None
+        if abs_fp != self.abs_fp:
+            self.abs_fp = abs_fp
+            self.file = self.find_file(abs_fp) if abs_fp else None
+            if abs_fp and not self.file:
+                logger.error("Currently playing track not found in DB.")
+        self.state = state
+        self.elapsed, self.changed_at = elapsed, now
+
+        if self.file and state != "stop":
+            self.event = self.file.add_event(event_type=state,
+                                             timestamp=elapsed,
+                                             duration=0)
+            if self.event:
+                logger.info(f"Added new {state} event for file {self.file}.")
+            else:
+                logger.error(f"Call to add_event on {self.file} failed.")
+
+    def flush(self) -> None:
+        """Write the current position and open event duration to the DB.
+        """
+        if not self.file:
+            return
+        position = self.position()
+        if isinstance(self.file, TopicFile):
+            if self.file.cur_timestamp is None or \
+               position > self.file.cur_timestamp:
+                self.file.cur_timestamp = position
+        if self.event:
+            self.event.timestamp = position
+            self.event.duration = (datetime.datetime.utcnow() -
+                                   self.event.created_at).total_seconds()
+        session.commit()
+        logger.debug(f"Flushed position {position:.1f}s of {self.file}.")
 
     def heartbeat_loop(self):
-        """Polls the MPD server, for events.
+        """Waits for MPD player events and records them.
         """
+        self.handle_change()
         while True:
-            cur_time = time.time()
-            with self.connection():
-                status = self.client.status()
-                event = status['state']
-                timestamp = status.get('elapsed')
-                filepath = self.current_track()['abs_fp']
-
-            if event != "stop" and timestamp and filepath:
-                file = self.find_file(filepath)
-                if file:
-                    events = file.events
-                    if events:
-                        last_event = max(events,
-                                         key=lambda event: event.created_at)
-                        # Check if same event
-                        if last_event.event == event:
-                            # Update duration
-                            duration = cur_time - (last_event
-                                                   .created_at
-                                                   .timestamp())
-                            last_event.duration = duration
-                            last_event.timestamp = timestamp
-                            session.commit()
-                            logger.info(f"Updated last event {last_event}.")
-                        # Create a new event
-                    else:
-                        if file.add_event(event_type=event,
-                                          timestamp=timestamp,
-                                          duration=0):
-                            session.commit()
-                            logger.info(f"Added new {event} event for file {file}.")
-                        else:
-                            logger.error(f"Call to add_event on {file} failed.")
-                else:
-                    logger.error("Currently playing track not found in DB.")
-            time.sleep(self.interval)
+            if self.wait_for_change():
+                self.handle_change()
+            else:
+                self.flush()
 
 
 if __name__ == "__main__":
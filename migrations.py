@@ -0,0 +1,366 @@
+"""Versioned schema migrations.
+
+Base.metadata.create_all only creates missing tables. Everything else
+(indexes, new columns, backfills) goes here as a numbered migration.
+migrate() runs every migration newer than the version stored in the
+schema_version table, each in its own transaction.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from typing import Callable, List, Tuple
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("migrations.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# (version, migration function) in the order they were added.
+MIGRATIONS: List[Tuple[int, Callable[[Connection], None]]] = []
+
+
+def migration(version: int) -> Callable:
+    """Register a function as the migration to schema version.
+    """
+    def register(func: Callable[[Connection], None]) -> Callable:
+        MIGRATIONS.append((version, func))
+        return func
+    return register
+
+
+def current_version(connection: Connection) -> int:
+    """
+    :returns: The schema version of the database, 0 if never migrated.
+    """
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version "
+                            "(version INTEGER NOT NULL)"))
+    version = connection.execute(
+            text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def column_names(connection: Connection, table: str) -> List[str]:
+    """
+    :returns: Names of the columns of the table.
+    """
+    rows = connection.execute(text(f"PRAGMA table_info({table})"))
+    return [row[1] for row in rows]
+
+
+def add_column(connection: Connection, table: str, column: str,
+               definition: str) -> bool:
+    """ALTER TABLE ADD COLUMN unless create_all already added it.
+
+    :definition: Column type and constraints eg. "FLOAT DEFAULT 0".
+    :returns: True if the column was added.
+    """
+    if column in column_names(connection, table):
+        return False
+    connection.execute(text(f"ALTER TABLE {table} "
+                            f"ADD COLUMN {column} {definition}"))
+    return True
+
+
+def migrate(engine: Engine) -> int:
+    """Apply pending migrations.
+
+    :returns: The schema version after migrating.
+    """
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    for target, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if target <= version:
+            continue
+        with engine.begin() as connection:
+            func(connection)
+            connection.execute(text("INSERT INTO schema_version (version) "
+                                    "VALUES (:version)"),
+                               version=target)
+        logger.info(f"Migrated database to version {target}: "
+                    f"{func.__name__}.")
+        version = target
+    return version
+
+
+##############
+# Migrations #
+##############
+
+@migration(1)
+def hot_path_indexes(connection: Connection) -> None:
+    """Indexes for the filters used by the Queue classes, heartbeat.py
+    and old_api.py.
+    """
+    statements = [
+        # TopicQueue.get_global_topics, MainQueue.get_extract_topic
+        "CREATE INDEX IF NOT EXISTS ix_topicfiles_outstanding "
+        "ON topicfiles (deleted, archived, created_at)",
+        # old_api.py /topics/ date filters
+        "CREATE INDEX IF NOT EXISTS ix_topicfiles_created_at "
+        "ON topicfiles (created_at)",
+        # Playlist.topics
+        "CREATE INDEX IF NOT EXISTS ix_topicfiles_playlist_id "
+        "ON topicfiles (playlist_id)",
+        # TopicFile.extracts
+        "CREATE INDEX IF NOT EXISTS ix_extractfiles_topic_id "
+        "ON extractfiles (topic_id)",
+        # ExtractQueue.get_global_extracts
+        "CREATE INDEX IF NOT EXISTS ix_extractfiles_deleted_created_at "
+        "ON extractfiles (deleted, created_at)",
+        # TopicQueue.stop_recording (last inserted extract)
+        "CREATE INDEX IF NOT EXISTS ix_extractfiles_created_at "
+        "ON extractfiles (created_at)",
+        # old_api.py /extracts/ only lists finished recordings
+        "CREATE INDEX IF NOT EXISTS ix_extractfiles_recorded "
+        "ON extractfiles (created_at) "
+        "WHERE filepath IS NOT NULL AND endstamp IS NOT NULL",
+        # ExtractFile.items
+        "CREATE INDEX IF NOT EXISTS ix_itemfiles_extract_id "
+        "ON itemfiles (extract_id)",
+        # ItemQueue.get_global_items only plays rendered questions
+        "CREATE INDEX IF NOT EXISTS ix_itemfiles_playable "
+        "ON itemfiles (deleted, created_at) "
+        "WHERE question_filepath IS NOT NULL",
+        # old_api.py /items/
+        "CREATE INDEX IF NOT EXISTS ix_itemfiles_clozed "
+        "ON itemfiles (created_at) "
+        "WHERE question_filepath IS NOT NULL AND cloze_endstamp IS NOT NULL",
+        # Event tables: per-file history and old_api.py /events/ filters
+        "CREATE INDEX IF NOT EXISTS ix_topicevents_topic_id_created_at "
+        "ON topicevents (topic_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_topicevents_created_at "
+        "ON topicevents (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_extractevents_extract_id_created_at "
+        "ON extractevents (extract_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_extractevents_created_at "
+        "ON extractevents (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_itemevents_item_id_created_at "
+        "ON itemevents (item_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_itemevents_created_at "
+        "ON itemevents (created_at)",
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@migration(2)
+def backfill_media_files(connection: Connection) -> None:
+    """Fill media_files for rows created before the table existed.
+    """
+    for table, entity_type, column in (("topicfiles", "topic", "filepath"),
+                                       ("extractfiles", "extract", "filepath"),
+                                       ("itemfiles", "item",
+                                        "question_filepath")):
+        connection.execute(text(
+            f"INSERT INTO media_files (filepath, entity_type, entity_id) "
+            f"SELECT {column}, '{entity_type}', id FROM {table} "
+            f"WHERE {column} IS NOT NULL AND {column} NOT IN "
+            f"(SELECT filepath FROM media_files)"))
+
+
+# The queue filter before nearly_done was cur_timestamp / duration < 0.9,
+# so a NULL or 0 duration and exactly 0.9 listened to are nearly done.
+NEARLY_DONE_BACKFILL = (
+    "UPDATE topicfiles SET nearly_done = "
+    "CASE WHEN COALESCE(cur_timestamp, 0) / duration < 0.9 "
+    "THEN 0 ELSE 1 END")
+
+
+@migration(3)
+def topic_nearly_done(connection: Connection) -> None:
+    """Persist whether a TopicFile is out of the queue because of its
+    progress, backfill it and index the outstanding topic queue on it.
+    """
+    add_column(connection, "topicfiles", "nearly_done", "BOOLEAN DEFAULT 0")
+    connection.execute(text(NEARLY_DONE_BACKFILL))
+    # TopicQueue.get_global_topics
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_topicfiles_queue "
+        "ON topicfiles (deleted, archived, nearly_done, created_at) "
+        "WHERE nearly_done = 0"))
+
+
+OUTSTANDING_RECOUNT = (
+    "UPDATE playlists SET outstanding_count = "
+    "(SELECT COUNT(*) FROM topicfiles "
+    "WHERE topicfiles.playlist_id = playlists.id "
+    "AND deleted = 0 AND archived = 0 AND nearly_done = 0)")
+
+
+@migration(4)
+def playlist_outstanding_count(connection: Connection) -> None:
+    """Count the outstanding TopicFiles of each playlist.
+    """
+    add_column(connection, "playlists", "outstanding_count",
+               "INTEGER NOT NULL DEFAULT 0")
+    connection.execute(text(OUTSTANDING_RECOUNT))
+
+
+@migration(5)
+def event_rollup_indexes(connection: Connection) -> None:
+    """Index the daily event rollups by day for old_api.py date ranges.
+
+    The rollup tables themselves are created by create_all.
+    """
+    for table in ("topicevent_rollups", "extractevent_rollups",
+                  "itemevent_rollups"):
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_day "
+                                f"ON {table} (day)"))
+
+
+@migration(6)
+def extract_render_status(connection: Connection) -> None:
+    """Track extracts waiting to be cut from their topic file.
+    """
+    add_column(connection, "extractfiles", "render_status", "VARCHAR")
+
+
+@migration(7)
+def render_jobs(connection: Connection) -> None:
+    """Track cloze renders and queue a RenderJob for every extract still
+    waiting to be cut.
+
+    The render_jobs table itself is created by create_all.
+    """
+    add_column(connection, "itemfiles", "render_status", "VARCHAR")
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_render_jobs_status_run_after "
+        "ON render_jobs (status, run_after)"))
+    connection.execute(text(
+        "INSERT INTO render_jobs (kind, entity_id, status, attempts, "
+        "created_at, run_after) "
+        "SELECT 'extract', id, 'pending', 0, "
+        "CURRENT_TIMESTAMP, CURRENT_TIMESTAMP "
+        "FROM extractfiles "
+        "WHERE render_status = 'pending' AND endstamp IS NOT NULL"))
+
+
+@migration(8)
+def transcript_search(connection: Connection) -> None:
+    """Full-text index of transcript_cues, kept in sync by triggers, and
+    the transcript_cues of existing extract transcripts.
+
+    The transcript_cues table itself is created by create_all. Topic
+    cues are parsed from the VTT files by transcript_search.py.
+    """
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS transcript_fts USING fts5("
+        "text, content='transcript_cues', content_rowid='id', "
+        "tokenize='porter unicode61')",
+        "CREATE TRIGGER IF NOT EXISTS transcript_cues_ai "
+        "AFTER INSERT ON transcript_cues BEGIN "
+        "INSERT INTO transcript_fts (rowid, text) "
+        "VALUES (new.id, new.text); END",
+        "CREATE TRIGGER IF NOT EXISTS transcript_cues_ad "
+        "AFTER DELETE ON transcript_cues BEGIN "
+        "INSERT INTO transcript_fts (transcript_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); END",
+        "CREATE TRIGGER IF NOT EXISTS transcript_cues_au "
+        "AFTER UPDATE ON transcript_cues BEGIN "
+        "INSERT INTO transcript_fts (transcript_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "INSERT INTO transcript_fts (rowid, text) "
+        "VALUES (new.id, new.text); END",
+        "INSERT INTO transcript_cues (topic_id, extract_id, start_ms, "
+        "end_ms, text) "
+        "SELECT e.topic_id, e.id, "
+        "CAST(e.startstamp * COALESCE(t.playback_rate, 1.0) * 1000 "
+        "AS INTEGER), "
+        "CAST(e.endstamp * COALESCE(t.playback_rate, 1.0) * 1000 "
+        "AS INTEGER), "
+        "e.transcript "
+        "FROM extractfiles e JOIN topicfiles t ON t.id = e.topic_id "
+        "WHERE e.transcript IS NOT NULL AND e.transcript != '' "
+        "AND e.deleted IS NOT 1 "
+        "AND e.id NOT IN (SELECT extract_id FROM transcript_cues "
+        "WHERE extract_id IS NOT NULL)",
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@migration(9)
+def keyset_pagination_indexes(connection: Connection) -> None:
+    """Index the per-parent old_api.py collections in cursor order,
+    (created_at, id), so pages need no sort.
+    """
+    statements = [
+        # old_api.py /topics/<id>/extracts
+        "CREATE INDEX IF NOT EXISTS ix_extractfiles_topic_id_created_at "
+        "ON extractfiles (topic_id, created_at)",
+        # old_api.py /extracts/<id>/items
+        "CREATE INDEX IF NOT EXISTS ix_itemfiles_extract_id_created_at "
+        "ON itemfiles (extract_id, created_at)",
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@migration(10)
+def row_versions(connection: Connection) -> None:
+    """Count the changes to every TopicFile, ExtractFile and ItemFile, so
+    old_api.py can cache rendered cards by (id, version).
+
+    Triggers rather than mapper events so bulk and raw SQL updates bump
+    the version too. recursive_triggers is off, so the trigger's own
+    UPDATE does not fire it again.
+    """
+    for table in ("topicfiles", "extractfiles", "itemfiles"):
+        add_column(connection, table, "version", "INTEGER NOT NULL DEFAULT 0")
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_version "
+            f"AFTER UPDATE ON {table} FOR EACH ROW "
+            f"WHEN NEW.version = OLD.version BEGIN "
+            f"UPDATE {table} SET version = OLD.version + 1 "
+            f"WHERE id = NEW.id; END"))
+
+
+@migration(11)
+def nearly_done_null_duration(connection: Connection) -> None:
+    """Backfill nearly_done again for the TopicFiles migration 3 put in the
+    queue although the queue filter before it left them out, those with a
+    NULL or 0 duration or exactly 90% listened to, and recount
+    Playlist.outstanding_count.
+    """
+    connection.execute(text(NEARLY_DONE_BACKFILL))
+    connection.execute(text(OUTSTANDING_RECOUNT))
+
+
+# TopicFile flags that take a TopicFile out of the queue.
+TOPIC_FLAGS = ("deleted", "archived", "nearly_done")
+
+
+@migration(12)
+def topic_flags_not_null(connection: Connection) -> None:
+    """Set NULL deleted, archived and nearly_done flags of TopicFiles to 0.
+
+    TopicFile.is_outstanding counts a NULL flag as false, but the queue
+    filter TopicFile.outstanding_condition compares with 0 so that SQLite
+    can use ix_topicfiles_queue, which left those rows out of the queue.
+    SQLite can't add NOT NULL to an existing column, so triggers reject
+    NULL flags from now on, as create_all does for new databases.
+    """
+    for flag in TOPIC_FLAGS:
+        connection.execute(text(f"UPDATE topicfiles SET {flag} = 0 "
+                                f"WHERE {flag} IS NULL"))
+    any_null = " OR ".join(f"NEW.{flag} IS NULL" for flag in TOPIC_FLAGS)
+    for event in ("INSERT", "UPDATE"):
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS "
+            f"topicfiles_flags_not_null_{event.lower()} "
+            f"BEFORE {event} ON topicfiles FOR EACH ROW "
+            f"WHEN {any_null} BEGIN "
+            f"SELECT RAISE(ABORT, 'NOT NULL constraint failed: "
+            f"topicfiles flags'); END"))
+    connection.execute(text(OUTSTANDING_RECOUNT))
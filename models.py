@@ -2,18 +2,26 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import (Column, Integer,
-                        String, DateTime,
+                        String, DateTime, Date,
                         Text,
                         ForeignKey, Boolean,
-                        Float)
+                        Float, or_, and_,
+                        inspect, literal, select,
+                        func, update, false, cast,
+                        UniqueConstraint)
+from sqlalchemy.event import listen, listens_for
+from sqlalchemy.exc import SQLAlchemyError
 import datetime
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Query, object_session
 from config import DATABASE_URI, QUESTIONFILES_DIR
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from migrations import migrate
+from vtt_index import index_filepath
+from peak_index import peaks_filepath
 import os
 import logging
-import subprocess
-from subprocess import DEVNULL
 
 engine = create_engine(DATABASE_URI, echo=False)
 Base = declarative_base()
@@ -34,6 +42,16 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
+# TopicFiles listened to beyond this fraction count as finished.
+FINISHED_RATIO = 0.9
+
+# Render states of audio files created in the background by renderer.py
+# and of the RenderJobs creating them.
+RENDER_PENDING = "pending"
+RENDER_RUNNING = "running"
+RENDER_DONE = "done"
+RENDER_FAILED = "failed"
+
 
 def delete_file(file) -> bool:
     """Deletes a file.
@@ -54,6 +72,82 @@ def delete_file(file) -> bool:
     return False
 
 
+def delete_audio_file(file) -> bool:
+    """Deletes an audio file and its waveform peaks, if any.
+    :returns: True if the audio file was deleted else False.
+    """
+    if file and os.path.isfile(peaks_filepath(file)):
+        delete_file(peaks_filepath(file))
+    return delete_file(file)
+
+
+def reap_finished(model, dry_run: bool = False,
+                  max_workers: int = 4, chunk_size: int = 500) -> Dict:
+    """Remove the files of finished rows and mark the rows deleted.
+
+    Finished rows are selected with a single query (model.finished_query),
+    files are unlinked on a thread pool and the deleted flags are set in
+    one transaction.
+
+    :model: TopicFile, ExtractFile or ItemFile.
+    :dry_run: Report what would be removed without touching anything.
+    :max_workers: Number of threads used to unlink files.
+    :chunk_size: Number of ids per UPDATE statement.
+    :returns: Report dict with the finished, deleted and failed rows.
+    """
+    rows = model.finished_query().all()
+    # Read the filepaths before handing them to the worker threads.
+    paths: List[Tuple[Optional[str], ...]] = [row.file_paths() for row in rows]
+    report = {
+            "table": model.__tablename__,
+            "dry_run": dry_run,
+            "finished": len(rows),
+            "deleted": 0,
+            "failed": [],
+            "files": [path for row_paths in paths
+                      for path in row_paths if path]
+    }
+
+    if dry_run:
+        for row in rows:
+            logger.info(f"Dry run: would remove {row}.")
+        return report
+
+    if not rows:
+        return report
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda p: model.unlink_files(*p), paths))
+
+    deleted_ids: List[int] = []
+    for row, result in zip(rows, results):
+        if result:
+            deleted_ids.append(row.id)
+        else:
+            report["failed"].append(row.id)
+
+    try:
+        for i in range(0, len(deleted_ids), chunk_size):
+            chunk = deleted_ids[i:i + chunk_size]
+            (session
+             .query(model)
+             .filter(model.id.in_(chunk))
+             .update({model.deleted: True}, synchronize_session=False))
+            # The bulk update skips the mapper events that drop these.
+            drop_transcript_cues(session.connection(), model, chunk)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.error(f"Failed to mark {model.__tablename__} rows deleted "
+                     f"with exception {e}.")
+        return report
+
+    report["deleted"] = len(deleted_ids)
+    logger.info(f"Removed {len(deleted_ids)} finished rows from "
+                f"{model.__tablename__}, {len(report['failed'])} failed.")
+    return report
+
+
 class Playlist(Base):
 
     """Represents a youtube playlist containing TopicFiles.
@@ -73,6 +167,9 @@ class Playlist(Base):
     archived: bool = Column(Boolean, default=False)
     # Aim to keep this many videos from this playlist in the TopicFile queue.
     outstanding_target: int = Column(Integer, default=1)
+    # Number of TopicFiles from this playlist in the TopicFile queue.
+    # Maintained by the TopicFile mapper events at the bottom of the file.
+    outstanding_count: int = Column(Integer, default=0, nullable=False)
 
     # One to many Playlist |-< TopicFile
     topics: List["TopicFile"] = relationship("TopicFile",
@@ -82,11 +179,39 @@ class Playlist(Base):
         """
         :returns: Number of outstanding TopicFiles for the playlist.
         """
-        not_finished = 0
-        for topic in self.topics:
-            if not topic.is_finished():
-                not_finished += 1
-        return not_finished
+        return self.outstanding_count
+
+    @classmethod
+    def check_outstanding_counts(cls, fix: bool = False) -> List[Dict]:
+        """Recount outstanding TopicFiles for every playlist in one query
+        and compare with the stored outstanding_count.
+
+        Bulk query.update() calls bypass the mapper events, so the
+        counters can drift if a script edits topicfiles directly.
+
+        :fix: Overwrite drifted counters with the recounted value.
+        :returns: Dicts with playlist id, title, stored and actual counts
+        for every playlist that drifted.
+        """
+        actual = (session
+                  .query(TopicFile.playlist_id, func.count(TopicFile.id))
+                  .filter(TopicFile.outstanding_condition())
+                  .filter(TopicFile.playlist_id != None)
+                  .group_by(TopicFile.playlist_id))
+        counts = dict(actual.all())
+        drift: List[Dict] = []
+        for playlist in session.query(cls):
+            count = counts.get(playlist.id, 0)
+            if playlist.outstanding_count != count:
+                drift.append({"id": playlist.id,
+                              "title": playlist.title,
+                              "stored": playlist.outstanding_count,
+                              "actual": count})
+                if fix:
+                    playlist.outstanding_count = count
+        if fix and drift:
+            session.commit()
+        return drift
 
     def __repr__(self):
         return f"<Playlist: id={self.id} title={self.title}>"
@@ -116,10 +241,10 @@ class TopicFile(Base):
     sm_priority: float = Column(Float, default=-1)
     # Can be set by the user at runtime
     # Can be set automatically if completion > 90%
-    archived: bool = Column(Boolean, default=False)
+    archived: bool = Column(Boolean, nullable=False, default=False)
     # If no outstanding extracts and archived is True,
     # Topic will be deleted by a script and deleted will be set to 1
-    deleted: bool = Column(Boolean, default=False)
+    deleted: bool = Column(Boolean, nullable=False, default=False)
     language: str = Column(String)
     youtube_id: str = Column(String, unique=True)
     title: str = Column(String)
@@ -134,8 +259,14 @@ class TopicFile(Base):
     average_rating: float = Column(Float)  # 0 to 5 float
     playback_rate: float = Column(Float, default=1.0)  # eg. 1, 1.25, 1.5
     cur_timestamp: float = Column(Float, default=0)  # seconds.miliseconds
+    # Out of the queue because of its progress, ie. not under
+    # FINISHED_RATIO listened to or without a duration. Maintained by the
+    # events below on insert and whenever cur_timestamp or duration change.
+    nearly_done: bool = Column(Boolean, nullable=False, default=False)
     created_at: DateTime = Column(DateTime, default=datetime.datetime.utcnow)
     transcript_filepath: str = Column(Text)  # webvtt format if available
+    # Bumped by a trigger on every UPDATE, see migrations.row_versions.
+    version: int = Column(Integer, nullable=False, default=0)
 
     # Many to One TopicFiles >-| Playlist
     playlist_id: int = Column(Integer, ForeignKey('playlists.id'))
@@ -151,38 +282,67 @@ class TopicFile(Base):
                                               back_populates="topic")
 
     @classmethod
-    def remove_finished_files(cls) -> None:
+    def remove_finished_files(cls, dry_run: bool = False) -> Dict:
         """Remove finished TopicFiles.
 
         Removes the audio filepath and subs file.
         """
-        topics: List[TopicFile] = (session
-                                   .query(TopicFile)
-                                   .filter_by(deleted=False)
-                                   .all())
-        if topics:
-            for topic in topics:
-                if topic.is_finished():
-                    if topic.transcript_filepath:
-                        delete_file(topic.transcript_filepath)
-                    if delete_file(topic.filepath):
-                        topic.deleted = True
-                        session.commit()
-        
-    def add_event(self, event_type: str, timestamp: float, duration: float):
+        return reap_finished(cls, dry_run=dry_run)
+
+    @classmethod
+    def finished_query(cls) -> Query:
+        """Query for undeleted TopicFiles matching TopicFile.is_finished.
+        """
+        outstanding_extracts = (session
+                                .query(ExtractFile.id)
+                                .filter(ExtractFile.topic_id == cls.id)
+                                .filter(ExtractFile.deleted.isnot(True))
+                                .exists())
+        return (session
+                .query(cls)
+                .filter(cls.deleted.isnot(True))
+                .filter(or_(and_(cls.nearly_done == True,
+                                 cls.cur_timestamp / cls.duration
+                                 > FINISHED_RATIO),
+                            cls.archived == True))
+                .filter(~outstanding_extracts))
+
+    def file_paths(self) -> Tuple[Optional[str], ...]:
+        """
+        :returns: Arguments for TopicFile.unlink_files.
+        """
+        return (self.filepath, self.transcript_filepath)
+
+    @staticmethod
+    def unlink_files(filepath: str,
+                     transcript_filepath: Optional[str]) -> bool:
+        """Remove the audio file, subs file and the subs' cue index.
+        :returns: True if the audio file was removed else False.
+        """
+        if transcript_filepath:
+            delete_file(transcript_filepath)
+            if os.path.isfile(index_filepath(transcript_filepath)):
+                delete_file(index_filepath(transcript_filepath))
+        return delete_audio_file(filepath)
+
+    def add_event(self, event_type: str, timestamp: float,
+                  duration: float) -> Optional["TopicEvent"]:
         """Add an event to the TopicFile.
-        :returns: True on success else False.
+
+        Does not load the events collection.
+        :returns: The new event on success else None.
         """
         if event_type in ["stop", "play", "pause"]:
             event = TopicEvent(event=event_type,
                                timestamp=timestamp,
-                               duration=duration)
-            self.events.append(event)
+                               duration=duration,
+                               topic_id=self.id)
+            session.add(event)
             session.commit()
             logger.debug(f"Added {event_type} event to {self} with "
                          f"duration {duration}s.")
-            return True
-        return False
+            return event
+        return None
 
     def is_finished(self) -> bool:
         """A finished TopicFile fulfils the following criteria.
@@ -195,7 +355,8 @@ class TopicFile(Base):
 
         :returns: True if the file is finished else False.
         """
-        if ((self.cur_timestamp / self.duration) > 0.9) or self.archived:
+        if self.is_listened(self.cur_timestamp, self.duration) or \
+           self.archived:
             extracts = self.extracts
             if extracts:
                 if all(extract.deleted for extract in extracts):
@@ -211,10 +372,81 @@ class TopicFile(Base):
         """
         return (self.cur_timestamp / self.duration) * 100
 
+    @classmethod
+    def outstanding_condition(cls):
+        """SQL condition for TopicFiles still in the TopicFile queue.
+
+        Literal false() so SQLite can use the partial ix_topicfiles_queue.
+        The flags are NOT NULL (see migrations.topic_flags_not_null), so
+        this matches TopicFile.is_outstanding.
+        """
+        return and_(cls.deleted == false(),
+                    cls.archived == false(),
+                    cls.nearly_done == false())
+
+    @classmethod
+    def queue_query(cls) -> Query:
+        """Query for the TopicFile queue, oldest first.
+        """
+        return (session
+                .query(cls)
+                .filter(cls.outstanding_condition())
+                .order_by(cls.created_at.asc()))
+
+    @staticmethod
+    def is_outstanding(deleted: Optional[bool], archived: Optional[bool],
+                       nearly_done: Optional[bool]) -> bool:
+        """
+        :returns: True if a TopicFile in this state is in the TopicFile queue.
+        """
+        return not (deleted or archived or nearly_done)
+
+    @staticmethod
+    def is_listened(cur_timestamp: Optional[float],
+                    duration: Optional[float]) -> bool:
+        """
+        :returns: True if over FINISHED_RATIO of the duration was listened to.
+        """
+        if not duration:
+            return False
+        return ((cur_timestamp or 0) / duration) > FINISHED_RATIO
+
+    @staticmethod
+    def is_nearly_done(cur_timestamp: Optional[float],
+                       duration: Optional[float]) -> bool:
+        """Like the SQL filter cur_timestamp / duration < FINISHED_RATIO
+        the queue used before nearly_done, a NULL or 0 duration or exactly
+        FINISHED_RATIO listened to keeps a TopicFile out of the queue. A
+        None cur_timestamp is the column default, 0.
+
+        :returns: True if the TopicFile is out of the queue because of its
+        progress.
+        """
+        if not duration:
+            return True
+        return ((cur_timestamp or 0) / duration) >= FINISHED_RATIO
+
     def __repr__(self) -> str:
         return f"<TopicFile: title={self.title}>"
 
 
+@listens_for(TopicFile, "before_insert")
+def topic_before_insert(mapper, connection, target):
+    # TopicFiles created without a duration never fire the set events.
+    target.nearly_done = TopicFile.is_nearly_done(target.cur_timestamp,
+                                                  target.duration)
+
+
+@listens_for(TopicFile.cur_timestamp, "set")
+def topic_cur_timestamp_set(target, value, oldvalue, initiator):
+    target.nearly_done = TopicFile.is_nearly_done(value, target.duration)
+
+
+@listens_for(TopicFile.duration, "set")
+def topic_duration_set(target, value, oldvalue, initiator):
+    target.nearly_done = TopicFile.is_nearly_done(target.cur_timestamp, value)
+
+
 class ExtractFile(Base):
     """ Recorded sections from TopicFiles
     ExtractFiles are all descendants of a TopicFile
@@ -237,6 +469,11 @@ class ExtractFile(Base):
     to_export: bool = Column(Boolean, default=False)
     # Added from SM importer
     transcript: str = Column(String)
+    # Extracts cut from the topic file by renderer.py are RENDER_PENDING
+    # until the file exists. None for extracts recorded with parecord.
+    render_status: str = Column(String)
+    # Bumped by a trigger on every UPDATE, see migrations.row_versions.
+    version: int = Column(Integer, nullable=False, default=0)
 
     sm_element_id: int = Column(Integer, default=-1)
     sm_priority: float = Column(Float, default=-1)
@@ -253,34 +490,58 @@ class ExtractFile(Base):
     events = relationship("ExtractEvent", back_populates="extract")
 
     @classmethod
-    def remove_finished_files(cls) -> None:
+    def remove_finished_files(cls, dry_run: bool = False) -> Dict:
         """Remove finished ExtractFiles.
         """
-        extracts: List[ExtractFile] = (session
-                                       .query(ExtractFile)
-                                       .filter_by(deleted=False)
-                                       .all())
-        if extracts:
-            for extract in extracts:
-                if extract.is_finished():
-                    if delete_file(extract.filepath):
-                        extract.deleted = True
-                        session.commit()
-        
-    def add_event(self, event_type: str, timestamp: float, duration: float):
+        return reap_finished(cls, dry_run=dry_run)
+
+    @classmethod
+    def finished_query(cls) -> Query:
+        """Query for undeleted ExtractFiles matching ExtractFile.is_finished.
+        """
+        outstanding_items = (session
+                             .query(ItemFile.id)
+                             .filter(ItemFile.extract_id == cls.id)
+                             .filter(ItemFile.archived.isnot(True))
+                             .filter(ItemFile.deleted.isnot(True))
+                             .exists())
+        return (session
+                .query(cls)
+                .filter(cls.deleted.isnot(True))
+                .filter(or_(cls.exported == True,
+                            (cls.archived == True) & ~outstanding_items)))
+
+    def file_paths(self) -> Tuple[Optional[str], ...]:
+        """
+        :returns: Arguments for ExtractFile.unlink_files.
+        """
+        return (self.filepath,)
+
+    @staticmethod
+    def unlink_files(filepath: str) -> bool:
+        """Remove the extract audio file.
+        :returns: True if the file was removed else False.
+        """
+        return delete_audio_file(filepath)
+
+    def add_event(self, event_type: str, timestamp: float,
+                  duration: float) -> Optional["ExtractEvent"]:
         """Add an event to the ExtractFile.
-        :returns: True on success else False.
+
+        Does not load the events collection.
+        :returns: The new event on success else None.
         """
         if event_type in ["stop", "play", "pause"]:
             event = ExtractEvent(event=event_type,
                                  timestamp=timestamp,
-                                 duration=duration)
-            self.events.append(event)
+                                 duration=duration,
+                                 extract_id=self.id)
+            session.add(event)
             session.commit()
             logger.debug(f"Added {event_type} event to {self} with "
                          f"duration {duration}s.")
-            return True
-        return False
+            return event
+        return None
 
     def is_finished(self) -> bool:
         """A finished ExtractFile fulfils the following criteria.
@@ -303,6 +564,35 @@ class ExtractFile(Base):
             return True
         return False
 
+    @classmethod
+    def playable_condition(cls):
+        """SQL condition for ExtractFiles whose audio file is ready.
+        """
+        return or_(cls.render_status == None,
+                   cls.render_status == RENDER_DONE)
+
+    @classmethod
+    def queue_query(cls) -> Query:
+        """Query for the playable ExtractFile queue, newest first.
+        """
+        return (session
+                .query(cls)
+                .filter_by(deleted=False)
+                .filter(cls.playable_condition())
+                .order_by(cls.created_at.desc()))
+
+    @classmethod
+    def newest_query(cls) -> Query:
+        """Query for ExtractFiles, newest first, eg. the one being recorded.
+        """
+        return session.query(cls).order_by(cls.created_at.desc())
+
+    def is_playable(self) -> bool:
+        """
+        :returns: True if the audio file has been recorded or rendered.
+        """
+        return self.render_status in (None, RENDER_DONE)
+
     def length(self) -> float:
         """
         :returns: Length of the extract if start and end else 0.0
@@ -338,6 +628,11 @@ class ItemFile(Base):
     exported: bool = Column(Boolean, default=False)  # True if exported to SM
     cloze_startstamp: float = Column(Float)  # seconds.miliseconds
     cloze_endstamp: float = Column(Float)  # seconds.miliseconds
+    # RENDER_PENDING until renderer.py has written the question and cloze
+    # files. None for items rendered before the render job queue existed.
+    render_status: str = Column(String)
+    # Bumped by a trigger on every UPDATE, see migrations.row_versions.
+    version: int = Column(Integer, nullable=False, default=0)
     extract_id: int = Column(Integer, ForeignKey('extractfiles.id'))
 
     # One to one ItemFile (child) |-| ExtractFile (parent)
@@ -347,7 +642,7 @@ class ItemFile(Base):
     events: List["ItemEvent"] = relationship("ItemEvent", back_populates="item")
 
     @classmethod
-    def remove_finished_files(cls) -> None:
+    def remove_finished_files(cls, dry_run: bool = False) -> Dict:
         """Remove finished ItemFiles.
         
         A finished ItemFile fulfils the following criteria.
@@ -358,59 +653,64 @@ class ItemFile(Base):
 
         2. ItemFile.exported is True.
         """
-        items: List[ItemFile] = (session
-                                 .query(ItemFile)
-                                 .filter_by(deleted=False)
-                                 .all())
-        if items:
-            for item in items:
-                if item.archived or item.exported:
-                    if delete_file(item.cloze_filepath) and delete_file(item.question_filepath):
-                        item.deleted = True
-                        session.commit()
-        
-    def add_event(self, event_type: str, timestamp: float, duration: float):
+        return reap_finished(cls, dry_run=dry_run)
+
+    @classmethod
+    def finished_query(cls) -> Query:
+        """Query for undeleted archived or exported ItemFiles.
+        """
+        return (session
+                .query(cls)
+                .filter(cls.deleted.isnot(True))
+                .filter(or_(cls.archived == True,
+                            cls.exported == True)))
+
+    def file_paths(self) -> Tuple[Optional[str], ...]:
+        """
+        :returns: Arguments for ItemFile.unlink_files.
+        """
+        return (self.cloze_filepath, self.question_filepath)
+
+    @staticmethod
+    def unlink_files(cloze_filepath: str, question_filepath: str) -> bool:
+        """Remove the cloze and question files.
+        :returns: True if both files were removed else False.
+        """
+        return delete_audio_file(cloze_filepath) and \
+            delete_audio_file(question_filepath)
+
+    def add_event(self, event_type: str, timestamp: float,
+                  duration: float) -> Optional["ItemEvent"]:
         """Add an event to the ItemFile.
-        :returns: True on success else False.
+
+        Does not load the events collection.
+        :returns: The new event on success else None.
         """
         if event_type in ["stop", "play", "pause"]:
             event = ItemEvent(event=event_type,
                               timestamp=timestamp,
-                              duration=duration)
-            self.events.append(event)
+                              duration=duration,
+                              item_id=self.id)
+            session.add(event)
             session.commit()
             logger.debug(f"Added {event_type} event to {self} with "
                          f"duration {duration}s.")
-            return True
-        return False
+            return event
+        return None
 
     def process_cloze(self) -> bool:
-        """Creates a question and cloze from an ItemFile.
+        """Queue a RenderJob creating the question and cloze files.
+
+        The files are written by the render worker pool in renderer.py.
+        question_filepath and cloze_filepath are set straight away but the
+        item is only playable once render_status is RENDER_DONE.
         """
-            
         if os.path.isfile(self.extract.filepath):
-            extract_fp = self.extract.filepath
             basename = os.path.basename(self.extract.filepath)
             filename, ext = os.path.splitext(basename)
             if self.extract.endstamp and self.extract.startstamp and self.extract.length() > 0:
-                extract_length = self.extract.length()
                 if self.cloze_endstamp and self.cloze_startstamp and \
                    self.length() > 0:
-                    cloze_start = self.cloze_startstamp
-                    cloze_end = self.cloze_endstamp
-                    cloze_length = self.length()
-
-                    # Extend the output cloze length slightly to improve audio
-                    # TODO Test this
-                    output_cloze_start = cloze_start
-                    output_cloze_end = cloze_end
-
-                    if cloze_start > 0.3:
-                        output_cloze_start -= 0.3
-
-                    if cloze_end + 0.3 < self.extract.endstamp:
-                        output_cloze_end += 0.3
-
                     question_fp = os.path.join(QUESTIONFILES_DIR,
                                                (filename + "-" +
                                                 "QUESTION" + "-" +
@@ -422,51 +722,14 @@ class ItemFile(Base):
                                              "CLOZE" + "-" +
                                              str(self.id) +
                                              ext))
-                                         
-                    # Non-blocking
-                    try:
-                        # TODO Test waiting for exit code?
-                        subprocess.Popen([
-                                # INPUTS
-                                # The extract file
-                                'ffmpeg',
-                                '-i',
-                                extract_fp,
-                                # Sine wave beep generator
-                                '-f',
-                                'lavfi',
-                                '-i',
-                                'sine=frequency=1000:duration=' + str(cloze_length),
-                                # FILTERS
-                                '-filter_complex',
-                                # Cut the beginning of the extract before the cloze
-                                '[0:a]atrim=' + "0" + ":" + str(cloze_start) + "[beg]" + ";" + \
-                                # Cut the beginning of the cloze to the end of the cloze
-                                '[0:a]atrim=' + str(output_cloze_start) + ":" + str(output_cloze_end) + "[cloze]" + ";" + \
-                                # Cut the end of the extract after the cloze
-                                '[0:a]atrim=' + str(cloze_end) + ":" + str(extract_length) + "[end]" + ";" + \
-                                # concatenate the files
-                                # [1:0] is the sine wave
-                                '[beg][1:0][end]concat=n=3:v=0:a=1[question]',
-                                '-map',
-                                # Output the clozed extract
-                                '[question]',
-                                question_fp,
-                                '-map',
-                                # Output the clozed word / phrase
-                                '[cloze]',
-                                cloze_fp
-                        ], shell=False, stdout=DEVNULL)
-
-                        self.question_filepath = question_fp
-                        self.cloze_filepath = cloze_fp
-                        logger.info("Created a new question / cloze pair.")
-                        session.commit()
-                        return True
-                    except OSError as e:
-                        logger.error(f"Call to ffmpeg subprocess "
-                                     f"failed with exception {e}.")
-                        return False
+
+                    self.question_filepath = question_fp
+                    self.cloze_filepath = cloze_fp
+                    self.render_status = RENDER_PENDING
+                    RenderJob.enqueue("cloze", self.id)
+                    session.commit()
+                    logger.info(f"Queued a render job for {self}.")
+                    return True
                 else:
                     logger.error(f"Attempted to create cloze on "
                                  "item with invalid length.")
@@ -477,6 +740,29 @@ class ItemFile(Base):
             logger.error(f"Extract filepath does not exist.")
         return False
 
+    @classmethod
+    def playable_condition(cls):
+        """SQL condition for ItemFiles whose question file is ready.
+        """
+        return or_(cls.render_status == None,
+                   cls.render_status == RENDER_DONE)
+
+    @classmethod
+    def queue_query(cls) -> Query:
+        """Query for the playable ItemFile queue.
+        """
+        return (session
+                .query(cls)
+                .filter_by(deleted=False)
+                .filter(cls.question_filepath != None)
+                .filter(cls.playable_condition()))
+
+    def is_playable(self) -> bool:
+        """
+        :returns: True if the question and cloze files have been rendered.
+        """
+        return self.render_status in (None, RENDER_DONE)
+
     def length(self) -> float:
         """
         :returns: Length of the cloze or 0.0
@@ -513,7 +799,7 @@ class ItemFile(Base):
 
 
 class TopicEvent(Base):
-    # The mpc_heartbeat script inserts into this table
+    # The heartbeat script inserts into this table
 
     __tablename__ = "topicevents"
 
@@ -534,7 +820,7 @@ class TopicEvent(Base):
 
 
 class ExtractEvent(Base):
-    # The mpc_heartbeat script inserts into this table
+    # The heartbeat script inserts into this table
 
     __tablename__ = "extractevents"
 
@@ -555,7 +841,7 @@ class ExtractEvent(Base):
 
 
 class ItemEvent(Base):
-    # The mpc_heartbeat script inserts into this table
+    # The heartbeat script inserts into this table
 
     __tablename__ = "itemevents"
 
@@ -575,5 +861,565 @@ class ItemEvent(Base):
                f"duration={self.duration}>"
 
 
+###############
+# Render Jobs #
+###############
+
+
+class RenderJob(Base):
+    """Persistent queue of audio files for renderer.RenderPool to create.
+
+    kind is "extract" (cut an ExtractFile from its TopicFile) or "cloze"
+    (create an ItemFile's question and cloze files from its ExtractFile)
+    and entity_id is the id of the ExtractFile or ItemFile.
+    """
+
+    __tablename__ = "render_jobs"
+
+    id: int = Column(Integer, primary_key=True)
+    kind: str = Column(String, nullable=False)
+    entity_id: int = Column(Integer, nullable=False)
+    status: str = Column(String, nullable=False, default=RENDER_PENDING)
+    attempts: int = Column(Integer, nullable=False, default=0)
+    returncode: int = Column(Integer)  # ffmpeg exit code of the last attempt
+    error: str = Column(Text)  # ffmpeg stderr of the last failed attempt
+    created_at: DateTime = Column(DateTime, default=datetime.datetime.utcnow)
+    # Failed attempts are retried after a delay.
+    run_after: DateTime = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at: DateTime = Column(DateTime)
+
+    @classmethod
+    def enqueue(cls, kind: str, entity_id: int) -> "RenderJob":
+        """Add a pending job to the session. Committed by the caller.
+        """
+        job = cls(kind=kind, entity_id=entity_id, status=RENDER_PENDING)
+        session.add(job)
+        return job
+
+    @classmethod
+    def due_query(cls, db, now: datetime.datetime) -> Query:
+        """Query for the pending RenderJobs due at now, oldest first.
+
+        :db: Session of the caller, RenderPool uses one per thread.
+        """
+        return (db.query(cls)
+                .filter(cls.status == RENDER_PENDING)
+                .filter(cls.run_after <= now)
+                .order_by(cls.run_after, cls.id))
+
+    @classmethod
+    def cloze_batch_query(cls, db, now: datetime.datetime, job_id: int,
+                          extract_id: int, limit: int) -> Query:
+        """Query for the other due cloze jobs of the ItemFiles of an
+        ExtractFile, rendered with job_id from one decode.
+        """
+        return (cls.due_query(db, now)
+                .join(ItemFile, ItemFile.id == cls.entity_id)
+                .filter(cls.kind == "cloze")
+                .filter(cls.id != job_id)
+                .filter(ItemFile.extract_id == extract_id)
+                .limit(limit))
+
+    def __repr__(self) -> str:
+        return f"<RenderJob: id={self.id} kind={self.kind} " \
+               f"entity_id={self.entity_id} status={self.status} " \
+               f"attempts={self.attempts}>"
+
+
+#################
+# Event Rollups #
+#################
+
+# rollup.py compacts raw events older than a few days into one row per
+# file per day and deletes the raw rows once they pass the retention age.
+
+
+class TopicEventRollup(Base):
+    """Daily totals of a TopicFile's TopicEvents.
+    """
+
+    __tablename__ = "topicevent_rollups"
+    __table_args__ = (UniqueConstraint("topic_id", "day"),)
+
+    id: int = Column(Integer, primary_key=True)
+    day: datetime.date = Column(Date, nullable=False)  # UTC
+    listened: float = Column(Float, default=0)  # seconds spent playing
+    plays: int = Column(Integer, default=0)
+    pauses: int = Column(Integer, default=0)
+    max_timestamp: float = Column(Float)  # furthest position reached
+    events: int = Column(Integer, default=0)  # raw events compacted
+
+    topic_id: int = Column(Integer, ForeignKey('topicfiles.id'))
+
+    def __repr__(self):
+        return f"<TopicEventRollup: topic_id={self.topic_id} " \
+               f"day={self.day} listened={self.listened}>"
+
+
+class ExtractEventRollup(Base):
+    """Daily totals of an ExtractFile's ExtractEvents.
+    """
+
+    __tablename__ = "extractevent_rollups"
+    __table_args__ = (UniqueConstraint("extract_id", "day"),)
+
+    id: int = Column(Integer, primary_key=True)
+    day: datetime.date = Column(Date, nullable=False)  # UTC
+    listened: float = Column(Float, default=0)  # seconds spent playing
+    plays: int = Column(Integer, default=0)
+    pauses: int = Column(Integer, default=0)
+    max_timestamp: float = Column(Float)  # furthest position reached
+    events: int = Column(Integer, default=0)  # raw events compacted
+
+    extract_id: int = Column(Integer, ForeignKey('extractfiles.id'))
+
+    def __repr__(self):
+        return f"<ExtractEventRollup: extract_id={self.extract_id} " \
+               f"day={self.day} listened={self.listened}>"
+
+
+class ItemEventRollup(Base):
+    """Daily totals of an ItemFile's ItemEvents.
+    """
+
+    __tablename__ = "itemevent_rollups"
+    __table_args__ = (UniqueConstraint("item_id", "day"),)
+
+    id: int = Column(Integer, primary_key=True)
+    day: datetime.date = Column(Date, nullable=False)  # UTC
+    listened: float = Column(Float, default=0)  # seconds spent playing
+    plays: int = Column(Integer, default=0)
+    pauses: int = Column(Integer, default=0)
+    max_timestamp: float = Column(Float)  # furthest position reached
+    events: int = Column(Integer, default=0)  # raw events compacted
+
+    item_id: int = Column(Integer, ForeignKey('itemfiles.id'))
+
+    def __repr__(self):
+        return f"<ItemEventRollup: item_id={self.item_id} " \
+               f"day={self.day} listened={self.listened}>"
+
+
+class BackfillState(Base):
+    """Progress of incremental backfill jobs, eg. extract transcripts.
+
+    Rows with an id up to last_id have been backfilled.
+    """
+
+    __tablename__ = "backfill_state"
+
+    name: str = Column(String, primary_key=True)
+    last_id: int = Column(Integer, default=0, nullable=False)
+    updated_at: DateTime = Column(DateTime, default=datetime.datetime.utcnow,
+                                  onupdate=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<BackfillState: name={self.name} last_id={self.last_id}>"
+
+
+class EventRollupState(Base):
+    """How far each event table has been rolled up and pruned.
+
+    Events created before rolled_up_until are counted in the rollup
+    table. Events created before pruned_before have been deleted.
+    Both are UTC midnights.
+    """
+
+    __tablename__ = "event_rollup_state"
+
+    event_table: str = Column(String, primary_key=True)
+    rolled_up_until: DateTime = Column(DateTime)
+    pruned_before: DateTime = Column(DateTime)
+
+    def __repr__(self):
+        return f"<EventRollupState: event_table={self.event_table} " \
+               f"rolled_up_until={self.rolled_up_until} " \
+               f"pruned_before={self.pruned_before}>"
+
+
+# Event model: (rollup model, foreign key column name)
+EVENT_ROLLUPS = {
+        TopicEvent: (TopicEventRollup, "topic_id"),
+        ExtractEvent: (ExtractEventRollup, "extract_id"),
+        ItemEvent: (ItemEventRollup, "item_id"),
+}
+
+
+##################
+# Media File Map #
+##################
+
+
+class MediaFile(Base):
+    """Maps the filepath MPD plays to its TopicFile, ExtractFile or ItemFile.
+
+    Kept in sync with the three tables by the mapper events below.
+    """
+
+    __tablename__ = "media_files"
+
+    id: int = Column(Integer, primary_key=True)
+    filepath: str = Column(String, nullable=False, unique=True)
+    entity_type: str = Column(String, nullable=False)  # topic/extract/item
+    entity_id: int = Column(Integer, nullable=False)
+
+    @classmethod
+    def lookup_query(cls, filepath: str) -> Query:
+        """Query for the entity_type and entity_id of a filepath.
+        """
+        return (session
+                .query(cls.entity_type, cls.entity_id)
+                .filter_by(filepath=filepath))
+
+    @classmethod
+    def rebuild(cls) -> None:
+        """Repopulate the table from the TopicFile, ExtractFile and
+        ItemFile tables.
+        """
+        session.query(cls).delete()
+        for model, (entity_type, column) in MEDIA_FILE_COLUMNS.items():
+            filepath = getattr(model, column)
+            session.execute(cls.__table__.insert().from_select(
+                ["filepath", "entity_type", "entity_id"],
+                select([filepath, literal(entity_type), model.id])
+                .where(filepath != None)))
+        session.commit()
+        media_file_entity.cache_clear()
+        logger.info("Rebuilt the media_files table.")
+
+    def __repr__(self) -> str:
+        return f"<MediaFile: filepath={self.filepath} " \
+               f"entity_type={self.entity_type} entity_id={self.entity_id}>"
+
+
+# Model: (MediaFile.entity_type, column holding the played filepath)
+MEDIA_FILE_COLUMNS = {
+        TopicFile: ("topic", "filepath"),
+        ExtractFile: ("extract", "filepath"),
+        ItemFile: ("item", "question_filepath"),
+}
+
+MEDIA_FILE_MODELS = {
+        entity_type: model
+        for model, (entity_type, _) in MEDIA_FILE_COLUMNS.items()
+}
+
+
+def _unmap_media_file(connection, entity_type: str, entity_id: int,
+                      filepath: Optional[str] = None) -> None:
+    table = MediaFile.__table__
+    condition = and_(table.c.entity_type == entity_type,
+                     table.c.entity_id == entity_id)
+    if filepath:
+        condition = or_(condition, table.c.filepath == filepath)
+    connection.execute(table.delete().where(condition))
+
+
+def _map_media_file(connection, target) -> None:
+    entity_type, column = MEDIA_FILE_COLUMNS[type(target)]
+    filepath = getattr(target, column)
+    _unmap_media_file(connection, entity_type, target.id, filepath)
+    if filepath:
+        connection.execute(MediaFile.__table__.insert().values(
+            filepath=filepath,
+            entity_type=entity_type,
+            entity_id=target.id))
+    media_file_entity.cache_clear()
+
+
+for _model in MEDIA_FILE_COLUMNS:
+
+    @listens_for(_model, "after_insert")
+    def media_file_after_insert(mapper, connection, target):
+        _map_media_file(connection, target)
+
+    @listens_for(_model, "after_update")
+    def media_file_after_update(mapper, connection, target):
+        _, column = MEDIA_FILE_COLUMNS[type(target)]
+        if inspect(target).attrs[column].history.has_changes():
+            _map_media_file(connection, target)
+
+    @listens_for(_model, "after_delete")
+    def media_file_after_delete(mapper, connection, target):
+        entity_type, _ = MEDIA_FILE_COLUMNS[type(target)]
+        _unmap_media_file(connection, entity_type, target.id)
+        media_file_entity.cache_clear()
+
+
+##############################
+# Playlist Outstanding Count #
+##############################
+
+# TopicFile columns that decide Playlist.outstanding_count.
+OUTSTANDING_COLUMNS = ("playlist_id", "deleted", "archived", "nearly_done")
+
+
+def _committed_value(target, column: str):
+    """
+    :returns: The value of the column before the current flush.
+    """
+    if column == "playlist_id" and "_committed_playlist_id" in vars(target):
+        return vars(target)["_committed_playlist_id"]
+    history = inspect(target).attrs[column].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+
+def _add_outstanding(connection, target, playlist_id: Optional[int],
+                     delta: int) -> None:
+    if playlist_id is None or not delta:
+        return
+    table = Playlist.__table__
+    connection.execute(update(table)
+                       .where(table.c.id == playlist_id)
+                       .values(outstanding_count=(table.c.outstanding_count
+                                                  + delta)))
+    # Reload the counter of the Playlist in the session on next access.
+    target_session = object_session(target)
+    if target_session is not None:
+        target_session.info.setdefault("stale_playlists", set()).add(
+                playlist_id)
+
+
+def _load_committed_value(target, value, oldvalue, initiator):
+    """Set event with active_history, so writing a column of a TopicFile
+    expired by a commit loads its committed value into the history first.
+    Otherwise _committed_value sees no old value and the counter drifts.
+    """
+
+
+for _column in OUTSTANDING_COLUMNS:
+    listen(getattr(TopicFile, _column), "set", _load_committed_value,
+           active_history=True)
+
+
+@listens_for(TopicFile, "before_delete")
+def outstanding_before_delete(mapper, connection, target):
+    # Load the columns of an expired TopicFile while its row still exists.
+    for column in OUTSTANDING_COLUMNS:
+        getattr(target, column)
+
+
+@listens_for(TopicFile.playlist, "set", active_history=True)
+def topic_playlist_set(target, value, oldvalue, initiator):
+    # The flush copies the new Playlist's id into playlist_id without
+    # recording history, so remember which playlist to decrement.
+    if "_committed_playlist_id" not in vars(target):
+        target._committed_playlist_id = getattr(oldvalue, "id", None)
+
+
+@listens_for(TopicFile, "after_insert")
+def outstanding_after_insert(mapper, connection, target):
+    vars(target).pop("_committed_playlist_id", None)
+    if TopicFile.is_outstanding(target.deleted, target.archived,
+                                target.nearly_done):
+        _add_outstanding(connection, target, target.playlist_id, 1)
+
+
+@listens_for(TopicFile, "after_update")
+def outstanding_after_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[column].history.has_changes()
+               for column in OUTSTANDING_COLUMNS) and \
+       "_committed_playlist_id" not in vars(target):
+        return
+    old_playlist_id, *old_flags = (_committed_value(target, column)
+                                   for column in OUTSTANDING_COLUMNS)
+    vars(target).pop("_committed_playlist_id", None)
+    was = TopicFile.is_outstanding(*old_flags)
+    now = TopicFile.is_outstanding(target.deleted, target.archived,
+                                   target.nearly_done)
+    if old_playlist_id == target.playlist_id:
+        _add_outstanding(connection, target, target.playlist_id, now - was)
+    else:
+        _add_outstanding(connection, target, old_playlist_id, -was)
+        _add_outstanding(connection, target, target.playlist_id, now)
+
+
+@listens_for(TopicFile, "after_delete")
+def outstanding_after_delete(mapper, connection, target):
+    old_playlist_id, *old_flags = (_committed_value(target, column)
+                                   for column in OUTSTANDING_COLUMNS)
+    vars(target).pop("_committed_playlist_id", None)
+    if TopicFile.is_outstanding(*old_flags):
+        _add_outstanding(connection, target, old_playlist_id, -1)
+
+
+@listens_for(Session, "after_flush_postexec")
+def expire_outstanding_counts(flush_session, flush_context):
+    for playlist_id in flush_session.info.pop("stale_playlists", ()):
+        key = inspect(Playlist).identity_key_from_primary_key([playlist_id])
+        playlist = flush_session.identity_map.get(key)
+        if playlist is not None:
+            flush_session.expire(playlist, ["outstanding_count"])
+
+
+#####################
+# Transcript Search #
+#####################
+
+
+class TranscriptCue(Base):
+    """Searchable transcript text, indexed by the transcript_fts FTS5
+    table (see migrations.transcript_search).
+
+    Rows with an extract_id hold an ExtractFile's transcript, the others
+    the cues of their TopicFile's VTT file. start_ms and end_ms are in
+    the time of the VTT file, ie. of the video before playback rate
+    conversion.
+
+    ExtractFile rows are kept in sync by the mapper events below,
+    TopicFile rows by transcript_search.index_topic.
+    """
+
+    __tablename__ = "transcript_cues"
+
+    id: int = Column(Integer, primary_key=True)
+    topic_id: int = Column(Integer, ForeignKey('topicfiles.id'),
+                           nullable=False, index=True)
+    extract_id: int = Column(Integer, ForeignKey('extractfiles.id'),
+                             index=True)
+    start_ms: int = Column(Integer, nullable=False)
+    end_ms: int = Column(Integer)
+    text: str = Column(Text, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<TranscriptCue: topic_id={self.topic_id} " \
+               f"extract_id={self.extract_id} start_ms={self.start_ms}>"
+
+
+# ExtractFile columns that decide its TranscriptCue.
+TRANSCRIPT_CUE_COLUMNS = ("transcript", "startstamp", "endstamp",
+                          "topic_id", "deleted")
+
+
+def index_extract_transcripts(connection, extract_ids: List[int]) -> None:
+    """Replace the TranscriptCues of ExtractFiles with their current
+    transcripts.
+
+    Needed after bulk updates, which skip the mapper events.
+    """
+    if not extract_ids:
+        return
+    cues = TranscriptCue.__table__
+    extracts = ExtractFile.__table__
+    topics = TopicFile.__table__
+    connection.execute(cues.delete().where(
+        transcript_cues_condition(ExtractFile, extract_ids)))
+    # Extract stamps are in the rate converted topic's time.
+    rate = func.coalesce(topics.c.playback_rate, 1.0)
+    connection.execute(cues.insert().from_select(
+        ["topic_id", "extract_id", "start_ms", "end_ms", "text"],
+        select([extracts.c.topic_id,
+                extracts.c.id,
+                cast(extracts.c.startstamp * rate * 1000, Integer),
+                cast(extracts.c.endstamp * rate * 1000, Integer),
+                extracts.c.transcript])
+        .select_from(extracts.join(topics,
+                                   topics.c.id == extracts.c.topic_id))
+        .where(and_(extracts.c.id.in_(extract_ids),
+                    extracts.c.transcript != None,
+                    extracts.c.transcript != "",
+                    extracts.c.deleted.isnot(True)))))
+
+
+def transcript_cues_condition(model, ids: List[int]):
+    """SQL condition for the TranscriptCues of TopicFiles or ExtractFiles.
+
+    The cues of a TopicFile exclude those of its ExtractFiles.
+
+    :returns: The condition or None for other models.
+    """
+    cues = TranscriptCue.__table__
+    if model is TopicFile:
+        return and_(cues.c.topic_id.in_(ids), cues.c.extract_id == None)
+    if model is ExtractFile:
+        return cues.c.extract_id.in_(ids)
+    return None
+
+
+def drop_transcript_cues(connection, model, ids: List[int]) -> None:
+    """Delete the TranscriptCues of deleted TopicFiles or ExtractFiles, like
+    the after_update events below.
+
+    Needed after bulk updates, which skip the mapper events.
+    """
+    condition = transcript_cues_condition(model, ids)
+    if condition is not None:
+        connection.execute(TranscriptCue.__table__.delete().where(condition))
+
+
+@listens_for(ExtractFile, "after_insert")
+def transcript_cue_after_insert(mapper, connection, target):
+    if target.transcript:
+        index_extract_transcripts(connection, [target.id])
+
+
+@listens_for(ExtractFile, "after_update")
+def transcript_cue_after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes()
+           for column in TRANSCRIPT_CUE_COLUMNS):
+        index_extract_transcripts(connection, [target.id])
+
+
+@listens_for(ExtractFile, "after_delete")
+def transcript_cue_after_delete(mapper, connection, target):
+    cues = TranscriptCue.__table__
+    connection.execute(cues.delete().where(cues.c.extract_id == target.id))
+
+
+@listens_for(TopicFile, "after_update")
+def topic_cues_after_update(mapper, connection, target):
+    # Deleted topics have no audio left to jump to.
+    if target.deleted and \
+       inspect(target).attrs["deleted"].history.has_changes():
+        drop_transcript_cues(connection, TopicFile, [target.id])
+
+
+@listens_for(TopicFile, "after_delete")
+def topic_cues_after_delete(mapper, connection, target):
+    cues = TranscriptCue.__table__
+    connection.execute(cues.delete().where(cues.c.topic_id == target.id))
+
+
+@lru_cache(maxsize=256)
+def media_file_entity(filepath: str) -> Tuple[str, int]:
+    """Indexed, cached filepath lookup in the media_files table.
+
+    Raises LookupError for unknown filepaths so that misses are not
+    cached (lru_cache does not cache exceptions).
+
+    :returns: (entity_type, entity_id)
+    """
+    row = MediaFile.lookup_query(filepath).one_or_none()
+    if row is None:
+        raise LookupError(filepath)
+    return row.entity_type, row.entity_id
+
+
+def find_media_file(filepath: str, model=None) -> Optional[Union[TopicFile,
+                                                                 ExtractFile,
+                                                                 ItemFile]]:
+    """Find the TopicFile, ExtractFile or ItemFile MPD plays from filepath.
+
+    :filepath: Absolute filepath of the track.
+    :model: Only return rows of this model eg. TopicFile.
+    :returns: The row or None.
+    """
+    try:
+        entity_type, entity_id = media_file_entity(filepath)
+    except LookupError:
+        return None
+    found = MEDIA_FILE_MODELS[entity_type]
+    if model is not None and found is not model:
+        return None
+    return session.query(found).get(entity_id)
+
+
 Base.metadata.create_all(engine)
+migrate(engine)
 session = Session()
@@ -4,8 +4,17 @@ from flask import Blueprint, request, Flask, render_template, url_for
 from flask_restplus import fields
 from flask_sqlalchemy import SQLAlchemy
 from config import DATABASE_URI
-from flask_restplus import reqparse
+from flask_restplus import reqparse, inputs
+from pagination import (keyset_page, CountCache, PER_PAGE, MAX_PER_PAGE)
+from api_filters import (created_between, recorded_extracts, clozed_items,
+                         rollup_days)
+from audio_stream import stream_audio, PLAYABLE_RENDER_STATUSES
+from peak_index import load_index, WINDOW_WIDTH, MAX_WINDOW_WIDTH
 from flask_cors import CORS
+from sqlalchemy.orm import selectinload
+from collections import OrderedDict, defaultdict
+import datetime
+import threading
 
 
 app = Flask(__name__)
@@ -39,40 +48,188 @@ event_ns = api.namespace('events',
                                      "Item events")
 
 
+#####################################
+# Sparse Fieldsets and Cached Cards #
+#####################################
+
+# Fields only serialized when asked for with ?fields=
+EXPENSIVE_FIELDS = {'rendered'}
+# Number of rendered cards kept in memory.
+RENDERED_CACHE_SIZE = 4096
+
+
+def requested_fields(collection=False):
+    """ Field names of ?fields=id,title,... or None for the default
+    fields, which are all except EXPENSIVE_FIELDS
+
+    The fields also become the X-Fields mask flask_restplus applies
+    when marshalling the response, so the rest are left out entirely """
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = {field.strip() for field in fields.split(',') if field.strip()}
+    if not request.headers.get(app.config['RESTPLUS_MASK_HEADER']):
+        mask = ','.join(sorted(fields))
+        if collection:
+            # The fields are event fields, the rollups are left whole.
+            mask = f'data{{{mask}}},_meta,_links,rollups'
+        header = app.config['RESTPLUS_MASK_HEADER'].upper().replace('-', '_')
+        request.environ[f'HTTP_{header}'] = f'{{{mask}}}'
+    return fields
+
+
+def wants(fields, field):
+    """ True if field should be serialized """
+    if fields is None:
+        return field not in EXPENSIVE_FIELDS
+    return field in fields
+
+
+def sparse(data, fields):
+    """ Keep only the requested fields of a serialized row """
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
+
+_rendered = OrderedDict()
+_rendered_lock = threading.Lock()
+
+
+def render_card(template, row, parent=None, **context):
+    """ Render a card template, cached on the id and version of the row
+    and of the parent row the template also shows """
+    key = (template, row.id, row.version,
+           parent.version if parent is not None else None)
+    with _rendered_lock:
+        html = _rendered.get(key)
+        if html is not None:
+            _rendered.move_to_end(key)
+            return html
+    html = render_template(template, **context)
+    with _rendered_lock:
+        _rendered[key] = html
+        while len(_rendered) > RENDERED_CACHE_SIZE:
+            _rendered.popitem(last=False)
+    return html
+
+
 ##########################
 # Pagination Mixin Class #
 ##########################
 
 class PaginatedAPIMixin(object):
+
+    # Columns, unique together, that order the keyset pages.
+    cursor_keys = ("created_at", "id")
+    # Field: relationships to load for a whole page when it is requested.
+    eager_fields = {}
+
+    @classmethod
+    def prefetch(cls, rows, fields):
+        """ Load what to_dict needs for a whole page of rows at once """
+        pass
+
     @staticmethod
     def to_collection_dict(query, page, per_page, endpoint, **kwargs):
-        resources = query.paginate(page, per_page, False)
+        """ Paginate a query by cursor
+        Pass the cursor of the next or prev link to get the following
+        page. ?total=1 adds the (cached) total counts to _meta.
+        ?page=<n> still pages by OFFSET for old clients. """
+        cursor = request.args.get('cursor')
+        with_total = request.args.get('total', type=inputs.boolean)
+        fields = requested_fields(collection=True)
+        model = query.column_descriptions[0]['entity']
+        for field, relationships in model.eager_fields.items():
+            if wants(fields, field):
+                query = query.options(*[
+                    selectinload(getattr(model, relationship))
+                    for relationship in relationships])
+        if fields is not None:
+            kwargs.setdefault('fields', request.args['fields'])
+        if page is not None and not cursor:
+            return offset_collection_dict(query, page, per_page, endpoint,
+                                          **kwargs)
+
+        # A cursor only makes sense with the filters it was made with.
+        for arg in ('start', 'end'):
+            if arg in request.args:
+                kwargs.setdefault(arg, request.args[arg])
+
+        keys = [getattr(model, key) for key in model.cursor_keys]
+        try:
+            rows, next_cursor, prev_cursor = keyset_page(query, keys,
+                                                         per_page, cursor)
+        except ValueError as e:
+            api.abort(400, str(e))
+        model.prefetch(rows, fields)
+
+        meta = {
+                "page": None,
+                "per_page": per_page,
+                "total_pages": None,
+                "total_items": None
+               }
+        if with_total:
+            total = count_cache.count(query)
+            meta["total_items"] = total
+            meta["total_pages"] = -(-total // per_page)
+
+        def link(cursor):
+            return url_for(endpoint, cursor=cursor, per_page=per_page,
+                           **kwargs) if cursor else None
+
         data = {
                 "data": [
-                         item.to_dict()
-                         for item in resources.items
+                         item.to_dict(fields)
+                         for item in rows
                         ],
-                "_meta": {
-                          "page": page,
-                          "per_page": per_page,
-                          "total_pages": resources.pages,
-                          "total_items": resources.total
-                         },
+                "_meta": meta,
                 "_links": {
-                           "self": url_for(endpoint, page=page,
-                                           per_page=per_page,
-                                           **kwargs),
-                           "next": url_for(endpoint, page=page + 1,
-                                           per_page=per_page,
-                                           **kwargs) if resources.has_next else None,
-                           "prev": url_for(endpoint, page=page - 1,
-                                           per_page=per_page,
-                                           **kwargs) if resources.has_prev else None
+                           "self": link(cursor) if cursor
+                                   else url_for(endpoint, per_page=per_page,
+                                                **kwargs),
+                           "next": link(next_cursor),
+                           "prev": link(prev_cursor)
                           }
                }
         return data
 
 
+def offset_collection_dict(query, page, per_page, endpoint, **kwargs):
+    """ The OFFSET pagination of ?page=<n>, slow for deep pages """
+    fields = requested_fields(collection=True)
+    resources = query.paginate(page, per_page, False)
+    query.column_descriptions[0]['entity'].prefetch(resources.items, fields)
+    data = {
+            "data": [
+                     item.to_dict(fields)
+                     for item in resources.items
+                    ],
+            "_meta": {
+                      "page": page,
+                      "per_page": per_page,
+                      "total_pages": resources.pages,
+                      "total_items": resources.total
+                     },
+            "_links": {
+                       "self": url_for(endpoint, page=page,
+                                       per_page=per_page,
+                                       **kwargs),
+                       "next": url_for(endpoint, page=page + 1,
+                                       per_page=per_page,
+                                       **kwargs) if resources.has_next else None,
+                       "prev": url_for(endpoint, page=page - 1,
+                                       per_page=per_page,
+                                       **kwargs) if resources.has_prev else None
+                      }
+           }
+    return data
+
+
+count_cache = CountCache()
+
+
 ##########################
 # Tag Association Tables #
 ##########################
@@ -81,6 +238,26 @@ yt_topicfile_tags = db.Table('yt_topicfile_tags', db.metadata)
 my_topicfile_tags = db.Table('my_topicfile_tags', db.metadata)
 
 
+def page_tags(relationship, topic_ids):
+    """ Tags of many topics from one query on a tag relationship,
+    without loading the tag rows as objects
+
+    Returns a topic id: list of tags mapping """
+    tags = defaultdict(list)
+    if not topic_ids:
+        return tags
+    prop = relationship.property
+    (_, topic_fk), = prop.synchronize_pairs
+    (tag_pk, tag_fk), = prop.secondary_synchronize_pairs
+    rows = db.session.execute(
+        db.select([topic_fk, tag_pk.table.c.tag])
+        .select_from(prop.secondary.join(tag_pk.table, tag_pk == tag_fk))
+        .where(topic_fk.in_(topic_ids)))
+    for topic_id, tag in rows:
+        tags[topic_id].append(tag)
+    return tags
+
+
 ####################################
 # TopicFile DB table and API Model #
 ####################################
@@ -103,7 +280,17 @@ class TopicFile(PaginatedAPIMixin, db.Model):
                              secondary=my_topicfile_tags,
                              back_populates='topics')
 
-    def to_dict(self):
+    @classmethod
+    def prefetch(cls, rows, fields):
+        """ Load the tags of a page of topics with one query per tag
+        relationship """
+        for field in ('yttags', 'mytags'):
+            if wants(fields, field):
+                tags = page_tags(getattr(cls, field), [row.id for row in rows])
+                for row in rows:
+                    row.__dict__.setdefault('_tags', {})[field] = tags[row.id]
+
+    def to_dict(self, fields=None):
         data = {
                 'id':             self.id,
                 'filepath':       self.filepath,
@@ -124,22 +311,25 @@ class TopicFile(PaginatedAPIMixin, db.Model):
                 'cur_timestamp':  self.cur_timestamp,
                 'created_at':     self.created_at,
                 'transcript':     self.transcript,
-                'rendered':       render_template("topic.html", topic=self),
-                'yttags': [
-                            tag.tag
-                            for tag in self.yttags
-                          ],
-                'mytags': [
-                            tag.tag
-                            for tag in self.mytags
-                          ],
-                '_links': {
-                        'self': url_for('topics_topic', id=self.id),
-                        'extracts': url_for('topics_topic_extracts', id=self.id),
-                        'events': url_for('topics_topic_events', id=self.id),
-                }
                }
-        return data
+        if wants(fields, 'rendered'):
+            data['rendered'] = render_card("topic.html", self, topic=self)
+        prefetched = self.__dict__.get('_tags', {})
+        for field in ('yttags', 'mytags'):
+            if field in prefetched:
+                data[field] = prefetched[field]
+            elif wants(fields, field):
+                data[field] = [
+                               tag.tag
+                               for tag in getattr(self, field)
+                              ]
+        if wants(fields, '_links'):
+            data['_links'] = {
+                    'self': url_for('topics_topic', id=self.id),
+                    'extracts': url_for('topics_topic_extracts', id=self.id),
+                    'events': url_for('topics_topic_events', id=self.id),
+            }
+        return sparse(data, fields)
 
 
 topic_links = api.model('Topic File Links', {
@@ -212,7 +402,9 @@ class ExtractFile(PaginatedAPIMixin, db.Model):
     items = db.relationship("ItemFile", back_populates="extract")
     events = db.relationship("ExtractEvent", back_populates="extract")
 
-    def to_dict(self):
+    eager_fields = {'rendered': ['topic']}
+
+    def to_dict(self, fields=None):
         data = {
                 "id":         self.id,
                 "filepath":   self.filepath,
@@ -222,15 +414,18 @@ class ExtractFile(PaginatedAPIMixin, db.Model):
                 "transcript": self.transcript,
                 'archived':   self.archived,
                 "deleted":    self.deleted,
-                "rendered":   render_template("extract.html", extract=self),
-                '_links': {
-                    'self': url_for('extracts_extract', id=self.id),
-                    'topic': url_for('extracts_extract_topic', id=self.id),
-                    'items': url_for('extracts_extract_items', id=self.id),
-                    'events': url_for('extracts_extract_events', id=self.id)
-                    }
                }
-        return data
+        if wants(fields, 'rendered'):
+            data['rendered'] = render_card("extract.html", self, self.topic,
+                                           extract=self)
+        if wants(fields, '_links'):
+            data['_links'] = {
+                'self': url_for('extracts_extract', id=self.id),
+                'topic': url_for('extracts_extract_topic', id=self.id),
+                'items': url_for('extracts_extract_items', id=self.id),
+                'events': url_for('extracts_extract_events', id=self.id)
+                }
+        return sparse(data, fields)
 
 
 extract_links = api.model('Extract Links', {
@@ -284,7 +479,9 @@ class ItemFile(PaginatedAPIMixin, db.Model):
     extract = db.relationship("ExtractFile", back_populates="items")
     events = db.relationship("ItemEvent", back_populates="item")
 
-    def to_dict(self):
+    eager_fields = {'rendered': ['extract']}
+
+    def to_dict(self, fields=None):
         data = {
                 'id':                self.id,
                 'created_at':        self.created_at,
@@ -294,14 +491,17 @@ class ItemFile(PaginatedAPIMixin, db.Model):
                 'deleted':           self.deleted,
                 'cloze_startstamp':  self.cloze_startstamp,
                 'cloze_endstamp':    self.cloze_endstamp,
-                'rendered':          render_template('item.html', item=self),
-                '_links': {
-                    'self': url_for('items_item', id=self.id),
-                    'extract': url_for('items_item_extract', id=self.id),
-                    'events': url_for('items_item_events', id=self.id)
-                    }
                }
-        return data
+        if wants(fields, 'rendered'):
+            data['rendered'] = render_card('item.html', self, self.extract,
+                                           item=self)
+        if wants(fields, '_links'):
+            data['_links'] = {
+                'self': url_for('items_item', id=self.id),
+                'extract': url_for('items_item_extract', id=self.id),
+                'events': url_for('items_item_events', id=self.id)
+                }
+        return sparse(data, fields)
 
 
 item_links = api.model('Item Links', {
@@ -352,19 +552,20 @@ class TopicEvent(PaginatedAPIMixin, db.Model):
     __table__ = db.Model.metadata.tables['topicevents']
     topic = db.relationship("TopicFile", back_populates="events")
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         data = {
                 'id':           self.id,
                 'created_at':   self.created_at,
                 'event':        self.event,
                 'timestamp':    self.timestamp,
                 'duration':     self.duration,
-                '_links': {
-                    'self': url_for('events_event', id=self.id),
-                    'topic': url_for('events_event_topic', id=self.id)
-                    }
                }
-        return data
+        if wants(fields, '_links'):
+            data['_links'] = {
+                'self': url_for('events_event', id=self.id),
+                'topic': url_for('events_event_topic', id=self.id)
+                }
+        return sparse(data, fields)
 
 
 topic_event_links = api.model('Topic Links', {
@@ -410,19 +611,20 @@ class ExtractEvent(PaginatedAPIMixin, db.Model):
     __table__ = db.Model.metadata.tables['extractevents']
     extract = db.relationship("ExtractFile", back_populates="events")
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         data = {
                 'id':           self.id,
                 'created_at':   self.created_at,
                 'event':        self.event,
                 'timestamp':    self.timestamp,
                 'duration':     self.duration,
-                '_links': {
-                    'self': url_for('events_event', id=self.id),
-                    'extract': url_for('events_event_extract', id=self.id)
-                    }
                }
-        return data
+        if wants(fields, '_links'):
+            data['_links'] = {
+                'self': url_for('events_event', id=self.id),
+                'extract': url_for('events_event_extract', id=self.id)
+                }
+        return sparse(data, fields)
 
 
 extract_event_links = api.model('Extract Event Links', {
@@ -468,19 +670,20 @@ class ItemEvent(PaginatedAPIMixin, db.Model):
     __table__ = db.Model.metadata.tables['itemevents']
     item = db.relationship("ItemFile", back_populates="events")
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         data = {
                 'id':           self.id,
                 'created_at':   self.created_at,
                 'self':         self.event,
                 'timestamp':    self.timestamp,
                 'duration':     self.duration,
-                '_links': {
-                    'self': url_for('events_event', id=self.id),
-                    'item': url_for('events_event_item', id=self.id),
-                }
                }
-        return data
+        if wants(fields, '_links'):
+            data['_links'] = {
+                'self': url_for('events_event', id=self.id),
+                'item': url_for('events_event_item', id=self.id),
+                }
+        return sparse(data, fields)
 
 
 item_event_links = api.model('Item Event Links', {
@@ -517,6 +720,125 @@ paginated_item_events_model = api.model('Paginated Item Events', {
     })
 
 
+#########################################
+# Event Rollup DB tables and API Models #
+#########################################
+
+class EventRollupState(db.Model):
+    __table__ = db.Model.metadata.tables['event_rollup_state']
+
+
+class TopicEventRollup(PaginatedAPIMixin, db.Model):
+    cursor_keys = ("day", "id")
+    __table__ = db.Model.metadata.tables['topicevent_rollups']
+
+    def to_dict(self, fields=None):
+        """ ?fields= names event fields, so rollups are always whole """
+        return {
+                'day':           self.day,
+                'listened':      self.listened,
+                'plays':         self.plays,
+                'pauses':        self.pauses,
+                'max_timestamp': self.max_timestamp,
+                'events':        self.events,
+                '_links': {
+                    'topic': url_for('topics_topic', id=self.topic_id)
+                    }
+               }
+
+
+class ExtractEventRollup(PaginatedAPIMixin, db.Model):
+    cursor_keys = ("day", "id")
+    __table__ = db.Model.metadata.tables['extractevent_rollups']
+
+    def to_dict(self, fields=None):
+        """ ?fields= names event fields, so rollups are always whole """
+        return {
+                'day':           self.day,
+                'listened':      self.listened,
+                'plays':         self.plays,
+                'pauses':        self.pauses,
+                'max_timestamp': self.max_timestamp,
+                'events':        self.events,
+                '_links': {
+                    'extract': url_for('extracts_extract', id=self.extract_id)
+                    }
+               }
+
+
+class ItemEventRollup(PaginatedAPIMixin, db.Model):
+    cursor_keys = ("day", "id")
+    __table__ = db.Model.metadata.tables['itemevent_rollups']
+
+    def to_dict(self, fields=None):
+        """ ?fields= names event fields, so rollups are always whole """
+        return {
+                'day':           self.day,
+                'listened':      self.listened,
+                'plays':         self.plays,
+                'pauses':        self.pauses,
+                'max_timestamp': self.max_timestamp,
+                'events':        self.events,
+                '_links': {
+                    'item': url_for('items_item', id=self.item_id)
+                    }
+               }
+
+
+def event_rollup_model(name, parent):
+    return api.model(f'{name} Event Rollup', {
+        'day':              fields.Date,
+        'listened':         fields.Float,
+        'plays':            fields.Integer,
+        'pauses':           fields.Integer,
+        'max_timestamp':    fields.Float,
+        'events':           fields.Integer,
+        '_links':           fields.Nested(api.model(
+                                f'{name} Event Rollup Links',
+                                {parent: fields.String}))
+        })
+
+
+# The days of a date range whose raw events were pruned are served from
+# the daily rollups (see rollup.py) in the "rollups" list of the first
+# page of the paginated event responses.
+paginated_topic_events_model['rollups'] = fields.List(
+        fields.Nested(event_rollup_model('Topic', 'topic')))
+paginated_extract_events_model['rollups'] = fields.List(
+        fields.Nested(event_rollup_model('Extract', 'extract')))
+paginated_item_events_model['rollups'] = fields.List(
+        fields.Nested(event_rollup_model('Item', 'item')))
+
+
+def event_rollups(rollup, event_table, filters=None):
+    """ Split the ?start=&end= date range where the raw events were
+    pruned (see rollup.py)
+
+    Returns the daily rollups of the days before that and the start of
+    the raw events to serve for the rest. The rollups only come with
+    the first page of raw events. """
+    start = request.args.get('start')
+    end = request.args.get('end')
+    if not (start and end):
+        return [], start
+    try:
+        start = datetime.datetime.fromisoformat(start)
+    except ValueError:
+        api.abort(400, f"Invalid start date {start}")
+
+    state = db.session.query(EventRollupState).get(event_table)
+    if not (state and state.pruned_before and start < state.pruned_before):
+        return [], start
+    if request.args.get('cursor') or \
+       request.args.get('page', 1, type=int) != 1:
+        return [], state.pruned_before
+
+    query = db.session.query(rollup).filter_by(**(filters or {}))
+    query = rollup_days(query, rollup, start.date(),
+                        state.pruned_before.date(), end)
+    return [row.to_dict() for row in query], state.pruned_before
+
+
 class YoutubeTag(db.Model):
     __table__ = db.Model.metadata.tables['yttags']
     topics = db.relationship('TopicFile',
@@ -546,6 +868,44 @@ class MyTag(db.Model):
 # Add archived, deleted, datetime filters to the query string
 
 
+############################
+# Waveform Peaks API Model #
+############################
+
+peaks_model = api.model('Waveform Peaks', {
+    'start':            fields.Float,
+    'seconds_per_peak': fields.Float,
+    'duration':         fields.Float,
+    'bits':             fields.Integer,
+    'peaks':            fields.List(fields.Integer)
+    })
+
+
+def peaks_window(filepath):
+    """ Waveform peaks of an audio file from ?start= to ?end= seconds
+    At least ?width= peaks where the audio is long enough, each a min
+    and max of seconds_per_peak of audio, the first starting at start.
+    They are read from the saved peak index, not the audio, and not
+    marshalled one integer at a time """
+    index = load_index(filepath) if filepath else None
+    if index is None:
+        api.abort(404, "The waveform peaks have not been computed yet")
+    start = request.args.get('start', 0.0, type=float)
+    end = request.args.get('end', index.duration, type=float)
+    width = min(request.args.get('width', WINDOW_WIDTH, type=int),
+                MAX_WINDOW_WIDTH)
+    if not 0 <= start < end or width < 1:
+        api.abort(400, "Expected 0 <= start < end and a positive width")
+    first, seconds_per_peak, peaks = index.window(start, end, width)
+    return {
+            'start':            first,
+            'seconds_per_peak': seconds_per_peak,
+            'duration':         index.duration,
+            'bits':             index.bits,
+            'peaks':            peaks.tolist()
+           }
+
+
 ##########
 # Topics #
 ##########
@@ -554,8 +914,11 @@ class MyTag(db.Model):
 class Topics(Resource):
     @api.marshal_with(paginated_topics_model)
     @api.response(200, 'Successfully read topics')
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     # @api.expect(parser)
     def get(self):
         """ Get all Topics
@@ -571,11 +934,11 @@ class Topics(Resource):
 
         # Add filters
         if start and end:
-            query = query.filter(TopicFile.created_at >= start)
-            query = query.filter(TopicFile.created_at <= end)
+            query = created_between(query, TopicFile, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = TopicFile.to_collection_dict(query,
                                             page, per_page,
                                             'topics_topics')
@@ -586,8 +949,11 @@ class Topics(Resource):
 class TopicExtracts(Resource):
     @api.marshal_with(paginated_extracts_model)
     @api.response(200, "Successfully read topic's extracts")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self, id):
         """ Get a topic's extracts
         Allows the user to read a list of child
@@ -603,11 +969,11 @@ class TopicExtracts(Resource):
 
         # Add filters
         if start and end:
-            query = query.filter(ExtractFile.created_at >= start)
-            query = query.filter(ExtractFile.created_at <= end)
+            query = created_between(query, ExtractFile, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = TopicFile.to_collection_dict(query, page, per_page,
                                             'topics_topic_extracts', id=id)
         return data
@@ -617,43 +983,82 @@ class TopicExtracts(Resource):
 class Topic(Resource):
     @api.marshal_with(topic_model)
     @api.response(200, "Successfully read topic")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     def get(self, id):
         """ Get a single topic
         Allows the user to get a single topic according
         to the topic id"""
 
         topic = db.session.query(TopicFile).get_or_404(id)
-        return topic.to_dict()
+        return topic.to_dict(requested_fields())
+
+
+@topic_ns.route('/<int:id>/audio')
+class TopicAudio(Resource):
+    @api.response(200, "Streamed the topic's audio file")
+    @api.response(206, "Streamed the requested range of the audio file")
+    @api.response(304, "Audio file matches If-None-Match")
+    @api.response(404, "Topic or audio file not found")
+    @api.response(416, "Range outside of the audio file")
+    def get(self, id):
+        """ Get a topic's audio
+        Streams the audio file of the topic, supporting Range
+        requests for seeking and ETags for revalidation"""
+
+        topic = db.session.query(TopicFile).get_or_404(id)
+        return stream_audio(topic.filepath)
+
+
+@topic_ns.route('/<int:id>/peaks')
+class TopicPeaks(Resource):
+    @api.response(200, "Read the topic's waveform peaks", peaks_model)
+    @api.response(404, "Topic or waveform peaks not found")
+    @api.param('start', 'Seconds into the audio, 0 by default')
+    @api.param('end', 'Seconds into the audio, the end by default')
+    @api.param('width', 'Minimum number of peaks, eg. the pixel width')
+    def get(self, id):
+        """ Get a topic's waveform peaks
+        Allows the user to draw the waveform of any part of the
+        topic's audio at any zoom"""
+
+        topic = db.session.query(TopicFile).get_or_404(id)
+        return peaks_window(topic.filepath)
 
 
 @topic_ns.route('/<int:id>/events')
 class TopicEvents(Resource):
     @api.marshal_with(paginated_topic_events_model)
     @api.response(200, "Successfully read topic's events")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self, id):
         """ Get a topic's events
         Allows the user to get a topic's events according
         to the topic id"""
 
         topic = db.session.query(TopicFile).get_or_404(id)
+        rollups, start = event_rollups(TopicEventRollup, 'topicevents',
+                                       filters={'topic_id': topic.id})
+
         query = db.session.query(TopicEvent).filter_by(topic_id=topic.id)
 
         # Parse query string for filters
         query_params = request.args
-        start = query_params.get('start')
         end = query_params.get('end')
 
         # Add filters
         if start and end:
-            query = query.filter(TopicEvent.created_at >= start)
-            query = query.filter(TopicEvent.created_at <= end)
+            query = created_between(query, TopicEvent, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = TopicEvent.to_collection_dict(query, page, per_page,
                                              'topics_topic_events', id=id)
+        data['rollups'] = rollups
         return data
 
 # @topic_ns.route('/yttags/')
@@ -673,29 +1078,34 @@ class TopicEvents(Resource):
 class TopicsEvents(Resource):
     @api.marshal_with(paginated_topic_events_model)
     @api.response(200, 'Successfully read topic events')
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self):
         """ Get all topic events
         Allows the user to read a list of all events """
 
+        rollups, start = event_rollups(TopicEventRollup, 'topicevents')
+
         query = db.session.query(TopicEvent)
 
         # Parse query string for filters
         query_params = request.args
-        start = query_params.get('start')
         end = query_params.get('end')
 
         # Add filters
         if start and end:
-            query = query.filter(TopicEvent.created_at >= start)
-            query = query.filter(TopicEvent.created_at <= end)
+            query = created_between(query, TopicEvent, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = TopicEvent.to_collection_dict(query,
                                              page, per_page,
                                              'events_topics_events')
+        data['rollups'] = rollups
         return data
 
 
@@ -703,28 +1113,34 @@ class TopicsEvents(Resource):
 class ExtractsEvents(Resource):
     @api.marshal_with(paginated_extract_events_model)
     @api.response(200, 'Successfully read extract events')
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self):
         """ Get all extract events
         Allows the user to read a list of all extract events """
+
+        rollups, start = event_rollups(ExtractEventRollup, 'extractevents')
+
         query = db.session.query(ExtractEvent)
 
         # Parse query string for filters
         query_params = request.args
-        start = query_params.get('start')
         end = query_params.get('end')
 
         # Add filters
         if start and end:
-            query = query.filter(ExtractEvent.created_at >= start)
-            query = query.filter(ExtractEvent.created_at <= end)
+            query = created_between(query, ExtractEvent, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ExtractEvent.to_collection_dict(query,
                                                page, per_page,
                                                'events_extracts_events')
+        data['rollups'] = rollups
         return data
 
 
@@ -732,29 +1148,34 @@ class ExtractsEvents(Resource):
 class ItemsEvents(Resource):
     @api.marshal_with(paginated_item_events_model)
     @api.response(200, 'Successfully read item events')
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self):
         """ Get all item events
         Allows the user to read a list of all item events """
 
+        rollups, start = event_rollups(ItemEventRollup, 'itemevents')
+
         query = db.session.query(ItemEvent)
 
         # Parse query string for filters
         query_params = request.args
-        start = query_params.get('start')
         end = query_params.get('end')
 
         # Add filters
         if start and end:
-            query = query.filter(ItemEvent.created_at >= start)
-            query = query.filter(ItemEvent.created_at <= end)
+            query = created_between(query, ItemEvent, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ItemEvent.to_collection_dict(query,
                                             page, per_page,
                                             'events_items_events')
+        data['rollups'] = rollups
         return data
 
 
@@ -766,18 +1187,17 @@ class ItemsEvents(Resource):
 class Extracts(Resource):
     @api.marshal_with(paginated_extracts_model)
     @api.response(200, 'Successfully read extracts')
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self):
         """ Get outstanding extracts
         Allows the user to read a list of all outstanding extract
         files in the database that have not been archived or deleted"""
 
-        query = (db
-                 .session
-                 .query(ExtractFile)
-                 .filter(ExtractFile.filepath != None)
-                 .filter(ExtractFile.endstamp != None))
+        query = recorded_extracts(db.session.query(ExtractFile), ExtractFile)
 
         # Parse query string for filters
         query_params = request.args
@@ -786,11 +1206,11 @@ class Extracts(Resource):
 
         # Add filters
         if start and end:
-            query = query.filter(ExtractFile.created_at >= start)
-            query = query.filter(ExtractFile.created_at <= end)
+            query = created_between(query, ExtractFile, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ExtractFile.to_collection_dict(query,
                                               page, per_page,
                                               'extracts_extracts')
@@ -801,6 +1221,7 @@ class Extracts(Resource):
 class Extract(Resource):
     @api.marshal_with(extract_model)
     @api.response(200, "Successfully read a single extract")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     def get(self, id):
         """ Get a single extract
         Allows the user to read a single extract according to
@@ -811,27 +1232,67 @@ class Extract(Resource):
                    .filter(ExtractFile.filepath != None)
                    .filter(Extract.endstamp != None)
                    .get_or_404(id))
-        return extract.to_dict()
+        return extract.to_dict(requested_fields())
+
+
+@extract_ns.route('/<int:id>/audio')
+class ExtractAudio(Resource):
+    @api.response(200, "Streamed the extract's audio file")
+    @api.response(206, "Streamed the requested range of the audio file")
+    @api.response(304, "Audio file matches If-None-Match")
+    @api.response(404, "Extract or rendered audio file not found")
+    @api.response(416, "Range outside of the audio file")
+    def get(self, id):
+        """ Get an extract's audio
+        Streams the audio file of the extract, supporting Range
+        requests for seeking and ETags for revalidation"""
+
+        extract = db.session.query(ExtractFile).get_or_404(id)
+        if extract.render_status not in PLAYABLE_RENDER_STATUSES:
+            api.abort(404, "The audio file is still being rendered")
+        return stream_audio(extract.filepath)
+
+
+@extract_ns.route('/<int:id>/peaks')
+class ExtractPeaks(Resource):
+    @api.response(200, "Read the extract's waveform peaks", peaks_model)
+    @api.response(404, "Extract or waveform peaks not found")
+    @api.param('start', 'Seconds into the audio, 0 by default')
+    @api.param('end', 'Seconds into the audio, the end by default')
+    @api.param('width', 'Minimum number of peaks, eg. the pixel width')
+    def get(self, id):
+        """ Get an extract's waveform peaks
+        Allows the user to draw the waveform of any part of the
+        extract's audio at any zoom"""
+
+        extract = db.session.query(ExtractFile).get_or_404(id)
+        if extract.render_status not in PLAYABLE_RENDER_STATUSES:
+            api.abort(404, "The audio file is still being rendered")
+        return peaks_window(extract.filepath)
 
 
 @extract_ns.route('/<int:id>/topic')
 class ExtractTopic(Resource):
     @api.marshal_with(topic_model)
     @api.response(200, "Successfully read parent topic of extract")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     def get(self, id):
         """ Get extract topic
         Allows the user to read the parent topic of an extract
         according to the extract id"""
         extract = db.session.query(ExtractFile).get_or_404(id)
-        return extract.topic.to_dict()
+        return extract.topic.to_dict(requested_fields())
 
 
 @extract_ns.route('/<int:id>/items')
 class ExtractItems(Resource):
     @api.marshal_with(paginated_items_model)
     @api.response(200, "Successfully read child items of extract")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self, id):
         """ Get extract items
         Allows the user to read the parent topic of an extract
@@ -847,47 +1308,53 @@ class ExtractItems(Resource):
 
         # Add filters
         if start and end:
-            query = query.filter(ItemFile.created_at >= start)
-            query = query.filter(ItemFile.created_at <= end)
+            query = created_between(query, ItemFile, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ItemFile.to_collection_dict(query,
                                            page, per_page,
                                            'extracts_extracts')
         return data
-        return extract.topic.to_dict()
+        return extract.topic.to_dict(requested_fields())
 
 
 @extract_ns.route('/<int:id>/events')
 class ExtractEvents(Resource):
     @api.marshal_with(paginated_extract_events_model)
     @api.response(200, "Successfully read extract's events")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self, id):
         """ Get extract's events
         Allows the user to read the events of the extract """
 
         extract = db.session.query(ExtractFile).get_or_404(id)
+        rollups, start = event_rollups(ExtractEventRollup, 'extractevents',
+                                       filters={'extract_id': extract.id})
+
         query = db.session.query(ExtractEvent).filter_by(extract_id=extract.id)
 
         # Parse query string for filters
         query_params = request.args
-        start = query_params.get('start')
         end = query_params.get('end')
 
         # Add filters
         if start and end:
-            query = query.filter(ExtractEvent.created_at >= start)
-            query = query.filter(ExtractEvent.created_at <= end)
+            query = created_between(query, ExtractEvent, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ExtractEvent.to_collection_dict(query,
                                                page, per_page,
                                                'extracts_extract_events',
                                                id=id)
+        data['rollups'] = rollups
         return data
 
 
@@ -899,18 +1366,17 @@ class ExtractEvents(Resource):
 class Items(Resource):
     @api.marshal_with(paginated_items_model)
     @api.response(200, "Successfully read the parent of extract")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self):
         """ Get outstanding items
         Allows the user to get a list of outstanding
         items that haven't been deleted or archived"""
 
-        query = (db
-                 .session
-                 .query(ItemFile)
-                 .filter(ItemFile.question_filepath != None)
-                 .filter(ItemFile.cloze_endstamp != None))
+        query = clozed_items(db.session.query(ItemFile), ItemFile)
 
         # Parse query string for filters
         query_params = request.args
@@ -919,11 +1385,11 @@ class Items(Resource):
 
         # Add filters
         if start and end:
-            query = query.filter(ItemFile.created_at >= start)
-            query = query.filter(ItemFile.created_at <= end)
+            query = created_between(query, ItemFile, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ItemFile.to_collection_dict(query,
                                            page, per_page,
                                            'items_items')
@@ -934,6 +1400,7 @@ class Items(Resource):
 class Item(Resource):
     @api.marshal_with(item_model)
     @api.response(200, "Successfully read the parent extract of item")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     def get(self, id):
         """ Get item extract
         Allows the user to get the parent extract of the item
@@ -945,52 +1412,114 @@ class Item(Resource):
                 .filter(ItemFile.cloze_endstamp != None)
                 .filter(ItemFile.question_filepath != None)
                 .get_or_404(id))
-        return item.to_dict()
+        return item.to_dict(requested_fields())
+
+
+@item_ns.route('/<int:id>/question')
+class ItemQuestion(Resource):
+    @api.response(200, "Streamed the item's question audio file")
+    @api.response(206, "Streamed the requested range of the audio file")
+    @api.response(304, "Audio file matches If-None-Match")
+    @api.response(404, "Item or rendered audio file not found")
+    @api.response(416, "Range outside of the audio file")
+    def get(self, id):
+        """ Get an item's question audio
+        Streams the question audio file of the item, with the cloze
+        beeped out, supporting Range requests and ETags"""
+
+        item = db.session.query(ItemFile).get_or_404(id)
+        if item.render_status not in PLAYABLE_RENDER_STATUSES:
+            api.abort(404, "The audio file is still being rendered")
+        return stream_audio(item.question_filepath)
+
+
+@item_ns.route('/<int:id>/question/peaks')
+class ItemQuestionPeaks(Resource):
+    @api.response(200, "Read the item's question waveform peaks",
+                  peaks_model)
+    @api.response(404, "Item or waveform peaks not found")
+    @api.param('start', 'Seconds into the audio, 0 by default')
+    @api.param('end', 'Seconds into the audio, the end by default')
+    @api.param('width', 'Minimum number of peaks, eg. the pixel width')
+    def get(self, id):
+        """ Get an item's question waveform peaks
+        Allows the user to check the cloze boundaries of the item
+        on the waveform of its question audio"""
+
+        item = db.session.query(ItemFile).get_or_404(id)
+        if item.render_status not in PLAYABLE_RENDER_STATUSES:
+            api.abort(404, "The audio file is still being rendered")
+        return peaks_window(item.question_filepath)
+
+
+@item_ns.route('/<int:id>/cloze')
+class ItemCloze(Resource):
+    @api.response(200, "Streamed the item's cloze audio file")
+    @api.response(206, "Streamed the requested range of the audio file")
+    @api.response(304, "Audio file matches If-None-Match")
+    @api.response(404, "Item or rendered audio file not found")
+    @api.response(416, "Range outside of the audio file")
+    def get(self, id):
+        """ Get an item's cloze audio
+        Streams the cloze (answer) audio file of the item, supporting
+        Range requests and ETags"""
+
+        item = db.session.query(ItemFile).get_or_404(id)
+        if item.render_status not in PLAYABLE_RENDER_STATUSES:
+            api.abort(404, "The audio file is still being rendered")
+        return stream_audio(item.cloze_filepath)
 
 
 @item_ns.route('/<int:id>/extract')
 class ItemExtract(Resource):
     @api.marshal_with(extract_model)
     @api.response(200, "Successfully read the parent extract of item")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     def get(self, id):
         """ Get item extract
         Allows the user to get the parent extract of the item
         according to the item id"""
 
         item = db.session.query(ItemFile).get_or_404(id)
-        return item.extract.to_dict()
+        return item.extract.to_dict(requested_fields())
 
 
 @item_ns.route('/<int:id>/events')
 class ItemEvents(Resource):
     @api.marshal_with(paginated_item_events_model)
     @api.response(200, "Successfully read the events of item")
+    @api.param('fields', 'Fields to return, eg. id,title,rendered')
     @api.param('start', 'Date string to match after')
     @api.param('end', 'Date string to match before')
+    @api.param('cursor', 'Cursor of a next or prev link')
+    @api.param('total', 'Include the total counts')
     def get(self, id):
         """ Get item's events
         Allows the user to get the events of the item
         according to the item id"""
 
         item = db.session.query(ItemFile).get_or_404(id)
+        rollups, start = event_rollups(ItemEventRollup, 'itemevents',
+                                       filters={'item_id': item.id})
+
         query = db.session.query(ItemEvent).filter_by(item_id=item.id)
 
         # Parse query string for filters
         query_params = request.args
-        start = query_params.get('start')
         end = query_params.get('end')
 
         # Add filters
         if start and end:
-            query = query.filter(ItemEvent.created_at >= start)
-            query = query.filter(ItemEvent.created_at <= end)
+            query = created_between(query, ItemEvent, start, end)
 
-        page = request.args.get('page', 1, type=int)
-        per_page = min(request.args.get('per_page', 10, type=int), 100)
+        page = request.args.get('page', type=int)
+        per_page = min(request.args.get('per_page', PER_PAGE, type=int),
+                       MAX_PER_PAGE)
         data = ItemEvent.to_collection_dict(query,
                                             page, per_page,
                                             'items_item_events',
                                             id=id)
+        data['rollups'] = rollups
         return data
 
 
@@ -0,0 +1,178 @@
+"""Keyset (cursor) pagination for the old_api.py collections.
+
+OFFSET pagination makes SQLite step over every earlier row, so deep
+pages of the event tables get slower the further you go, and counting
+the total runs another full COUNT(*) per page. Keyset pagination orders
+by unique key columns, eg. (created_at, id), and starts each page
+strictly after the last row of the previous one, which an index on the
+key columns finds directly.
+
+Cursors are opaque url-safe strings holding the direction and the key
+values of the row a page starts from.
+"""
+import base64
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+
+# Default and maximum number of rows per page.
+PER_PAGE = 10
+MAX_PER_PAGE = 100
+# Seconds a total count is reused for the same query.
+COUNT_CACHE_TTL = 60
+# Number of cached total counts.
+COUNT_CACHE_SIZE = 256
+
+NEXT = "next"
+PREV = "prev"
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return datetime.date.fromisoformat(value["d"])
+        raise ValueError(f"Unknown cursor value {value}.")
+    return value
+
+
+def encode_cursor(direction: str, values: Sequence[Any]) -> str:
+    """
+    :direction: NEXT for the rows after values, PREV for the rows before.
+    :values: Key values of the row the page starts from.
+    :returns: Opaque cursor.
+    """
+    data = json.dumps([direction] + [_encode_value(v) for v in values],
+                      separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, List[Any]]:
+    """Raises ValueError for cursors not made by encode_cursor.
+
+    :returns: (direction, key values)
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, *values = json.loads(data)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor}.") from e
+    if direction not in (NEXT, PREV) or not values:
+        raise ValueError(f"Invalid cursor {cursor}.")
+    return direction, [_decode_value(value) for value in values]
+
+
+def after(keys: Sequence, values: Sequence[Any], descending: bool = False):
+    """Filter for the rows after values in (keys) order.
+
+    Written as key >= value AND (key > value OR ...) rather than a row
+    value comparison so SQLite can range scan an index on the first key.
+    """
+    column, value = keys[0], values[0]
+    strict = column < value if descending else column > value
+    if len(keys) == 1:
+        return strict
+    first = column <= value if descending else column >= value
+    return and_(first, or_(strict, after(keys[1:], values[1:], descending)))
+
+
+def keyset_query(query: Query, keys: Sequence, per_page: int,
+                 direction: str = NEXT,
+                 values: Optional[Sequence[Any]] = None) -> Query:
+    """The query of one page, with one row more than per_page to tell
+    whether there is another page.
+
+    :direction: NEXT for the rows after values, PREV for the rows before,
+    which come in descending order.
+    :values: Key values of the row the page starts from, the first page
+    if None.
+    """
+    backwards = direction == PREV
+    if values is not None:
+        query = query.filter(after(keys, values, descending=backwards))
+    order = [key.desc() if backwards else key.asc() for key in keys]
+    return query.order_by(None).order_by(*order).limit(per_page + 1)
+
+
+def keyset_page(query: Query, keys: Sequence, per_page: int,
+                cursor: Optional[str] = None
+                ) -> Tuple[List, Optional[str], Optional[str]]:
+    """Fetch one page of query ordered by keys.
+
+    :keys: Columns that together are unique, eg. (created_at, id).
+    Rows with a NULL key are never returned.
+    :cursor: Cursor from a previous page, the first page if None.
+    :returns: (rows, next cursor, prev cursor), the cursors are None at
+    the ends of the collection.
+    """
+    direction, values = decode_cursor(cursor) if cursor else (NEXT, None)
+    backwards = direction == PREV
+    if values is not None and len(values) != len(keys):
+        raise ValueError(f"Invalid cursor {cursor}.")
+    rows = keyset_query(query, keys, per_page, direction, values).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    def row_cursor(row_direction: str, row) -> str:
+        return encode_cursor(row_direction,
+                             [getattr(row, key.key) for key in keys])
+
+    has_next = more if not backwards else True
+    has_prev = more if backwards else values is not None
+    return (rows,
+            row_cursor(NEXT, rows[-1]) if has_next else None,
+            row_cursor(PREV, rows[0]) if has_prev else None)
+
+
+class CountCache(object):
+
+    """Total row counts of queries, reused for COUNT_CACHE_TTL seconds.
+    """
+
+    def __init__(self, ttl: float = COUNT_CACHE_TTL,
+                 size: int = COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._counts: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(query: Query) -> str:
+        compiled = query.statement.compile()
+        return f"{compiled} {sorted(compiled.params.items(), key=str)}"
+
+    def count(self, query: Query) -> int:
+        """
+        :returns: Number of rows of query.
+        """
+        key = self.cache_key(query)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1]
+        total = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (now, total)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.size:
+                self._counts.popitem(last=False)
+        return total
@@ -0,0 +1,242 @@
+"""Multi-resolution waveform peaks of audio files.
+
+A peak is the lowest and highest sample of a short stretch of audio.
+Level 0 has PEAKS_PER_SECOND peaks per second and every further level
+merges pairs of peaks of the level before, halving the resolution down
+to a single peak for the whole file, like the mipmaps of a texture. A
+timeline of any time window at any zoom then reads about as many peaks
+as it is wide from one level, without decoding the audio.
+
+The peaks are saved next to the audio file (abc.m4a -> abc.m4a.peaks) as
+int8 or int16 min/max pairs, tagged with the mtime and size of the audio
+file. waveform.py computes them with NumPy. Reading them needs neither
+NumPy nor ffmpeg, so old_api.py serves them directly.
+"""
+import math
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INDEX_EXT = ".peaks"
+# Peaks per second of level 0, ie. 10ms per peak.
+PEAKS_PER_SECOND = 100
+# Bits of each saved min and max, 8 or 16.
+PEAK_BITS = 8
+# Default and maximum number of peaks returned for a window.
+WINDOW_WIDTH = 1000
+MAX_WINDOW_WIDTH = 10000
+
+MAGIC = b"PEAK"
+VERSION = 1
+# magic, version, audio mtime_ns, audio size, sample rate, samples per
+# peak, bits, number of level 0 peaks
+HEADER = struct.Struct("<4sHqqIIHQ")
+# array typecode of the saved peaks by bits.
+TYPECODES = {8: "b", 16: "h"}
+
+
+def peaks_filepath(audio_filepath: str) -> str:
+    """
+    :returns: Path of the saved peaks of an audio file.
+    """
+    return audio_filepath + INDEX_EXT
+
+
+def samples_per_peak(rate: int) -> int:
+    """
+    :rate: Sample rate of the audio.
+    :returns: Samples (per channel) reduced into each level 0 peak.
+    """
+    return max(1, round(rate / PEAKS_PER_SECOND))
+
+
+def level_sizes(n: int) -> List[int]:
+    """
+    :n: Number of level 0 peaks.
+    :returns: Number of peaks of each level, down to a single peak.
+    """
+    sizes = [n]
+    while sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+
+def level0(blocks: Iterable["np.ndarray"], samples_per_peak: int
+           ) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Lowest and highest sample of every samples_per_peak frames.
+
+    :blocks: Consecutive samples, shaped (frames,) or (frames, channels).
+    Blocks whose length is a multiple of samples_per_peak are reduced
+    without copying. All channels go into the same peak.
+    :returns: (mins, maxs) in the dtype of the samples.
+    :raises ValueError: If there are no samples.
+    """
+    mins: List["np.ndarray"] = []
+    maxs: List["np.ndarray"] = []
+    rest = None
+    for block in blocks:
+        block = block.reshape(len(block), -1)
+        if rest is not None and len(rest):
+            block = np.concatenate([rest, block])
+        whole = len(block) - len(block) % samples_per_peak
+        if whole:
+            peaks = block[:whole].reshape(whole // samples_per_peak, -1)
+            mins.append(peaks.min(axis=1))
+            maxs.append(peaks.max(axis=1))
+        rest = block[whole:]
+    if rest is not None and len(rest):
+        mins.append(rest.min(keepdims=True).ravel())
+        maxs.append(rest.max(keepdims=True).ravel())
+    if not mins:
+        raise ValueError("The audio has no samples.")
+    return np.concatenate(mins), np.concatenate(maxs)
+
+
+def quantize(values: "np.ndarray", bits: int = PEAK_BITS) -> "np.ndarray":
+    """Scale samples to signed bits wide integers.
+
+    8 bit WAV samples are unsigned around 128, float samples are -1 to 1.
+    """
+    dtype = values.dtype
+    if dtype.kind == "f":
+        zero, scale = 0.0, 1.0
+    elif dtype.kind == "u":
+        zero = scale = 2.0 ** (dtype.itemsize * 8 - 1)
+    else:
+        zero, scale = 0.0, 2.0 ** (dtype.itemsize * 8 - 1)
+    limit = 2 ** (bits - 1)
+    scaled = np.floor((values.astype(np.float64) - zero) * (limit / scale))
+    return np.clip(scaled, -limit, limit - 1).astype(f"<i{bits // 8}")
+
+
+def mipmap(mins: "np.ndarray", maxs: "np.ndarray"
+           ) -> List[Tuple["np.ndarray", "np.ndarray"]]:
+    """
+    :returns: (mins, maxs) of level 0 and of every coarser level.
+    """
+    levels = [(mins, maxs)]
+    while len(mins) > 1:
+        if len(mins) % 2:
+            mins = np.append(mins, mins[-1])
+            maxs = np.append(maxs, maxs[-1])
+        mins = mins.reshape(-1, 2).min(axis=1)
+        maxs = maxs.reshape(-1, 2).max(axis=1)
+        levels.append((mins, maxs))
+    return levels
+
+
+def save_peaks(filepath: str, source_key: Tuple[int, int], rate: int,
+               samples_per_peak: int, mins: "np.ndarray",
+               maxs: "np.ndarray") -> None:
+    """Write the levels of quantized level 0 peaks, tagged with the mtime
+    and size of their audio file, atomically.
+    """
+    bits = mins.dtype.itemsize * 8
+    partial_fp = filepath + ".partial"
+    with open(partial_fp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, *source_key, rate,
+                            samples_per_peak, bits, len(mins)))
+        for level_mins, level_maxs in mipmap(mins, maxs):
+            f.write(np.stack([level_mins, level_maxs], axis=1).tobytes())
+    os.replace(partial_fp, filepath)
+
+
+class PeakIndex(object):
+
+    """Header of saved peaks, reading the peaks of a window on demand.
+    """
+
+    __slots__ = ("filepath", "rate", "samples_per_peak", "bits", "sizes",
+                 "offsets")
+
+    def __init__(self, filepath: str, rate: int, samples_per_peak: int,
+                 bits: int, n: int):
+        """
+        :filepath: The saved peaks.
+        :n: Number of level 0 peaks.
+        """
+        self.filepath = filepath
+        self.rate = rate
+        self.samples_per_peak = samples_per_peak
+        self.bits = bits
+        self.sizes = level_sizes(n)
+        # File offset of each level, plus the file size.
+        self.offsets = list(accumulate(
+                [HEADER.size] + [size * bits // 4 for size in self.sizes]))
+
+    @property
+    def peaks_per_second(self) -> float:
+        return self.rate / self.samples_per_peak
+
+    @property
+    def duration(self) -> float:
+        """Seconds of audio, rounded up to a whole peak."""
+        return self.sizes[0] / self.peaks_per_second
+
+    def level_for(self, seconds: float, width: int) -> int:
+        """
+        :returns: The coarsest level with at least width peaks in seconds
+        of audio.
+        """
+        peaks = seconds * self.peaks_per_second
+        level = 0
+        while level + 1 < len(self.sizes) and \
+                peaks / 2 ** (level + 1) >= width:
+            level += 1
+        return level
+
+    def window(self, start: float, end: float, width: int = WINDOW_WIDTH
+               ) -> Tuple[float, float, array]:
+        """Peaks from start to end seconds, from the coarsest level with at
+        least width peaks (or all there are) between them.
+
+        :returns: (start seconds of the first peak, seconds per peak,
+        min, max, min, max ... of each peak).
+        """
+        level = self.level_for(end - start, width)
+        seconds_per_peak = 2 ** level / self.peaks_per_second
+        first = max(0, int(start / seconds_per_peak))
+        last = min(self.sizes[level], math.ceil(end / seconds_per_peak))
+        peaks = array(TYPECODES[self.bits])
+        if last > first:
+            with open(self.filepath, "rb") as f:
+                f.seek(self.offsets[level] + first * 2 * peaks.itemsize)
+                peaks.frombytes(f.read((last - first) * 2 * peaks.itemsize))
+            if sys.byteorder == "big":
+                peaks.byteswap()
+        return first * seconds_per_peak, seconds_per_peak, peaks
+
+
+def load_index(audio_filepath: str) -> Optional[PeakIndex]:
+    """
+    :returns: The saved peaks of an audio file or None if they are
+    missing, corrupt or older than the audio file.
+    """
+    filepath = peaks_filepath(audio_filepath)
+    try:
+        stat = os.stat(audio_filepath)
+        with open(filepath, "rb") as f:
+            header = f.read(HEADER.size)
+            size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, version, mtime_ns, audio_size, rate, samples_per_peak, bits, \
+        n = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or \
+       (mtime_ns, audio_size) != (stat.st_mtime_ns, stat.st_size) or \
+       bits not in TYPECODES or not rate or not samples_per_peak or not n:
+        return None
+    index = PeakIndex(filepath, rate, samples_per_peak, bits, n)
+    if index.offsets[-1] != size:
+        return None
+    return index
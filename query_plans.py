@@ -0,0 +1,183 @@
+"""EXPLAIN QUERY PLAN regression check for the hot query paths.
+
+Builds the queries of the Queue classes, renderer.py, heartbeat.py,
+rollup.py and old_api.py with the same functions they use, explains
+them against an empty, fully migrated SQLite database and fails if any
+of them scans a table without an index or sorts in a temporary B-tree.
+
+    python query_plans.py
+"""
+import sys
+import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Query
+from typing import Dict, List
+from models import (Base, TopicFile, ExtractFile, ItemFile, MediaFile,
+                    Playlist, RenderJob, TopicEvent, ExtractEvent, ItemEvent,
+                    TopicEventRollup, ExtractEventRollup, ItemEventRollup,
+                    TranscriptCue, transcript_cues_condition, session)
+from migrations import migrate
+from pagination import keyset_query, NEXT, PER_PAGE
+from api_filters import (created_between, recorded_extracts, clozed_items,
+                         rollup_days)
+from rollup import newest_event_query
+
+START, END = "2020-01-01", "2020-02-01"
+NOW = datetime.datetime(2020, 2, 1)
+
+
+def keyset(query: Query, model) -> Query:
+    """A page of query as old_api.py pages it after a cursor.
+    """
+    keys = [getattr(model, key) for key in ("created_at", "id")]
+    return keyset_query(query, keys, PER_PAGE, NEXT, [START, 1])
+
+
+def rollups(rollup, **filters) -> Query:
+    """The rollups old_api.event_rollups serves for ?start=&end=.
+    """
+    return rollup_days(session.query(rollup).filter_by(**filters), rollup,
+                       datetime.date(2020, 1, 1), datetime.date(2020, 1, 8),
+                       END)
+
+
+def hot_queries() -> Dict[str, Query]:
+    """
+    :returns: Query name mapped to a query as the application builds it.
+    """
+    topic, extract = TopicFile(id=1), ExtractFile(id=1)
+    return {
+        "TopicQueue.get_global_topics": TopicFile.queue_query(),
+        "TopicQueue.stop_recording": ExtractFile.newest_query().limit(1),
+        "ExtractQueue.get_global_extracts": ExtractFile.queue_query(),
+        "ItemQueue.get_global_items": ItemFile.queue_query(),
+        "RenderPool.claim": RenderJob.due_query(session, NOW).limit(1),
+        "RenderPool.claim clozes of extract":
+            RenderJob.cloze_batch_query(session, NOW, 1, 1, 15),
+        "TopicFile.extracts":
+            session.query(ExtractFile).with_parent(topic, "extracts"),
+        "ExtractFile.items":
+            session.query(ItemFile).with_parent(extract, "items"),
+        "Playlist.topics":
+            session.query(TopicFile).with_parent(Playlist(id=1), "topics"),
+        "transcript_search.index_topic":
+            session.query(TranscriptCue)
+            .filter(transcript_cues_condition(TopicFile, [1])),
+        "index_extract_transcripts":
+            session.query(TranscriptCue)
+            .filter(transcript_cues_condition(ExtractFile, [1, 2])),
+        "find_media_file": MediaFile.lookup_query("/topicfiles/a.m4a"),
+        "old_api Topics":
+            created_between(session.query(TopicFile), TopicFile, START, END),
+        "old_api Extracts":
+            created_between(recorded_extracts(session.query(ExtractFile),
+                                              ExtractFile),
+                            ExtractFile, START, END),
+        "old_api Items":
+            created_between(clozed_items(session.query(ItemFile), ItemFile),
+                            ItemFile, START, END),
+        "old_api TopicEvents":
+            created_between(session.query(TopicEvent).filter_by(topic_id=1),
+                            TopicEvent, START, END),
+        "old_api ExtractEvents":
+            created_between(session.query(ExtractEvent)
+                            .filter_by(extract_id=1),
+                            ExtractEvent, START, END),
+        "old_api ItemEvents":
+            created_between(session.query(ItemEvent).filter_by(item_id=1),
+                            ItemEvent, START, END),
+        "old_api TopicsEvents":
+            created_between(session.query(TopicEvent), TopicEvent,
+                            START, END),
+        "old_api ExtractsEvents":
+            created_between(session.query(ExtractEvent), ExtractEvent,
+                            START, END),
+        "old_api ItemsEvents":
+            created_between(session.query(ItemEvent), ItemEvent,
+                            START, END),
+        "old_api TopicEvents rollups":
+            rollups(TopicEventRollup, topic_id=1),
+        "old_api TopicsEvents rollups": rollups(TopicEventRollup),
+        "old_api ExtractsEvents rollups": rollups(ExtractEventRollup),
+        "old_api ItemsEvents rollups": rollups(ItemEventRollup),
+        "rollup.open_event_day topicevents": newest_event_query(TopicEvent),
+        "rollup.open_event_day extractevents":
+            newest_event_query(ExtractEvent),
+        "rollup.open_event_day itemevents": newest_event_query(ItemEvent),
+        "old_api Topics keyset page":
+            keyset(session.query(TopicFile), TopicFile),
+        "old_api Extracts keyset page":
+            keyset(recorded_extracts(session.query(ExtractFile),
+                                     ExtractFile), ExtractFile),
+        "old_api Items keyset page":
+            keyset(clozed_items(session.query(ItemFile), ItemFile),
+                   ItemFile),
+        "old_api TopicExtracts keyset page":
+            keyset(session.query(ExtractFile).filter_by(topic_id=1),
+                   ExtractFile),
+        "old_api ExtractItems keyset page":
+            keyset(session.query(ItemFile).filter_by(extract_id=1),
+                   ItemFile),
+        "old_api TopicEvents keyset page":
+            keyset(session.query(TopicEvent).filter_by(topic_id=1),
+                   TopicEvent),
+        "old_api ExtractEvents keyset page":
+            keyset(session.query(ExtractEvent).filter_by(extract_id=1),
+                   ExtractEvent),
+        "old_api ItemEvents keyset page":
+            keyset(session.query(ItemEvent).filter_by(item_id=1),
+                   ItemEvent),
+        "old_api TopicsEvents keyset page":
+            keyset(session.query(TopicEvent), TopicEvent),
+        "old_api ExtractsEvents keyset page":
+            keyset(session.query(ExtractEvent), ExtractEvent),
+        "old_api ItemsEvents keyset page":
+            keyset(session.query(ItemEvent), ItemEvent),
+    }
+
+
+def explain(engine, query: Query) -> List[str]:
+    """
+    :returns: The detail column of EXPLAIN QUERY PLAN.
+    """
+    compiled = query.statement.compile(dialect=engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    connection = engine.raw_connection()
+    try:
+        rows = connection.execute("EXPLAIN QUERY PLAN " + str(compiled),
+                                  params).fetchall()
+    finally:
+        connection.close()
+    return [row[-1] for row in rows]
+
+
+def is_scan(detail: str) -> bool:
+    """A full table scan or a sort that could not use an index.
+    """
+    if detail.startswith("SCAN") and "USING" not in detail:
+        return True
+    return "TEMP B-TREE" in detail
+
+
+def check_query_plans() -> List[str]:
+    """
+    :returns: Failure messages, empty if every hot query uses an index.
+    """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    migrate(engine)
+    failures: List[str] = []
+    for name, query in hot_queries().items():
+        plan = explain(engine, query)
+        if any(is_scan(detail) for detail in plan):
+            failures.append(f"{name}: {' / '.join(plan)}")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_query_plans()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{len(hot_queries()) - len(failures)}/{len(hot_queries())} "
+          "hot queries use an index.")
+    sys.exit(1 if failures else 0)
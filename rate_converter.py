@@ -0,0 +1,207 @@
+"""Playback rate conversion of TopicFiles on a process pool.
+
+AudioDownloader submits each finished download with a playback rate
+other than 1 to a RateConverter and carries on downloading while ffmpeg
+converts earlier files. Conversions write a hidden partial file and
+rename it over the original, so MPD never sees a half converted file.
+
+rerate_topics converts existing TopicFiles to a new rate and rescales
+their duration, cur_timestamp and the stamps of their ExtractFiles.
+
+    python rate_converter.py <rate> <topic id> [<topic id> ...]
+"""
+import os
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+from models import TopicFile, session
+from renderer import partial_filepath, priority_prefix, run_ffmpeg, discard
+from waveform import peak_indexer
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("rate_converter.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# Concurrent ffmpeg conversions.
+RATE_WORKERS = 2
+# nice(1) niceness of the conversions.
+RATE_NICENESS = 10
+# Playback rates TopicFiles may be converted to.
+MIN_RATE, MAX_RATE = 0.25, 4.0
+
+
+def atempo_filter(factor: float) -> str:
+    """ffmpeg atempo only accepts factors between 0.5 and 2, so chain
+    several for larger changes.
+    """
+    filters: List[str] = []
+    while factor > 2:
+        filters.append("atempo=2.0")
+        factor /= 2
+    while factor < 0.5:
+        filters.append("atempo=0.5")
+        factor /= 0.5
+    filters.append(f"atempo={factor}")
+    return ",".join(filters)
+
+
+def rate_command(filepath: str, factor: float,
+                 output_fp: str) -> List[str]:
+    """ffmpeg command speeding up filepath by factor into output_fp.
+    """
+    return ['ffmpeg',
+            '-nostdin',
+            '-y',
+            '-loglevel', 'error',
+            '-i', filepath,
+            '-filter:a', atempo_filter(factor),
+            '-vn',
+            output_fp]
+
+
+def convert_file(filepath: str, factor: float,
+                 niceness: int = RATE_NICENESS) -> Tuple[int, str]:
+    """Speed up an audio file in place by factor.
+
+    Runs in a RateConverter worker process.
+
+    :returns: (exit code, error message).
+    """
+    if not os.path.isfile(filepath):
+        return -1, f"{filepath} does not exist."
+    partial_fp = partial_filepath(filepath)
+    returncode, stderr = run_ffmpeg(rate_command(filepath, factor,
+                                                 partial_fp),
+                                    priority_prefix(niceness))
+    if returncode != 0:
+        discard(partial_fp)
+        return returncode, stderr
+    try:
+        os.replace(partial_fp, filepath)
+    except OSError as e:
+        discard(partial_fp)
+        return -1, str(e)
+    return 0, ""
+
+
+class RateConverter(object):
+
+    """Process pool converting audio files to a new playback rate.
+    """
+
+    def __init__(self,
+                 workers: int = RATE_WORKERS,
+                 niceness: int = RATE_NICENESS):
+        """
+        :workers: Maximum number of concurrent conversions.
+        :niceness: CPU niceness of ffmpeg.
+        """
+        self.workers = workers
+        self.niceness = niceness
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, filepath: str, factor: float) -> "Future[Tuple[int, str]]":
+        """Start speeding up filepath by factor.
+
+        :returns: Future of (exit code, error message).
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor.submit(convert_file, filepath, factor,
+                                     self.niceness)
+
+    def shutdown(self) -> None:
+        """Wait for running conversions and stop the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def rescale_topic(topic: TopicFile, rate: float) -> None:
+    """Move the timestamps of a TopicFile and its ExtractFiles from its
+    current playback rate to rate.
+    """
+    scale = (topic.playback_rate or 1.0) / rate
+    if topic.duration is not None:
+        topic.duration *= scale
+    if topic.cur_timestamp is not None:
+        topic.cur_timestamp *= scale
+    for extract in topic.extracts:
+        if extract.startstamp is not None:
+            extract.startstamp *= scale
+        if extract.endstamp is not None:
+            extract.endstamp *= scale
+    topic.playback_rate = rate
+
+
+def rerate_topics(topic_ids: Iterable[int], rate: float,
+                  converter: Optional[RateConverter] = None
+                  ) -> Dict[int, bool]:
+    """Convert TopicFiles to a new playback rate in parallel.
+
+    Each TopicFile's timestamps are rescaled and committed as soon as
+    its file has been replaced.
+
+    :returns: TopicFile id mapped to True if it is now at rate.
+    """
+    if not MIN_RATE <= rate <= MAX_RATE:
+        raise ValueError(f"Playback rate must be between {MIN_RATE} "
+                         f"and {MAX_RATE}.")
+    own_converter = converter is None
+    converter = converter or RateConverter()
+    results: Dict[int, bool] = {}
+    futures: Dict[Future, TopicFile] = {}
+    try:
+        topics: List[TopicFile] = (session
+                                   .query(TopicFile)
+                                   .filter(TopicFile.id.in_(list(topic_ids)))
+                                   .all())
+        for topic in topics:
+            current = topic.playback_rate or 1.0
+            if current == rate:
+                results[topic.id] = True
+            elif topic.deleted or not os.path.isfile(topic.filepath):
+                logger.error(f"{topic} has no audio file to convert.")
+                results[topic.id] = False
+            else:
+                futures[converter.submit(topic.filepath,
+                                         rate / current)] = topic
+
+        for future in as_completed(futures):
+            topic = futures[future]
+            returncode, error = future.result()
+            if returncode == 0:
+                rescale_topic(topic, rate)
+                session.commit()
+                logger.info(f"Converted {topic} to playback rate {rate}.")
+                peak_indexer.submit(topic.filepath)
+            else:
+                logger.error(f"Converting {topic} failed with exit code "
+                             f"{returncode}: {error}")
+            results[topic.id] = returncode == 0
+    finally:
+        if own_converter:
+            converter.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+    converted = rerate_topics([int(id) for id in sys.argv[2:]],
+                              float(sys.argv[1]))
+    sys.exit(0 if all(converted.values()) else 1)
@@ -0,0 +1,45 @@
+from models import TopicFile, ExtractFile, ItemFile
+import sys
+import logging
+from typing import List, Dict
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("reaper.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+
+def reap_all(dry_run: bool = False) -> List[Dict]:
+    """Remove finished Items, Extracts and Topics.
+
+    Items are reaped before Extracts and Extracts before Topics because
+    a parent is only finished once its children are deleted.
+
+    :dry_run: Report what would be removed without touching anything.
+    :returns: One report dict per table.
+    """
+    reports: List[Dict] = []
+    for model in (ItemFile, ExtractFile, TopicFile):
+        report = model.remove_finished_files(dry_run=dry_run)
+        logger.info(f"{report['table']}: {report['finished']} finished, "
+                    f"{report['deleted']} deleted, "
+                    f"{len(report['failed'])} failed.")
+        if dry_run:
+            for filepath in report["files"]:
+                logger.info(f"Would remove {filepath}.")
+        reports.append(report)
+    return reports
+
+
+if __name__ == "__main__":
+    reap_all(dry_run="--dry-run" in sys.argv)
@@ -0,0 +1,511 @@
+"""Background rendering of extract and cloze audio files.
+
+Extracts recorded in offline mode (TopicQueue.offline_extracts) only
+store their start and end timestamps while the topic plays, and
+ItemFile.process_cloze only stores the cloze timestamps. Both queue a
+RenderJob row. The RenderPool runs the jobs with a bounded number of
+low priority ffmpeg processes, records their exit codes and retries
+failures, so bursts of clozing don't starve MPD's decoder of CPU.
+Pending clozes of one extract are claimed together and rendered from a
+single decode of the extract.
+"""
+import os
+import shutil
+import datetime
+import threading
+import subprocess
+from subprocess import DEVNULL, PIPE
+from sqlalchemy import update
+from typing import Callable, Dict, List, Optional, Tuple
+from models import (Session, ExtractFile, ItemFile, RenderJob,
+                    RENDER_PENDING, RENDER_RUNNING, RENDER_DONE, RENDER_FAILED)
+import wav_cloze
+from wav_cloze import cloze_bounds
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("renderer.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# Concurrent ffmpeg processes. The Pi has 4 cores and MPD needs one.
+RENDER_WORKERS = 2
+# nice(1) niceness of the ffmpeg processes (19 is the lowest priority).
+RENDER_NICENESS = 10
+# Attempts per job before it is marked RENDER_FAILED.
+RENDER_MAX_ATTEMPTS = 3
+# Seconds before the first retry, multiplied by the attempt number.
+RENDER_RETRY_DELAY = 30
+# Seconds between checks for due retries when nothing wakes the pool.
+RENDER_POLL_INTERVAL = 60
+# Most cloze jobs of one extract rendered from a single decode.
+RENDER_BATCH_SIZE = 16
+
+
+def partial_filepath(filepath: str) -> str:
+    """Hidden sibling path to render into before renaming into place.
+
+    MPD does not index hidden files, so it never sees a half written file.
+    """
+    return os.path.join(os.path.dirname(filepath),
+                        "." + os.path.basename(filepath))
+
+
+def priority_prefix(niceness: int) -> List[str]:
+    """nice and, where available, idle class ionice command prefix.
+    """
+    prefix: List[str] = []
+    if niceness and shutil.which("nice"):
+        prefix += ['nice', '-n', str(niceness)]
+    if shutil.which("ionice"):
+        prefix += ['ionice', '-c', '3']
+    return prefix
+
+
+def cut_command(source_fp: str, start: float, end: float, output_fp: str,
+                stream_copy: bool = True) -> List[str]:
+    """ffmpeg command to cut start to end seconds out of source_fp.
+
+    -ss before -i seeks the input directly instead of decoding up to the
+    start time.
+
+    :stream_copy: Copy the compressed audio packets instead of
+    re-encoding. The cut then snaps to the nearest packet (~20ms).
+    """
+    command = ['ffmpeg',
+               '-nostdin',
+               '-y',
+               '-loglevel', 'error',
+               '-ss', f"{start:.3f}",
+               '-i', source_fp,
+               '-t', f"{end - start:.3f}",
+               '-vn',
+               '-map_metadata', '-1']
+    if stream_copy:
+        command += ['-c:a', 'copy']
+    return command + [output_fp]
+
+
+def clozes_command(extract_fp: str, extract_length: float,
+                   clozes: List[Tuple[float, float, str, str]]) -> List[str]:
+    """ffmpeg command writing the question (extract with a beep over the
+    cloze) and the cloze (the clozed word / phrase) files of several
+    clozes of one extract.
+
+    The extract is decoded once and fed to every cloze's filters.
+
+    :clozes: (cloze start, cloze end, question filepath, cloze filepath)
+    """
+    filters: List[str] = []
+    outputs: List[str] = []
+    for n, (cloze_start, cloze_end, question_fp, cloze_fp) in \
+            enumerate(clozes):
+        cloze_length = cloze_end - cloze_start
+        output_cloze_start, output_cloze_end = cloze_bounds(cloze_start,
+                                                            cloze_end,
+                                                            extract_length)
+        filters += [
+            # Cut the beginning of the extract before the cloze
+            f"[0:a]atrim=0:{cloze_start}[beg{n}]",
+            # Cut the beginning of the cloze to the end of the cloze
+            f"[0:a]atrim={output_cloze_start}:{output_cloze_end}[cloze{n}]",
+            # Cut the end of the extract after the cloze
+            f"[0:a]atrim={cloze_end}:{extract_length}[end{n}]",
+            # Sine wave beep the length of the cloze
+            f"sine=frequency=1000:duration={cloze_length}[beep{n}]",
+            # concatenate the files
+            f"[beg{n}][beep{n}][end{n}]concat=n=3:v=0:a=1[question{n}]",
+        ]
+        outputs += [
+            # Output the clozed extract
+            '-map', f"[question{n}]", question_fp,
+            # Output the clozed word / phrase
+            '-map', f"[cloze{n}]", cloze_fp,
+        ]
+
+    return [
+            'ffmpeg',
+            '-nostdin',
+            '-y',
+            '-loglevel', 'error',
+            # The extract file
+            '-i',
+            extract_fp,
+            '-filter_complex',
+            ";".join(filters),
+    ] + outputs
+
+
+def cloze_command(extract_fp: str, extract_length: float,
+                  cloze_start: float, cloze_end: float,
+                  question_fp: str, cloze_fp: str) -> List[str]:
+    """ffmpeg command writing the question and cloze files of one cloze.
+    """
+    return clozes_command(extract_fp, extract_length,
+                          [(cloze_start, cloze_end, question_fp, cloze_fp)])
+
+
+def run_ffmpeg(command: List[str],
+               prefix: Optional[List[str]] = None) -> Tuple[int, str]:
+    """Run ffmpeg to completion.
+
+    :prefix: Command prefix eg. from priority_prefix.
+    :returns: (exit code, stderr). The exit code is -1 if ffmpeg could
+    not be started.
+    """
+    try:
+        process = subprocess.run((prefix or []) + command,
+                                 stdout=DEVNULL, stderr=PIPE)
+    except OSError as e:
+        logger.error(f"Call to ffmpeg failed with exception {e}.")
+        return -1, str(e)
+    stderr = process.stderr.decode(errors='replace').strip()
+    if process.returncode != 0:
+        logger.error(f"ffmpeg exited with {process.returncode}: {stderr}")
+    return process.returncode, stderr
+
+
+def discard(*filepaths: str) -> None:
+    for filepath in filepaths:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+def cut_audio(source_fp: str, start: float, end: float, output_fp: str,
+              prefix: Optional[List[str]] = None) -> Tuple[int, str]:
+    """Cut start to end seconds out of source_fp into output_fp.
+
+    Falls back to re-encoding if the stream cannot be copied into the
+    output container.
+
+    :returns: (exit code, stderr) of the last ffmpeg run.
+    """
+    partial_fp = partial_filepath(output_fp)
+    for stream_copy in (True, False):
+        returncode, stderr = run_ffmpeg(
+                cut_command(source_fp, start, end, partial_fp,
+                            stream_copy=stream_copy),
+                prefix)
+        if returncode == 0:
+            os.replace(partial_fp, output_fp)
+            return returncode, stderr
+    discard(partial_fp)
+    return returncode, stderr
+
+
+def render_extract(extract: ExtractFile,
+                   prefix: Optional[List[str]] = None) -> Tuple[int, str]:
+    """Cut an ExtractFile out of its parent TopicFile.
+
+    :returns: (exit code, error message).
+    """
+    topic_fp = extract.topic.filepath if extract.topic else None
+    if not topic_fp or not os.path.isfile(topic_fp):
+        return -1, "Source topic file does not exist."
+    if not extract.length() > 0:
+        return -1, "Extract has an invalid length."
+    return cut_audio(topic_fp, extract.startstamp, extract.endstamp,
+                     extract.filepath, prefix)
+
+
+def render_extracts(extracts: List[ExtractFile],
+                    prefix: Optional[List[str]] = None
+                    ) -> Dict[int, Tuple[int, str]]:
+    """
+    :returns: ExtractFile id mapped to the result of render_extract.
+    """
+    return {extract.id: render_extract(extract, prefix)
+            for extract in extracts}
+
+
+def render_clozes(items: List[ItemFile],
+                  prefix: Optional[List[str]] = None
+                  ) -> Dict[int, Tuple[int, str]]:
+    """Create the question and cloze files of ItemFiles of one extract
+    from a single decode of the extract.
+
+    PCM WAV extracts are rendered in-process by wav_cloze when NumPy is
+    installed, anything else with one ffmpeg run. If a batch fails the
+    clozes are retried one by one so a bad cloze can't fail the others.
+
+    :returns: ItemFile id mapped to (exit code, error message).
+    """
+    extract = items[0].extract
+    assert all(item.extract_id == extract.id for item in items)
+    if not os.path.isfile(extract.filepath):
+        return {item.id: (-1, "Extract file does not exist.")
+                for item in items}
+
+    results: Dict[int, Tuple[int, str]] = {}
+    valid: List[ItemFile] = []
+    for item in items:
+        if extract.length() > 0 and item.length() > 0:
+            valid.append(item)
+        else:
+            results[item.id] = (-1, "Extract or cloze has an invalid length.")
+    if not valid:
+        return results
+
+    clozes = [(item.cloze_startstamp, item.cloze_endstamp,
+               partial_filepath(item.question_filepath),
+               partial_filepath(item.cloze_filepath))
+              for item in valid]
+
+    returncode, stderr = -1, ""
+    if wav_cloze.available() and \
+       extract.filepath.lower().endswith(".wav"):
+        try:
+            wav_cloze.render_clozes_wav(extract.filepath, extract.length(),
+                                        clozes)
+            returncode = 0
+        except ValueError as e:
+            logger.info(f"Rendering clozes of {extract} with ffmpeg: {e}")
+    if returncode != 0:
+        returncode, stderr = run_ffmpeg(
+                clozes_command(extract.filepath, extract.length(), clozes),
+                prefix)
+
+    if returncode != 0:
+        for _, _, question_partial, cloze_partial in clozes:
+            discard(question_partial, cloze_partial)
+        if len(valid) > 1:
+            for item in valid:
+                results.update(render_clozes([item], prefix))
+        else:
+            results[valid[0].id] = (returncode, stderr)
+        return results
+
+    for item, (_, _, question_partial, cloze_partial) in zip(valid, clozes):
+        try:
+            os.replace(cloze_partial, item.cloze_filepath)
+            os.replace(question_partial, item.question_filepath)
+            results[item.id] = (0, "")
+        except OSError as e:
+            discard(question_partial, cloze_partial)
+            results[item.id] = (-1, str(e))
+    return results
+
+
+def render_cloze(item: ItemFile,
+                 prefix: Optional[List[str]] = None) -> Tuple[int, str]:
+    """Create an ItemFile's question and cloze files from its extract.
+
+    :returns: (exit code, error message).
+    """
+    return render_clozes([item], prefix)[item.id]
+
+
+# RenderJob.kind: (model, batch render function, filepath columns to
+# report)
+RENDERERS: Dict[str, Tuple] = {
+        "extract": (ExtractFile, render_extracts, ("filepath",)),
+        "cloze": (ItemFile, render_clozes, ("question_filepath",
+                                            "cloze_filepath")),
+}
+
+
+class RenderPool(object):
+
+    """Worker threads running RenderJobs, each in a low priority ffmpeg.
+
+    Jobs live in the render_jobs table, so queued and half finished
+    renders survive a restart.
+    """
+
+    def __init__(self,
+                 workers: int = RENDER_WORKERS,
+                 niceness: int = RENDER_NICENESS,
+                 max_attempts: int = RENDER_MAX_ATTEMPTS,
+                 retry_delay: float = RENDER_RETRY_DELAY,
+                 poll_interval: float = RENDER_POLL_INTERVAL,
+                 batch_size: int = RENDER_BATCH_SIZE,
+                 on_rendered: Optional[Callable[[str], None]] = None):
+        """
+        :workers: Maximum number of concurrent ffmpeg processes.
+        :niceness: CPU niceness of ffmpeg. ffmpeg also gets the idle I/O
+        class if ionice is installed.
+        :max_attempts: Attempts per job before giving up.
+        :retry_delay: Seconds before a retry, times the attempt number.
+        :poll_interval: Seconds between checks for due retries.
+        :batch_size: Most cloze jobs of one extract run together.
+        :on_rendered: Called with each rendered filepath eg. to ask MPD
+        to index it.
+        """
+        self.workers = workers
+        self.prefix = priority_prefix(niceness)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.on_rendered = on_rendered
+        self._wakeup = threading.Condition()
+        self._claim_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Requeue jobs interrupted by a restart and start the workers.
+        """
+        if self._threads:
+            return
+        self.recover()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop,
+                                      name=f"render-{n}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} render workers.")
+
+    def stop(self) -> None:
+        """Stop the workers after their current job.
+        """
+        self._stop.set()
+        self.wake()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def wake(self) -> None:
+        """Tell idle workers that new jobs were committed.
+        """
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def recover(self) -> int:
+        """Return jobs left running by a crash to the queue.
+        :returns: Number of jobs requeued.
+        """
+        db = Session()
+        try:
+            table = RenderJob.__table__
+            result = db.execute(update(table)
+                                .where(table.c.status == RENDER_RUNNING)
+                                .values(status=RENDER_PENDING))
+            db.commit()
+            if result.rowcount:
+                logger.info(f"Requeued {result.rowcount} interrupted "
+                            "render jobs.")
+            return result.rowcount
+        finally:
+            db.close()
+
+    def claim(self, db) -> List[RenderJob]:
+        """Mark the oldest due pending job as running, along with the
+        other due cloze jobs of the same extract so that they are
+        rendered from one decode.
+
+        :returns: The jobs, empty if there is nothing to do.
+        """
+        with self._claim_lock:
+            now = datetime.datetime.utcnow()
+            job: Optional[RenderJob] = RenderJob.due_query(db, now).first()
+            if job is None:
+                return []
+            jobs = [job]
+            if job.kind == "cloze":
+                extract_id = (db.query(ItemFile.extract_id)
+                              .filter(ItemFile.id == job.entity_id)
+                              .scalar())
+                jobs += RenderJob.cloze_batch_query(
+                        db, now, job.id, extract_id,
+                        self.batch_size - 1).all()
+            for claimed in jobs:
+                claimed.status = RENDER_RUNNING
+                claimed.attempts += 1
+            db.commit()
+            return jobs
+
+    def _worker_loop(self) -> None:
+        while not self._stop.is_set():
+            db = Session()
+            try:
+                jobs = self.claim(db)
+                if jobs:
+                    self.run(db, jobs)
+            except Exception as e:
+                logger.error(f"Render worker failed with exception {e}.")
+                db.rollback()
+                jobs = []
+            finally:
+                db.close()
+            if not jobs:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+
+    def run(self, db, jobs: List[RenderJob]) -> int:
+        """Run claimed jobs of one kind and record the outcome on each
+        job and on the render_status of its ExtractFile or ItemFile.
+
+        :returns: Number of jobs whose files were rendered.
+        """
+        model, render, columns = RENDERERS[jobs[0].kind]
+        targets = {job.id: db.query(model).get(job.entity_id)
+                   for job in jobs}
+        found = [target for target in targets.values() if target is not None]
+        results: Dict[int, Tuple[int, str]] = {}
+        if found:
+            try:
+                results = render(found, self.prefix)
+            except OSError as e:
+                results = {target.id: (-1, str(e)) for target in found}
+
+        rendered = []
+        for job in jobs:
+            target = targets[job.id]
+            if target is None:
+                returncode, error = -1, f"{model.__name__} not found."
+            else:
+                returncode, error = results[target.id]
+            self.record(job, target, returncode, error)
+            if returncode == 0:
+                rendered.append(target)
+            else:
+                logger.error(f"{job} failed with exit code {returncode}: "
+                             f"{error}")
+        db.commit()
+
+        for target in rendered:
+            logger.info(f"Rendered {target}.")
+            if self.on_rendered:
+                for column in columns:
+                    try:
+                        self.on_rendered(getattr(target, column))
+                    except Exception as e:
+                        logger.error(f"on_rendered callback failed with "
+                                     f"exception {e}.")
+        return len(rendered)
+
+    def record(self, job: RenderJob, target, returncode: int,
+               error: str) -> None:
+        """Set the status of a job and its target after a render,
+        scheduling a retry if attempts remain.
+        """
+        job.returncode = returncode
+        if returncode == 0:
+            job.status = RENDER_DONE
+            job.error = None
+            job.finished_at = datetime.datetime.utcnow()
+            target.render_status = RENDER_DONE
+        elif job.attempts < self.max_attempts and target is not None:
+            job.status = RENDER_PENDING
+            job.error = error
+            job.run_after = (datetime.datetime.utcnow() +
+                             datetime.timedelta(seconds=self.retry_delay *
+                                                job.attempts))
+        else:
+            job.status = RENDER_FAILED
+            job.error = error
+            job.finished_at = datetime.datetime.utcnow()
+            if target is not None:
+                target.render_status = RENDER_FAILED
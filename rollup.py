@@ -0,0 +1,182 @@
+from models import (EVENT_ROLLUPS, EventRollupState,
+                    session)
+from sqlalchemy import func, select, case
+from sqlalchemy.orm import Query
+import datetime
+import sys
+import logging
+from typing import List, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("rollup.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# Raw events older than this many days are compacted into daily rollups.
+ROLLUP_AFTER_DAYS = 7
+# Raw events older than this many days are deleted once rolled up.
+RETENTION_DAYS = 30
+
+
+def utc_midnight(days_ago: int) -> datetime.datetime:
+    """
+    :returns: The start of the UTC day days_ago days before today.
+    """
+    today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0,
+                                               microsecond=0)
+    return today - datetime.timedelta(days=days_ago)
+
+
+def newest_event_query(event_model) -> Query:
+    """
+    :returns: Query for the created_at of the newest event of the table.
+    """
+    return session.query(func.max(event_model.created_at))
+
+
+def open_event_day() -> Optional[datetime.datetime]:
+    """MpdHeartbeat keeps writing the duration of the last event it added,
+    of any event table, until the player changes state, which can be days
+    later. Its day must not be rolled up before that.
+
+    :returns: The start of the UTC day of the newest event or None if
+    there are no events.
+    """
+    newest = [created_at for created_at, in
+              (newest_event_query(event_model).one()
+               for event_model in EVENT_ROLLUPS)
+              if created_at is not None]
+    if not newest:
+        return None
+    return max(newest).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_state(event_model) -> EventRollupState:
+    """
+    :returns: The EventRollupState row for the event table.
+    """
+    table = event_model.__tablename__
+    state = session.query(EventRollupState).get(table)
+    if state is None:
+        state = EventRollupState(event_table=table)
+        session.add(state)
+    return state
+
+
+def rollup_events(event_model, until: datetime.datetime,
+                  dry_run: bool = False) -> int:
+    """Add raw events created before until that have not been rolled up
+    yet to the daily rollup table.
+
+    until must be a UTC midnight so that every rolled up day is complete
+    and each (file, day) row is only ever inserted once.
+
+    :returns: Number of raw events rolled up.
+    """
+    rollup, fk = EVENT_ROLLUPS[event_model]
+    state = rollup_state(event_model)
+    since: Optional[datetime.datetime] = state.rolled_up_until
+    if since is not None and since >= until:
+        return 0
+
+    created_at = event_model.created_at
+    condition = created_at < until
+    if since is not None:
+        condition = condition & (created_at >= since)
+
+    count = (session
+             .query(func.count(event_model.id))
+             .filter(condition)
+             .scalar())
+    # Left uncommitted on a dry run so prune_events sees the new boundary.
+    state.rolled_up_until = until
+    if dry_run:
+        return count
+
+    fk_column = getattr(event_model, fk)
+    day = func.date(created_at)
+    listened = func.sum(case([(event_model.event == "play",
+                               event_model.duration)], else_=0))
+    plays = func.sum(case([(event_model.event == "play", 1)], else_=0))
+    pauses = func.sum(case([(event_model.event == "pause", 1)], else_=0))
+    aggregate = (select([fk_column, day, listened, plays, pauses,
+                         func.max(event_model.timestamp),
+                         func.count(event_model.id)])
+                 .where(condition)
+                 .group_by(fk_column, day))
+    session.execute(rollup.__table__.insert().from_select(
+        [fk, "day", "listened", "plays", "pauses", "max_timestamp", "events"],
+        aggregate))
+    session.commit()
+    return count
+
+
+def prune_events(event_model, before: datetime.datetime,
+                 dry_run: bool = False) -> int:
+    """Delete raw events created before before that are already counted
+    in the rollup table.
+
+    :returns: Number of raw events deleted.
+    """
+    state = rollup_state(event_model)
+    if state.rolled_up_until is None:
+        return 0
+    before = min(before, state.rolled_up_until)
+    query = (session
+             .query(event_model)
+             .filter(event_model.created_at < before))
+    if dry_run:
+        return query.count()
+    deleted = query.delete(synchronize_session=False)
+    if state.pruned_before is None or before > state.pruned_before:
+        state.pruned_before = before
+    session.commit()
+    return deleted
+
+
+def rollup_all(rollup_after_days: int = ROLLUP_AFTER_DAYS,
+               retention_days: int = RETENTION_DAYS,
+               dry_run: bool = False) -> List[Dict]:
+    """Roll up and prune the TopicEvent, ExtractEvent and ItemEvent tables.
+
+    :rollup_after_days: Roll up events older than this many days, but not
+    the day of the event the heartbeat may still be writing.
+    :retention_days: Delete rolled up events older than this many days.
+    :dry_run: Report what would change without touching anything.
+    :returns: One report dict per event table.
+    """
+    if retention_days < rollup_after_days:
+        raise ValueError("Raw events must be kept until they are rolled up.")
+    rollup_until = utc_midnight(rollup_after_days)
+    open_day = open_event_day()
+    if open_day is not None:
+        rollup_until = min(rollup_until, open_day)
+    prune_before = utc_midnight(retention_days)
+    reports: List[Dict] = []
+    for event_model in EVENT_ROLLUPS:
+        report = {"table": event_model.__tablename__,
+                  "dry_run": dry_run,
+                  "rolled_up": rollup_events(event_model, rollup_until,
+                                             dry_run=dry_run),
+                  "pruned": prune_events(event_model, prune_before,
+                                         dry_run=dry_run)}
+        logger.info(f"{report['table']}: {report['rolled_up']} events "
+                    f"rolled up, {report['pruned']} pruned.")
+        reports.append(report)
+    if dry_run:
+        session.rollback()
+    return reports
+
+
+if __name__ == "__main__":
+    rollup_all(dry_run="--dry-run" in sys.argv)
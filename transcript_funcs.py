@@ -1,71 +1,145 @@
-import webvtt
 import os
-import time
-from models import session, ExtractFile
-from config import *
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from vtt_index import load_index, join_lines
+from models import (session, ExtractFile, TopicFile, BackfillState,
+                    index_extract_transcripts)
+import logging
 
 
-def vtt_to_text(subs_file):
-    vtt = webvtt.read(subs_file)
-    transcript = ""
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("transcripts.log")
+file_handler.setFormatter(formatter)
 
-    lines = []
-    for line in vtt:
-        # strip newlines
-        # split string if newline present in the middle
-        # add lines to lines array
-        lines.extend(line.text.strip().splitlines())
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
 
-    previous = None
-    for line in lines:
-        if line == previous:
-            continue
-        transcript += " " + line
-        previous = line
+# BackfillState.name of the extract transcript backfill.
+EXTRACT_TRANSCRIPTS = "extract_transcripts"
+# Topics transcribed in parallel.
+BACKFILL_WORKERS = 2
+# Extract transcripts written per transaction.
+BACKFILL_BATCH_SIZE = 500
 
-    return transcript
+
+def vtt_to_text(subs_file):
+    # Returns the whole transcript without the
+    # repeated lines of auto captions
+    return join_lines(load_index(subs_file).texts())
 
 
 def find_within_range(start, end, subs_file):
     # Returns captions within between a start and
-    # end timestamp
-
-    # Takes seconds and converts into %H:%M:%S format
-    # Works up to 24hrs
-    start = time.strftime("%H:%M:%S", time.gmtime(int(start)))
-    end = time.strftime("%H:%M:%S", time.gmtime(int(end)))
-
-    vtt = webvtt.read(subs_file)
-    transcript = ""
-    lines = []
-    for caption in vtt:
-        if caption.end > start and caption.start < end:
-            lines.extend(caption.text.strip().splitlines())
-    previous = None
-    for line in lines:
-        if line == previous:
-            continue
-
-        transcript += " " + line
-        previous = line
-
-    return transcript
-
-
-def update_extract_table():
-    # Check if there exists a subs file first
-    extracts = (session
-                .query(ExtractFile)
-                .filter_by(extract_transcript=None)
-                .all())
-    if extracts:
-        for extract in extracts:
-            start = extract.topicfile_startstamp
-            end = extract.topicfile_endstamp
-            filepath = extract.topicfiles.filepath
-            subsfile = os.path.join(
-                    TOPICFILES_DIR,
-                    os.path.splitext(os.path.basename(filepath))[0] + ".en.vtt")
-            transcript = find_within_range(start, end, subsfile)
-            extract.extract_transcript = transcript
-            session.commit()
+    # end timestamp in seconds, to the millisecond
+    return join_lines(load_index(subs_file).within(start, end))
+
+
+def transcribe_ranges(subs_file: str,
+                      ranges: List[Tuple[int, float, float]]
+                      ) -> List[Tuple[int, str]]:
+    """Find the captions of many extracts of one topic with a single
+    parse of its subs file.
+
+    Runs in a process pool worker.
+
+    :ranges: (extract id, start, end) in seconds of the subs file.
+    :returns: (extract id, transcript)
+    """
+    try:
+        index = load_index(subs_file)
+    except Exception as e:
+        logger.error(f"Reading {subs_file} failed with exception {e}.")
+        return []
+    return [(extract_id, join_lines(index.within(start, end)))
+            for extract_id, start, end in ranges]
+
+
+def update_extract_table(full: bool = False,
+                         workers: int = BACKFILL_WORKERS,
+                         batch_size: int = BACKFILL_BATCH_SIZE) -> Dict:
+    """Add transcripts to ExtractFiles created since the last run.
+
+    Extracts are grouped by TopicFile so that each subs file is parsed
+    once, and topics are spread over a process pool. Extracts still
+    being recorded are picked up by a later run.
+
+    :full: Also retry older extracts without a transcript.
+    :returns: Report of the run.
+    """
+    state = session.query(BackfillState).get(EXTRACT_TRANSCRIPTS)
+    if state is None:
+        state = BackfillState(name=EXTRACT_TRANSCRIPTS, last_id=0)
+        session.add(state)
+    since = 0 if full else state.last_id
+
+    rows = (session
+            .query(ExtractFile.id, ExtractFile.startstamp,
+                   ExtractFile.endstamp, TopicFile.transcript_filepath,
+                   TopicFile.playback_rate)
+            .join(TopicFile, ExtractFile.topic_id == TopicFile.id)
+            .filter(ExtractFile.id > since)
+            .filter(ExtractFile.transcript == None)
+            .filter(ExtractFile.deleted.isnot(True))
+            .order_by(ExtractFile.id)
+            .all())
+
+    # Subs file mapped to the extract ranges in it.
+    ranges: Dict[str, List[Tuple[int, float, float]]] = defaultdict(list)
+    last_id = max([since] + [row.id for row in rows])
+    for row in rows:
+        if row.endstamp is None:
+            # Still recording, come back to it next time.
+            last_id = min(last_id, row.id - 1)
+        elif row.transcript_filepath and \
+                os.path.isfile(row.transcript_filepath):
+            # Extract stamps are in the rate converted topic's time.
+            rate = row.playback_rate or 1.0
+            ranges[row.transcript_filepath].append(
+                    (row.id, row.startstamp * rate, row.endstamp * rate))
+
+    transcripts: List[Tuple[int, str]] = []
+    if len(ranges) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(transcribe_ranges,
+                                       ranges.keys(), ranges.values()):
+                transcripts.extend(result)
+    else:
+        for subs_file, topic_ranges in ranges.items():
+            transcripts.extend(transcribe_ranges(subs_file, topic_ranges))
+
+    for i in range(0, len(transcripts), batch_size):
+        batch = transcripts[i:i + batch_size]
+        session.bulk_update_mappings(
+                ExtractFile,
+                [{"id": extract_id, "transcript": transcript}
+                 for extract_id, transcript in batch])
+        # Bulk updates skip the mapper events that index transcripts.
+        index_extract_transcripts(session.connection(),
+                                  [extract_id for extract_id, _ in batch])
+        session.commit()
+
+    if not full or last_id > state.last_id:
+        state.last_id = max(last_id, state.last_id)
+    session.commit()
+
+    report = {"extracts": len(rows),
+              "topics": len(ranges),
+              "transcribed": len(transcripts),
+              "last_id": state.last_id}
+    logger.info(f"Added {report['transcribed']} transcripts from "
+                f"{report['topics']} topics, checked {report['extracts']} "
+                f"extracts.")
+    return report
+
+
+if __name__ == "__main__":
+    update_extract_table(full="--full" in sys.argv)
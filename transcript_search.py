@@ -0,0 +1,193 @@
+"""Full-text search of transcripts across TopicFiles and ExtractFiles.
+
+The cues of each TopicFile's VTT file and every ExtractFile transcript
+are stored as TranscriptCue rows, which SQLite indexes in the FTS5 table
+transcript_fts. A hit resolves to its TopicFile (and ExtractFile) and the
+timestamp of the cue in the topic's audio file.
+
+Topics are indexed by AudioDownloader.add_topicfile as they are
+downloaded. Run this script to index topics downloaded before that, or
+with --rebuild to reindex all of them:
+
+    python transcript_search.py [--rebuild]
+    python transcript_search.py --search <query>
+"""
+import os
+import re
+import sys
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SessionType
+from vtt_index import load_index
+from models import (session, TopicFile, TranscriptCue, BackfillState,
+                    transcript_cues_condition)
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("transcript_search.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# BackfillState.name of the topic transcript indexing.
+TOPIC_TRANSCRIPTS = "transcript_search"
+# Default and maximum number of hits returned by search.
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 200
+# Tokens around the match in hit snippets.
+SNIPPET_TOKENS = 12
+
+# The cues of deleted rows are dropped when they are deleted. The deleted
+# checks keep out any left behind by raw SQL updates.
+SEARCH_QUERY = text(
+    "SELECT c.topic_id, c.extract_id, c.start_ms, c.end_ms, "
+    "t.title, t.playback_rate, hits.snippet, hits.rank "
+    "FROM (SELECT rowid, rank, "
+    "snippet(transcript_fts, 0, '[', ']', '...', :tokens) AS snippet "
+    "FROM transcript_fts WHERE transcript_fts MATCH :query "
+    "ORDER BY rank LIMIT :limit) AS hits "
+    "JOIN transcript_cues c ON c.id = hits.rowid "
+    "JOIN topicfiles t ON t.id = c.topic_id AND t.deleted IS NOT 1 "
+    "LEFT JOIN extractfiles e ON e.id = c.extract_id "
+    "WHERE e.deleted IS NOT 1 "
+    "ORDER BY hits.rank")
+
+
+def match_query(query: str) -> Optional[str]:
+    """Turn user input into an FTS5 query matching all of its words, so
+    quotes, hyphens or operators in the input are never a syntax error.
+
+    :returns: The FTS5 query or None if there is nothing to search for.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
+
+
+def search(query: str, limit: int = SEARCH_LIMIT,
+           db: Optional[SessionType] = None) -> List[Dict]:
+    """Find transcript cues containing all the words of query, best
+    match first.
+
+    :db: Session to query, the global session by default.
+    :returns: Hits with topic_id, extract_id (None for topic cues),
+    title, timestamp (seconds into the topic's audio file), snippet and
+    rank (lower is better).
+    """
+    match = match_query(query)
+    if match is None:
+        return []
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    rows = (db or session).execute(SEARCH_QUERY,
+                                   {"query": match,
+                                    "limit": limit,
+                                    "tokens": SNIPPET_TOKENS})
+    hits = []
+    for row in rows:
+        rate = row.playback_rate or 1.0
+        hits.append({"topic_id": row.topic_id,
+                     "extract_id": row.extract_id,
+                     "title": row.title,
+                     "timestamp": row.start_ms / 1000 / rate,
+                     "snippet": row.snippet,
+                     "rank": row.rank})
+    return hits
+
+
+def topic_cues(vtt_fp: str) -> List[Dict]:
+    """Cues of a VTT file without the lines rolling auto captions repeat
+    from the previous cue.
+
+    :returns: TranscriptCue columns of each cue with new text.
+    """
+    index = load_index(vtt_fp)
+    cues = []
+    previous: List[str] = []
+    for i in range(len(index)):
+        lines = index.text(i).splitlines()
+        new_lines = [line for line in lines
+                     if line.strip() and line not in previous]
+        previous = lines
+        if new_lines:
+            cues.append({"start_ms": index.starts[i],
+                         "end_ms": index.ends[i],
+                         "text": "\n".join(new_lines)})
+    return cues
+
+
+def index_topic(db: SessionType, topic: TopicFile) -> int:
+    """Replace the TranscriptCues of a TopicFile with the cues of its VTT
+    file. Committed by the caller.
+
+    :returns: Number of cues indexed.
+    """
+    cues = TranscriptCue.__table__
+    db.execute(cues.delete().where(
+        transcript_cues_condition(TopicFile, [topic.id])))
+    if topic.deleted or not topic.transcript_filepath or \
+       not os.path.isfile(topic.transcript_filepath):
+        return 0
+    rows = topic_cues(topic.transcript_filepath)
+    if rows:
+        for row in rows:
+            row["topic_id"] = topic.id
+        db.execute(cues.insert(), rows)
+    return len(rows)
+
+
+def index_topics(rebuild: bool = False) -> Dict:
+    """Index the transcripts of TopicFiles added since the last run.
+
+    :rebuild: Reindex every TopicFile.
+    :returns: Report of the run.
+    """
+    state = session.query(BackfillState).get(TOPIC_TRANSCRIPTS)
+    if state is None:
+        state = BackfillState(name=TOPIC_TRANSCRIPTS, last_id=0)
+        session.add(state)
+        session.commit()
+    since = 0 if rebuild else state.last_id
+    topics: List[TopicFile] = (session
+                               .query(TopicFile)
+                               .filter(TopicFile.id > since)
+                               .filter(TopicFile.transcript_filepath != None)
+                               .filter(TopicFile.deleted.isnot(True))
+                               .order_by(TopicFile.id)
+                               .all())
+    report = {"topics": 0, "cues": 0}
+    for topic in topics:
+        try:
+            cues = index_topic(session, topic)
+        except Exception as e:
+            logger.error(f"Indexing the transcript of {topic} failed with "
+                         f"exception {e}.")
+            session.rollback()
+            continue
+        state.last_id = max(state.last_id, topic.id)
+        session.commit()
+        report["topics"] += 1
+        report["cues"] += cues
+    session.commit()
+    logger.info(f"Indexed {report['cues']} cues of {report['topics']} "
+                f"topics.")
+    return report
+
+
+if __name__ == "__main__":
+    if "--search" in sys.argv:
+        query = " ".join(sys.argv[sys.argv.index("--search") + 1:])
+        for hit in search(query):
+            print(f"{hit['timestamp']:>9.1f}s  {hit['title']}: "
+                  f"{hit['snippet']}")
+    else:
+        index_topics(rebuild="--rebuild" in sys.argv)
@@ -0,0 +1,227 @@
+"""Parsed-once, indexed VTT transcripts.
+
+A VTT file is parsed a single time into a CueIndex: cue start and end
+times in milliseconds plus the cue texts in one UTF-8 blob with offsets.
+The index is saved next to the transcript (abc.en.vtt -> abc.en.cues)
+and kept in a small in-memory cache, so looking up the captions of an
+extract is two bisects instead of re-parsing the whole file.
+"""
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Iterable, List, Optional, Tuple
+import webvtt
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("vtt_index.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+INDEX_EXT = ".cues"
+# Number of CueIndexes kept in memory.
+CACHE_SIZE = 16
+
+MAGIC = b"VTTI"
+VERSION = 1
+# magic, version, VTT mtime_ns, VTT size, number of cues, blob size
+HEADER = struct.Struct("<4sHqqII")
+
+
+def index_filepath(vtt_filepath: str) -> str:
+    """
+    :returns: Path of the saved CueIndex of a VTT file.
+    """
+    return os.path.splitext(vtt_filepath)[0] + INDEX_EXT
+
+
+def timestamp_ms(timestamp: str) -> int:
+    """
+    :timestamp: VTT timestamp, HH:MM:SS.mmm or MM:SS.mmm
+    :returns: Milliseconds.
+    """
+    hms, _, fraction = timestamp.partition(".")
+    seconds = 0
+    for part in hms.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds * 1000 + int(fraction[:3].ljust(3, "0") or 0)
+
+
+class CueIndex(object):
+
+    """Cue times and texts of a VTT file, sorted by start time.
+    """
+
+    __slots__ = ("starts", "ends", "offsets", "blob", "max_ends")
+
+    def __init__(self, starts: array, ends: array, offsets: array,
+                 blob: bytes):
+        """
+        :starts: Start of each cue in milliseconds.
+        :ends: End of each cue in milliseconds.
+        :offsets: Offset of each cue's text in blob, plus the blob size.
+        :blob: UTF-8 text of all cues.
+        """
+        self.starts = starts
+        self.ends = ends
+        self.offsets = offsets
+        self.blob = blob
+        # Cues can overlap, so bisect the running maximum of the ends.
+        self.max_ends = array("q", accumulate(ends, max))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def texts(self) -> List[str]:
+        """
+        :returns: Text of every cue.
+        """
+        return [self.text(i) for i in range(len(self))]
+
+    def within(self, start: float, end: float) -> List[str]:
+        """
+        :start: Seconds.
+        :end: Seconds.
+        :returns: Text of the cues overlapping start to end.
+        """
+        start_ms = int(round(start * 1000))
+        end_ms = int(round(end * 1000))
+        lo = bisect_right(self.max_ends, start_ms)
+        hi = bisect_left(self.starts, end_ms)
+        return [self.text(i) for i in range(lo, hi)
+                if self.ends[i] > start_ms]
+
+    @classmethod
+    def from_vtt(cls, vtt_filepath: str) -> "CueIndex":
+        """Parse a VTT file.
+        """
+        cues: List[Tuple[int, int, bytes]] = sorted(
+                ((timestamp_ms(caption.start), timestamp_ms(caption.end),
+                  caption.text.strip().encode())
+                 for caption in webvtt.read(vtt_filepath)),
+                key=lambda cue: cue[0])
+        offsets = array("q", [0])
+        for _, _, text in cues:
+            offsets.append(offsets[-1] + len(text))
+        return cls(array("q", (cue[0] for cue in cues)),
+                   array("q", (cue[1] for cue in cues)),
+                   offsets,
+                   b"".join(cue[2] for cue in cues))
+
+    def save(self, filepath: str, source_key: Tuple[int, int]) -> None:
+        """Write the index, tagged with the mtime and size of its VTT
+        file, atomically.
+        """
+        partial_fp = filepath + ".partial"
+        with open(partial_fp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, *source_key, len(self),
+                                len(self.blob)))
+            for values in (self.starts, self.ends, self.offsets):
+                f.write(little_endian(values).tobytes())
+            f.write(self.blob)
+        os.replace(partial_fp, filepath)
+
+    @classmethod
+    def load(cls, filepath: str,
+             source_key: Tuple[int, int]) -> Optional["CueIndex"]:
+        """
+        :returns: The saved index or None if it is missing, corrupt or
+        older than its VTT file.
+        """
+        try:
+            with open(filepath, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, version, mtime_ns, size, n, blob_size = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or \
+           (mtime_ns, size) != source_key:
+            return None
+        arrays = []
+        pos = HEADER.size
+        for length in (n, n, n + 1):
+            values = array("q")
+            values.frombytes(data[pos:pos + length * values.itemsize])
+            if len(values) != length:
+                return None
+            arrays.append(little_endian(values))
+            pos += length * values.itemsize
+        blob = data[pos:pos + blob_size]
+        if len(blob) != blob_size:
+            return None
+        return cls(*arrays, blob)
+
+
+def little_endian(values: array) -> array:
+    """Byteswap on big endian machines, the saved index is little endian.
+    """
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+_cache: "OrderedDict[str, Tuple[Tuple[int, int], CueIndex]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_index(vtt_filepath: str) -> CueIndex:
+    """Get the CueIndex of a VTT file from memory, from its saved index or
+    by parsing it, whichever is up to date.
+    """
+    stat = os.stat(vtt_filepath)
+    source_key = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(vtt_filepath)
+        if cached and cached[0] == source_key:
+            _cache.move_to_end(vtt_filepath)
+            return cached[1]
+
+    filepath = index_filepath(vtt_filepath)
+    index = CueIndex.load(filepath, source_key)
+    if index is None:
+        index = CueIndex.from_vtt(vtt_filepath)
+        try:
+            index.save(filepath, source_key)
+        except OSError as e:
+            logger.error(f"Saving cue index {filepath} failed with "
+                         f"exception {e}.")
+
+    with _cache_lock:
+        _cache[vtt_filepath] = (source_key, index)
+        _cache.move_to_end(vtt_filepath)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def join_lines(texts: Iterable[str]) -> str:
+    """Join cue texts into a transcript, skipping the repeated lines of
+    rolling auto captions.
+    """
+    lines: List[str] = []
+    for text in texts:
+        for line in text.splitlines():
+            if not lines or line != lines[-1]:
+                lines.append(line)
+    return "".join(" " + line for line in lines)
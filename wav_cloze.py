@@ -0,0 +1,199 @@
+"""Question and cloze files for PCM WAV extracts without ffmpeg.
+
+A question is the extract with a 1 kHz beep over the cloze and a cloze
+is the clozed word / phrase. For WAV input both are plain sample
+slicing, so the extract is memory-mapped with NumPy and the outputs are
+written with the wave module. Starting ffmpeg and building its filter
+graph costs far more than that on a Raspberry Pi.
+
+NumPy is optional: without it (or for compressed or unusual WAV input)
+renderer.py uses ffmpeg.
+"""
+import struct
+import wave
+from typing import List, NamedTuple, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Beep settings matching ffmpeg's sine source used by renderer.cloze_command.
+BEEP_FREQUENCY = 1000
+BEEP_AMPLITUDE = 1 / 8
+
+# WAVE_FORMAT_PCM and WAVE_FORMAT_IEEE_FLOAT
+PCM, IEEE_FLOAT = 1, 3
+# Format tag of WAVE_FORMAT_EXTENSIBLE headers, the real tag is in the
+# first two bytes of the sub format GUID.
+EXTENSIBLE = 0xFFFE
+
+
+class WavAudio(NamedTuple):
+    """Memory-mapped samples of a WAV file.
+    """
+    samples: "np.ndarray"  # shape (frames, channels)
+    rate: int
+    format_tag: int
+
+
+def available() -> bool:
+    """
+    :returns: True if NumPy is installed.
+    """
+    return np is not None
+
+
+def sample_dtype(format_tag: int, bits: int) -> "np.dtype":
+    """
+    :returns: NumPy little endian dtype of the samples.
+    :raises ValueError: For formats the wave module can't write back.
+    """
+    if format_tag == PCM and bits == 8:
+        return np.dtype("u1")
+    if format_tag == PCM and bits in (16, 32):
+        return np.dtype(f"<i{bits // 8}")
+    raise ValueError(f"Unsupported WAV format {format_tag} "
+                     f"with {bits} bit samples.")
+
+
+def read_wav(filepath: str) -> WavAudio:
+    """Memory-map the samples of a PCM WAV file.
+
+    :raises ValueError: If the file is not a supported WAV file.
+    """
+    if np is None:
+        raise ValueError("NumPy is not installed.")
+    with open(filepath, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12:
+            raise ValueError(f"{filepath} is not a WAV file.")
+        riff, _, wave_id = struct.unpack("<4sI4s", header)
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{filepath} is not a WAV file.")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{filepath} has no data chunk.")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                body = f.read(size)
+                if len(body) < 16:
+                    raise ValueError(f"{filepath} has a short fmt chunk.")
+                format_tag, channels, rate = struct.unpack("<HHI", body[:8])
+                bits = struct.unpack("<H", body[14:16])[0]
+                if format_tag == EXTENSIBLE and len(body) >= 26:
+                    format_tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (format_tag, channels, rate, bits)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"{filepath} has no fmt chunk.")
+                offset = f.tell()
+                break
+            else:
+                # Chunks are padded to an even size.
+                f.seek(size + (size & 1), 1)
+
+    format_tag, channels, rate, bits = fmt
+    dtype = sample_dtype(format_tag, bits)
+    frames = size // (dtype.itemsize * channels)
+    if frames == 0:
+        raise ValueError(f"{filepath} has no samples.")
+    samples = np.memmap(filepath, dtype=dtype, mode="r", offset=offset,
+                        shape=(frames, channels))
+    return WavAudio(samples, rate, format_tag)
+
+
+def beep(audio: WavAudio, frames: int) -> "np.ndarray":
+    """
+    :returns: A BEEP_FREQUENCY sine wave in the sample format of audio.
+    """
+    dtype = audio.samples.dtype
+    t = np.arange(frames) / audio.rate
+    sine = BEEP_AMPLITUDE * np.sin(2 * np.pi * BEEP_FREQUENCY * t)
+    if dtype.kind == "u":
+        # 8 bit WAV is unsigned around 128.
+        tone = 128 + sine * 127
+    else:
+        tone = sine * np.iinfo(dtype).max
+    channels = audio.samples.shape[1]
+    return np.repeat(tone.astype(dtype)[:, None], channels, axis=1)
+
+
+def write_wav(filepath: str, audio: WavAudio, *parts: "np.ndarray") -> None:
+    """Write the concatenated sample arrays as a WAV file in the format
+    of audio.
+    """
+    with wave.open(filepath, "wb") as w:
+        w.setnchannels(audio.samples.shape[1])
+        w.setsampwidth(audio.samples.dtype.itemsize)
+        w.setframerate(audio.rate)
+        for part in parts:
+            w.writeframes(np.ascontiguousarray(part).tobytes())
+
+
+def cloze_bounds(cloze_start: float, cloze_end: float,
+                 extract_length: float) -> Tuple[float, float]:
+    """Extend the output cloze slightly to improve audio.
+
+    :returns: (start, end) of the cloze file in the extract.
+    """
+    output_cloze_start = cloze_start
+    output_cloze_end = cloze_end
+    if cloze_start > 0.3:
+        output_cloze_start -= 0.3
+    if cloze_end + 0.3 < extract_length:
+        output_cloze_end += 0.3
+    return output_cloze_start, output_cloze_end
+
+
+def write_cloze(audio: WavAudio, extract_length: float,
+                cloze_start: float, cloze_end: float,
+                question_fp: str, cloze_fp: str) -> None:
+    """Write the question and cloze files of one cloze.
+
+    :extract_length: Seconds of the extract to use, like the atrim end
+    of the ffmpeg renderer.
+    """
+    samples = audio.samples
+    rate = audio.rate
+
+    def frame(seconds: float) -> int:
+        return min(max(int(round(seconds * rate)), 0), len(samples))
+
+    end = frame(extract_length)
+    start_frame, end_frame = frame(cloze_start), frame(cloze_end)
+    write_wav(question_fp, audio,
+              samples[:start_frame],
+              beep(audio, end_frame - start_frame),
+              samples[end_frame:end])
+
+    output_start, output_end = cloze_bounds(cloze_start, cloze_end,
+                                            extract_length)
+    write_wav(cloze_fp, audio, samples[frame(output_start):frame(output_end)])
+
+
+def render_clozes_wav(extract_fp: str, extract_length: float,
+                      clozes: List[Tuple[float, float, str, str]]) -> None:
+    """Write the question and cloze files of several clozes of one PCM
+    WAV extract, mapping the extract only once.
+
+    :clozes: (cloze start, cloze end, question filepath, cloze filepath)
+    :raises ValueError: If the extract is not a supported WAV file.
+    """
+    audio = read_wav(extract_fp)
+    for cloze_start, cloze_end, question_fp, cloze_fp in clozes:
+        write_cloze(audio, extract_length, cloze_start, cloze_end,
+                    question_fp, cloze_fp)
+
+
+def render_cloze_wav(extract_fp: str, extract_length: float,
+                     cloze_start: float, cloze_end: float,
+                     question_fp: str, cloze_fp: str) -> None:
+    """Write the question and cloze files of a PCM WAV extract.
+
+    :raises ValueError: If the extract is not a supported WAV file.
+    """
+    render_clozes_wav(extract_fp, extract_length,
+                      [(cloze_start, cloze_end, question_fp, cloze_fp)])
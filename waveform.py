@@ -0,0 +1,270 @@
+"""Background computation of the waveform peaks of audio files, see
+peak_index.py.
+
+Every file is decoded once. PCM WAV files, ie. rendered extracts and
+questions, are memory-mapped with NumPy. Anything else is decoded to
+mono 16 bit PCM by a low priority ffmpeg and read from its stdout in
+blocks, so a multi-hour topic is never held in memory. The min/max
+reduction and the mipmapping are vectorized with NumPy.
+
+A PeakIndexer spreads the files over a process pool. AudioDownloader
+submits every new TopicFile, the RenderPool callback every rendered
+extract and item file and rerate_topics every converted topic. Run this
+script to index the files added before that, or all of them with
+--rebuild:
+
+    python waveform.py [--rebuild]
+"""
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from subprocess import DEVNULL, PIPE
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from peak_index import (peaks_filepath, samples_per_peak, load_index,
+                        level0, quantize, save_peaks, PEAK_BITS)
+import wav_cloze
+from renderer import priority_prefix
+from models import session, TopicFile, ExtractFile, ItemFile
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter("%(levelname)s:%(name)s:%(funcName)s():"
+                              "%(message)s")
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+
+file_handler = logging.FileHandler("waveform.log")
+file_handler.setFormatter(formatter)
+
+logger.addHandler(file_handler)
+logger.addHandler(console_handler)
+
+# Concurrent indexing processes.
+PEAK_WORKERS = 2
+# nice(1) niceness of the decoding ffmpeg.
+PEAK_NICENESS = 10
+# Sample rate ffmpeg decodes to. The peaks only need the envelope.
+DECODE_RATE = 8000
+# Level 0 peaks reduced per block of samples.
+BLOCK_PEAKS = 4096
+
+
+def decode_command(filepath: str) -> List[str]:
+    """ffmpeg command writing the audio of filepath to stdout as mono 16
+    bit little endian PCM at DECODE_RATE.
+    """
+    return ['ffmpeg',
+            '-nostdin',
+            '-loglevel', 'error',
+            '-i', filepath,
+            '-vn',
+            '-ac', '1',
+            '-ar', str(DECODE_RATE),
+            '-f', 's16le',
+            '-']
+
+
+def pcm_blocks(stream: BinaryIO, frames: int) -> Iterator["np.ndarray"]:
+    """Read 16 bit little endian mono samples from stream in blocks.
+    """
+    while True:
+        data = stream.read(frames * 2)
+        if not data:
+            return
+        yield np.frombuffer(data[:len(data) - len(data) % 2], dtype="<i2")
+
+
+def wav_peaks(filepath: str) -> Optional[Tuple[int, int, "np.ndarray",
+                                                "np.ndarray"]]:
+    """Peaks of a PCM WAV file, memory-mapped instead of decoded.
+
+    :returns: (sample rate, samples per peak, mins, maxs) or None if the
+    file is not a WAV file wav_cloze can map.
+    """
+    try:
+        audio = wav_cloze.read_wav(filepath)
+    except ValueError:
+        return None
+    per_peak = samples_per_peak(audio.rate)
+    frames = per_peak * BLOCK_PEAKS
+    samples = audio.samples
+    mins, maxs = level0((samples[i:i + frames]
+                         for i in range(0, len(samples), frames)), per_peak)
+    return audio.rate, per_peak, mins, maxs
+
+
+def ffmpeg_peaks(filepath: str, niceness: int
+                 ) -> Tuple[int, int, "np.ndarray", "np.ndarray"]:
+    """Peaks of any audio file ffmpeg can decode.
+
+    :returns: (sample rate, samples per peak, mins, maxs)
+    :raises ValueError: If ffmpeg fails.
+    """
+    per_peak = samples_per_peak(DECODE_RATE)
+    process = subprocess.Popen(priority_prefix(niceness) +
+                               decode_command(filepath),
+                               stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+    with process:
+        try:
+            mins, maxs = level0(pcm_blocks(process.stdout,
+                                           per_peak * BLOCK_PEAKS),
+                                per_peak)
+        except ValueError:
+            mins = maxs = None
+        stderr = process.stderr.read().decode(errors='replace').strip()
+    if process.returncode != 0:
+        raise ValueError(f"ffmpeg exited with {process.returncode}: "
+                         f"{stderr}")
+    if mins is None:
+        raise ValueError(f"{filepath} has no audio.")
+    return DECODE_RATE, per_peak, mins, maxs
+
+
+def index_file(filepath: str, niceness: int = PEAK_NICENESS,
+               bits: int = PEAK_BITS) -> Tuple[int, str]:
+    """Compute and save the peaks of an audio file.
+
+    Runs in a PeakIndexer worker process.
+
+    :returns: (exit code, error message).
+    """
+    if np is None:
+        return -1, "NumPy is not installed."
+    try:
+        stat = os.stat(filepath)
+        peaks = None
+        if filepath.lower().endswith(".wav"):
+            peaks = wav_peaks(filepath)
+        if peaks is None:
+            peaks = ffmpeg_peaks(filepath, niceness)
+        rate, per_peak, mins, maxs = peaks
+        save_peaks(peaks_filepath(filepath),
+                   (stat.st_mtime_ns, stat.st_size), rate, per_peak,
+                   quantize(mins, bits), quantize(maxs, bits))
+    except (OSError, ValueError) as e:
+        return -1, str(e)
+    return 0, ""
+
+
+class PeakIndexer(object):
+
+    """Process pool computing the peaks of audio files in the background.
+    """
+
+    def __init__(self,
+                 workers: int = PEAK_WORKERS,
+                 niceness: int = PEAK_NICENESS):
+        """
+        :workers: Maximum number of files indexed at once.
+        :niceness: CPU niceness of ffmpeg.
+        """
+        self.workers = workers
+        self.niceness = niceness
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, filepath: str) -> "Future[Tuple[int, str]]":
+        """Start indexing filepath. Failures are logged.
+
+        Safe to call from any thread.
+
+        :returns: Future of (exit code, error message).
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers)
+            future = self._executor.submit(index_file, filepath,
+                                           self.niceness)
+        future.add_done_callback(
+                lambda done: self.log_result(filepath, done))
+        return future
+
+    @staticmethod
+    def log_result(filepath: str, future: Future) -> None:
+        error = future.exception()
+        if error is None:
+            returncode, error = future.result()
+            if returncode == 0:
+                logger.info(f"Indexed the peaks of {filepath}.")
+                return
+        logger.error(f"Indexing the peaks of {filepath} failed: {error}")
+
+    def shutdown(self) -> None:
+        """Wait for running indexing and stop the worker processes.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# Shared by the downloader, the render pool and rerate_topics.
+peak_indexer = PeakIndexer()
+
+
+def audio_filepaths() -> List[str]:
+    """
+    :returns: Audio files of undeleted TopicFiles, and of the rendered
+    ExtractFiles and ItemFile questions, that exist.
+    """
+    queries = [
+        (session
+         .query(TopicFile.filepath)
+         .filter(TopicFile.deleted.isnot(True))
+         .filter(TopicFile.downloaded == True)),
+        (session
+         .query(ExtractFile.filepath)
+         .filter(ExtractFile.deleted.isnot(True))
+         .filter(ExtractFile.playable_condition())),
+        (session
+         .query(ItemFile.question_filepath)
+         .filter(ItemFile.deleted.isnot(True))
+         .filter(ItemFile.question_filepath != None)
+         .filter(ItemFile.playable_condition())),
+    ]
+    return [filepath
+            for query in queries
+            for filepath, in query
+            if filepath and os.path.isfile(filepath)]
+
+
+def index_files(rebuild: bool = False,
+                indexer: Optional[PeakIndexer] = None) -> Dict:
+    """Index the audio files without up to date peaks in parallel.
+
+    :rebuild: Reindex every file.
+    :returns: Report of the run.
+    """
+    filepaths = [filepath for filepath in audio_filepaths()
+                 if rebuild or load_index(filepath) is None]
+    own_indexer = indexer is None
+    indexer = indexer or PeakIndexer()
+    report = {"files": len(filepaths), "indexed": 0, "failed": 0}
+    try:
+        futures = [indexer.submit(filepath) for filepath in filepaths]
+        for future in as_completed(futures):
+            if future.exception() is None and future.result()[0] == 0:
+                report["indexed"] += 1
+            else:
+                report["failed"] += 1
+    finally:
+        if own_indexer:
+            indexer.shutdown()
+    logger.info(f"Indexed the peaks of {report['indexed']} of "
+                f"{report['files']} files.")
+    return report
+
+
+if __name__ == "__main__":
+    index_files(rebuild="--rebuild" in sys.argv)